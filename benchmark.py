@@ -0,0 +1,404 @@
+# Нагрузочный тест бота: реальные обработчики telegramm.py против локального
+# фейкового Telegram Bot API и синтетического потока обновлений.
+#
+# Пример:
+#   python benchmark.py --users 20 --rate 200 --duration 30
+#   python benchmark.py --db big.db --sessions 5 --compare bench_results/old.json
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BENCH_TOKEN = "123456:BENCHMARK"
+BENCH_ADMIN_ID = 1
+BENCH_SUPPORT_CHAT_ID = -1001
+FIRST_USER_ID = 100000
+TICKET_RE = re.compile(r"#([A-Z0-9]{6,})")
+BOT_USER = {"id": 999, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+# Фейковый Telegram Bot API: отвечает на все методы и запоминает отправленные сообщения
+class FakeTelegramAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), FakeTelegramRequestHandler)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.message_id = 0
+        self.calls = {}
+        self.last_texts = {}
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/bot{{0}}/{{1}}"
+
+    def handle_method(self, method: str, params: dict):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.message_id += 1
+            message_id = self.message_id
+            chat_id = params.get("chat_id")
+            if chat_id is not None and "text" in params:
+                self.last_texts.setdefault(int(chat_id), []).append(params["text"])
+                del self.last_texts[int(chat_id)][:-20]
+
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": int(chat_id or 0), "type": "private"},
+                "text": params.get("text", "")
+            }
+        return True
+
+    def last_ticket_id(self, chat_id: int):
+        with self.lock:
+            for text in reversed(self.last_texts.get(chat_id, [])):
+                match = TICKET_RE.search(text)
+                if match:
+                    return match.group(1)
+        return None
+
+class FakeTelegramRequestHandler(BaseHTTPRequestHandler):
+    def _handle(self):
+        url = urlsplit(self.path)
+        method = url.path.rsplit("/", 1)[-1]
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length)
+            if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                params.update(parse_qsl(body.decode("utf-8")))
+        result = self.server.handle_method(method, params)
+        payload = json.dumps({"ok": True, "result": result}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+# Равномерная подача обновлений с заданной общей частотой (0 - без ограничения)
+class Pacer:
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_at = time.perf_counter()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.perf_counter()
+            scheduled = max(self.next_at, now)
+            self.next_at = scheduled + self.interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(values, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0
+    }
+
+class Benchmark:
+    def __init__(self, bot_module, api: FakeTelegramAPI, args):
+        self.tg = bot_module
+        self.api = api
+        self.args = args
+        self.pacer = Pacer(args.rate)
+        self.admin_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.update_id = 0
+        self.latencies = {}
+        self.failures = 0
+        self.deadline = None
+
+    def _next_update_id(self) -> int:
+        with self.lock:
+            self.update_id += 1
+            return self.update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"Пользователь {user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        update_id = self._next_update_id()
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text
+            }
+        }
+
+    def _callback(self, user_id: int, data: str) -> dict:
+        update_id = self._next_update_id()
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "menu",
+                    "reply_markup": {"inline_keyboard": [[{"text": "menu", "callback_data": "back_to_main"}]]}
+                }
+            }
+        }
+
+    def send(self, step: str, update: dict):
+        self.pacer.wait()
+        parsed = self.tg.types.Update.de_json(update)
+        started = time.perf_counter()
+        try:
+            self.tg.bot.process_new_updates([parsed])
+        except Exception:
+            with self.lock:
+                self.failures += 1
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.latencies.setdefault(step, []).append(elapsed)
+
+    # Сценарий одного пользователя: старт, просмотр категорий, заявка, комментарий, ответ админа, оценка
+    def run_session(self, user_id: int):
+        self.send("start", self._message(user_id, "/start"))
+        self.send("browse", self._callback(user_id, "cat_internet"))
+        self.send("browse", self._callback(user_id, "subcat_internet_slow"))
+        self.send("create_ticket", self._callback(user_id, "new_ticket_cat_internet"))
+        self.send("create_ticket", self._message(user_id, "Интернет работает очень медленно, роутер перезагружал"))
+
+        ticket_id = self.api.last_ticket_id(user_id)
+        if not ticket_id:
+            with self.lock:
+                self.failures += 1
+            return
+
+        self.send("my_requests", self._callback(user_id, "my_requests"))
+        self.send("view_ticket", self._callback(user_id, f"request_{ticket_id}"))
+        self.send("comment", self._callback(user_id, f"comment_{ticket_id}"))
+        self.send("comment", self._message(user_id, "Проблема сохраняется после перезагрузки"))
+
+        # Администратор один, поэтому его диалоги выполняются последовательно
+        with self.admin_lock:
+            self.send("admin_view", self._callback(BENCH_ADMIN_ID, f"admin_ticket_chat_{ticket_id}"))
+            self.send("admin_reply", self._callback(BENCH_ADMIN_ID, f"admin_reply_{ticket_id}"))
+            self.send("admin_reply", self._message(BENCH_ADMIN_ID, "Проверьте, пожалуйста, подключение по кабелю"))
+            self.send("admin_resolve", self._callback(BENCH_ADMIN_ID, f"admin_resolve_{ticket_id}"))
+
+        self.send("rate", self._callback(user_id, f"rate_{ticket_id}_5"))
+
+    def run_user(self, user_id: int):
+        completed = 0
+        while True:
+            if self.deadline and time.perf_counter() >= self.deadline:
+                break
+            if not self.deadline and completed >= self.args.sessions:
+                break
+            self.run_session(user_id)
+            completed += 1
+
+    def run(self) -> dict:
+        retries_before = self.tg.metrics.counter_total("bot_db_lock_retries_total")
+        lock_errors_before = self.tg.metrics.counter_total("bot_db_lock_errors_total")
+        handler_errors_before = self.tg.metrics.counter_total("bot_handler_errors_total")
+        acks_before = self.tg.metrics.histogram_total("bot_callback_ack_seconds")
+
+        started = time.perf_counter()
+        if self.args.duration:
+            self.deadline = started + self.args.duration
+        threads = [
+            threading.Thread(target=self.run_user, args=(FIRST_USER_ID + i,), daemon=True)
+            for i in range(self.args.users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - started
+        # Отложенные уведомления доставляются до подсчета вызовов API
+        self.tg.notification_digest.flush(force=True)
+        # Подтверждения callback-запросов отправляются потоками бота: дожидаемся очереди
+        drain_deadline = time.monotonic() + 10
+        while self.tg.callback_acks.pending() and time.monotonic() < drain_deadline:
+            time.sleep(0.01)
+        ack_count, ack_sum = self.tg.metrics.histogram_total("bot_callback_ack_seconds")
+
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "config": {
+                "users": self.args.users,
+                "rate": self.args.rate,
+                "duration": self.args.duration,
+                "sessions": self.args.sessions,
+                "api_latency_ms": self.args.api_latency,
+                "db": self.args.db
+            },
+            "wall_time_s": round(wall_time, 3),
+            "updates": len(all_latencies),
+            "throughput_ups": round(len(all_latencies) / wall_time, 2) if wall_time else 0.0,
+            "failures": self.failures,
+            "latency": summarize(all_latencies),
+            "latency_by_step": {step: summarize(values) for step, values in sorted(self.latencies.items())},
+            "db_contention": {
+                "lock_retries": self.tg.metrics.counter_total("bot_db_lock_retries_total") - retries_before,
+                "lock_errors": self.tg.metrics.counter_total("bot_db_lock_errors_total") - lock_errors_before
+            },
+            "handler_errors": self.tg.metrics.counter_total("bot_handler_errors_total") - handler_errors_before,
+            "callback_acks": {
+                "count": ack_count - acks_before[0],
+                "mean_ms": round((ack_sum - acks_before[1]) / (ack_count - acks_before[0]) * 1000, 3)
+                if ack_count > acks_before[0] else 0.0,
+                "pending": self.tg.callback_acks.pending()
+            },
+            "api_calls": dict(sorted(self.api.calls.items()))
+        }
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+def print_report(result: dict, baseline: dict = None):
+    def delta(path, value):
+        if not baseline:
+            return ""
+        old = baseline
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+        if not isinstance(old, (int, float)) or not old:
+            return ""
+        return f" ({(value - old) / old:+.1%})"
+
+    print(f"Обновлений: {result['updates']} за {result['wall_time_s']} с, ошибок: {result['failures']}")
+    print(f"Пропускная способность: {result['throughput_ups']} обн/с{delta(['throughput_ups'], result['throughput_ups'])}")
+    print(f"{'шаг':<16}{'кол-во':>8}{'p50, мс':>12}{'p90, мс':>12}{'p99, мс':>12}{'max, мс':>12}")
+    rows = [("всего", result["latency"], ["latency"])] + [
+        (step, stats, ["latency_by_step", step]) for step, stats in result["latency_by_step"].items()
+    ]
+    for step, stats, path in rows:
+        print(
+            f"{step:<16}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p90_ms']:>12}"
+            f"{stats['p99_ms']:>12}{stats['max_ms']:>12}{delta(path + ['p99_ms'], stats['p99_ms'])}"
+        )
+    print(f"Блокировки БД: повторов {result['db_contention']['lock_retries']}, "
+          f"ошибок {result['db_contention']['lock_errors']}")
+    acks = result["callback_acks"]
+    print(f"Подтверждения callback: {acks['count']}, в среднем {acks['mean_ms']} мс"
+          f"{delta(['callback_acks', 'mean_ms'], acks['mean_ms'])}, в очереди {acks['pending']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота поддержки")
+    parser.add_argument("--users", type=int, default=10, help="число одновременных пользователей")
+    parser.add_argument("--rate", type=float, default=0, help="общая частота обновлений в секунду (0 - без ограничения)")
+    parser.add_argument("--duration", type=float, default=0, help="длительность теста в секундах")
+    parser.add_argument("--sessions", type=int, default=3, help="сценариев на пользователя, если не задана длительность")
+    parser.add_argument("--api-latency", type=float, default=0, help="искусственная задержка фейкового API, мс")
+    parser.add_argument("--db", help="исходная база данных (копируется, оригинал не изменяется)")
+    parser.add_argument("--output", help="путь к JSON с результатами")
+    parser.add_argument("--compare", help="JSON предыдущего запуска для сравнения")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bot_bench_")
+    db_path = os.path.join(workdir, "support_bot.db")
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+
+    api = FakeTelegramAPI(latency=args.api_latency / 1000)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "ADMIN_ID": str(BENCH_ADMIN_ID),
+        "SUPPORT_CHAT_ID": str(BENCH_SUPPORT_CHAT_ID),
+        "DB_PATH": db_path,
+        "METRICS_PORT": "0"
+    })
+    output = os.path.abspath(args.output) if args.output else os.path.abspath(
+        os.path.join("bench_results", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    )
+    if args.compare:
+        args.compare = os.path.abspath(args.compare)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(workdir)  # Логи и отчеты бота пишутся во временный каталог
+
+    import telegramm
+    telegramm.apihelper.API_URL = api.api_url
+    telegramm.init_database()
+    # Обновления обрабатываются синхронно в потоках теста, чтобы измерять полную задержку
+    telegramm.bot.threaded = False
+    # Сценарии выполняют действия пользователя без пауз, ограничения частоты их бы отбрасывали
+    telegramm.rate_limiter.limits = {}
+    telegramm.ticket_quota.limit = 0
+    # Оповещения о заявках отправляются сразу независимо от времени запуска
+    telegramm.CONFIG["SUPPORT_HOURS"] = {"start": 0, "end": 24}
+    # Подтверждения callback-запросов, как в боте, отправляют отдельные потоки
+    for _ in range(telegramm.CONFIG["CALLBACK_ACK_THREADS"]):
+        threading.Thread(target=telegramm.callback_acks.run, daemon=True).start()
+
+    try:
+        result = Benchmark(telegramm, api, args).run()
+    finally:
+        api.shutdown()
+        telegramm.stop_logging(telegramm.log_listener)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"Результаты сохранены: {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+# Выгрузка заявок с перепиской и данными пользователей для аналитики (CSV или JSONL, gzip).
+# Использует те же настройки, что и бот (.env: DB_PATH или STORAGE_BACKEND/POSTGRES_DSN),
+# и может запускаться рядом с работающим ботом: запись в базу не блокируется.
+#
+# Пример:
+#   python export_tickets.py
+#   python export_tickets.py --format jsonl --since-days 30 --output tickets.jsonl.gz
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка заявок бота поддержки")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv", help="формат файла (по умолчанию csv)")
+    parser.add_argument("--since-days", type=int, help="только заявки, созданные за последние N дней")
+    parser.add_argument("--output", help="путь к файлу (по умолчанию tickets_ГГГГММДД_ЧЧММ.<формат>.gz)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import telegramm
+
+    output = args.output or f"tickets_{datetime.now(telegramm.MOSCOW_TZ).strftime('%Y%m%d_%H%M')}.{args.format}.gz"
+    since = telegramm.epoch_cutoff(days=args.since_days) if args.since_days is not None else None
+    try:
+        started = time.perf_counter()
+        tickets, messages = telegramm.export_tickets(output, args.format, since)
+        size_mb = os.path.getsize(output) / (1024 * 1024)
+        print(f"Заявок: {tickets}, сообщений: {messages}")
+        print(f"Файл: {output} ({size_mb:.1f} МБ) за {time.perf_counter() - started:.1f} с")
+    finally:
+        telegramm.stop_logging(telegramm.log_listener)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+# Генератор большой синтетической базы support_bot.db для тестов производительности запросов и индексов.
+#
+# Пример:
+#   python generate_dataset.py --db big.db --rows 10000000 --seed 42
+#   python generate_dataset.py --db small.db --users 1000 --requests 20000 --messages 100000
+import argparse
+import array
+import itertools
+import math
+import os
+import random
+import sqlite3
+import sys
+import time
+
+# Доли строк по таблицам при задании общего объема через --rows
+TABLE_SHARES = {
+    "users": 0.02,
+    "requests": 0.15,
+    "request_messages": 0.70,
+    "feedback": 0.03,
+    "notifications": 0.10
+}
+
+STATUS_WEIGHTS = {"Закрыто": 55, "Решено": 15, "Открыто": 15, "Отменено": 10, "Отклонено": 5}
+PRIORITY_WEIGHTS = {"Низкий": 20, "Средний": 55, "Высокий": 20, "Критический": 5}
+
+# Нагрузка по часам суток (МСК): пики утром и после обеда, провал ночью
+HOUR_WEIGHTS = [1, 1, 1, 1, 1, 2, 4, 8, 14, 20, 22, 21, 18, 17, 19, 20, 18, 15, 12, 10, 8, 6, 4, 2]
+MSK_OFFSET = 3 * 3600
+
+FIRST_NAMES = [
+    "Александр", "Мария", "Дмитрий", "Анна", "Сергей", "Елена", "Андрей", "Ольга", "Алексей", "Наталья",
+    "Иван", "Татьяна", "Михаил", "Екатерина", "Павел", "Юлия", "Николай", "Светлана", "Артём", "Ирина"
+]
+LAST_NAMES = [
+    "Иванов", "Смирнова", "Кузнецов", "Попова", "Васильев", "Петрова", "Соколов", "Михайлова",
+    "Новиков", "Федорова", "Морозов", "Волкова", "Алексеев", "Лебедева", None, None
+]
+WORDS = (
+    "интернет роутер соединение скорость пропадает сигнал ноутбук телефон приложение ошибка экран "
+    "перезагрузка драйвер обновление батарея зарядка медленно работает после вчера сегодня снова "
+    "проверил пробовал помогло не помогло кабель провайдер wi-fi настройки пароль система синий "
+    "компьютер память диск вирус очистка уведомление заявка пожалуйста подскажите спасибо срочно "
+    "постоянно иногда вечером утром сеть подключение модем канал прошивка температура процессор"
+).split()
+ADMIN_REPLIES = [
+    "Здравствуйте! Проверьте, пожалуйста, подключение по кабелю.",
+    "Попробуйте перезагрузить устройство и сообщите результат.",
+    "Мы передали вашу заявку специалисту, ожидайте ответа.",
+    "Обновите драйверы сетевой карты и проверьте снова.",
+    "Уточните, пожалуйста, модель устройства и версию системы.",
+    "Проблема на стороне провайдера, работы будут завершены сегодня."
+]
+FEEDBACK_COMMENTS = [
+    "Спасибо, все заработало!", "Долго ждал ответа", "Отличная поддержка", "Проблема решена не до конца",
+    "Быстро и понятно", None, None, None
+]
+
+class DatasetGenerator:
+    def __init__(self, db_path: str, counts: dict, seed: int, days: int, batch_size: int):
+        self.db_path = db_path
+        self.counts = counts
+        self.rng = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.end = time.time()
+        self.start = (int(self.end) // 86400 - days) * 86400  # Полночь UTC
+        self.inserted = {}
+
+        # Заранее подготовленные тексты: генерация строк на каждую запись слишком дорога
+        self.sentences = [self._sentence(4, 25) for _ in range(5000)]
+        self.problems = [self._sentence(8, 60) for _ in range(5000)]
+
+        # Пользователи с распределением Ципфа: небольшая доля пользователей создает большую часть заявок
+        self.user_ids = [200000000 + i for i in range(counts["users"])]
+        self.user_cum_weights = list(itertools.accumulate(1 / (i + 1) ** 0.9 for i in range(counts["users"])))
+
+        # Всплески нагрузки: в отдельные дни заявок в несколько раз больше
+        day_weights = [5.0 if self.rng.random() < 0.05 else 1.0 for _ in range(days)]
+        self.day_cum_weights = list(itertools.accumulate(day_weights))
+        self.hour_cum_weights = list(itertools.accumulate(HOUR_WEIGHTS))
+
+        self.user_requests = [0] * counts["users"]
+        self.user_solved = [0] * counts["users"]
+        self.user_last_activity = [0.0] * counts["users"]
+
+    def _sentence(self, min_words: int, max_words: int) -> str:
+        words = self.rng.choices(WORDS, k=self.rng.randint(min_words, max_words))
+        return " ".join(words).capitalize() + "."
+
+    def _timestamps(self, k: int) -> list:
+        days = self.rng.choices(range(self.days), cum_weights=self.day_cum_weights, k=k)
+        hours = self.rng.choices(range(24), cum_weights=self.hour_cum_weights, k=k)
+        rnd = self.rng.random
+        return [self.start + day * 86400 + hour * 3600 - MSK_OFFSET + rnd() * 3600 for day, hour in zip(days, hours)]
+
+    def _insert(self, conn, table: str, sql: str, rows):
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                conn.executemany(sql, batch)
+                count += len(batch)
+                batch.clear()
+                if count % (self.batch_size * 10) == 0:
+                    conn.commit()
+                    print(f"  {table}: {count:,}", flush=True)
+        if batch:
+            conn.executemany(sql, batch)
+            count += len(batch)
+        conn.commit()
+        self.inserted[table] = count
+        return count
+
+    def _request_rows(self):
+        rng = self.rng
+        statuses = list(STATUS_WEIGHTS)
+        status_cw = list(itertools.accumulate(STATUS_WEIGHTS.values()))
+        priorities = list(PRIORITY_WEIGHTS)
+        priority_cw = list(itertools.accumulate(PRIORITY_WEIGHTS.values()))
+        total = self.counts["requests"]
+        request_id = 0
+
+        while request_id < total:
+            k = min(self.batch_size, total - request_id)
+            users = rng.choices(range(len(self.user_ids)), cum_weights=self.user_cum_weights, k=k)
+            created = self._timestamps(k)
+            status_list = rng.choices(statuses, cum_weights=status_cw, k=k)
+            priority_list = rng.choices(priorities, cum_weights=priority_cw, k=k)
+            for user_index, created_at, status, priority in zip(users, created, status_list, priority_list):
+                request_id += 1
+                category = rng.choice(self.categories)
+                updated_at = min(created_at + rng.expovariate(1 / 14400), self.end)
+                response_time = int(rng.expovariate(1 / 30)) + 1 if status != "Открыто" else None
+                rating = None
+                if status in ("Решено", "Закрыто") and rng.random() < 0.4:
+                    rating = rng.choices((1, 2, 3, 4, 5), weights=(5, 5, 10, 30, 50))[0]
+                    self.rated.append((request_id, self.user_ids[user_index], rating, updated_at))
+
+                self.user_requests[user_index] += 1
+                if status == "Решено":
+                    self.user_solved[user_index] += 1
+                if updated_at > self.user_last_activity[user_index]:
+                    self.user_last_activity[user_index] = updated_at
+                self.request_users.append(user_index)
+                self.request_created.append(created_at)
+                self.request_updated.append(updated_at)
+
+                yield (
+                    request_id, f"{request_id:08X}", self.user_ids[user_index], category,
+                    rng.choice(self.problems), status, priority, int(created_at), int(updated_at),
+                    response_time, rating
+                )
+
+    # Длинные ветки переписки: логнормальное распределение длины со средним messages/requests
+    def _message_rows(self):
+        rng = self.rng
+        total = self.counts["messages"]
+        requests = len(self.request_users)
+        if not requests:
+            return
+        mean = max(total / requests, 0.01)
+        sigma = 1.2
+        mu = math.log(mean) - sigma ** 2 / 2
+        produced = 0
+        message_id = 0
+        for request_index in range(requests):
+            if produced >= total:
+                break
+            user_index = self.request_users[request_index]
+            created_at = self.request_created[request_index]
+            updated_at = self.request_updated[request_index]
+            length = min(int(rng.lognormvariate(mu, sigma) + 0.5), 1000, total - produced)
+            if request_index == requests - 1:
+                length = total - produced
+            sent_at = created_at
+            step = max((updated_at - created_at) / (length + 1), 30)
+            user_id = self.user_ids[user_index]
+            for i in range(length):
+                message_id += 1
+                sent_at += rng.random() * step * 2
+                from_admin = i % 2 == 1
+                yield (
+                    message_id, request_index + 1,
+                    self.admin_id if from_admin else user_id,
+                    rng.choice(ADMIN_REPLIES) if from_admin else rng.choice(self.sentences),
+                    int(sent_at),
+                    1 if from_admin and rng.random() < 0.02 else 0
+                )
+            produced += length
+
+    def _feedback_rows(self):
+        rng = self.rng
+        total = self.counts["feedback"]
+        for i, (request_id, user_id, rating, rated_at) in enumerate(self.rated):
+            if i >= total:
+                break
+            yield (request_id, user_id, rating, rng.choice(FEEDBACK_COMMENTS), int(rated_at + rng.random() * 3600))
+
+    def _notification_rows(self):
+        rng = self.rng
+        total = self.counts["notifications"]
+        templates = (
+            "📨 Получен ответ на вашу заявку #{}",
+            "✅ Ваша заявка #{} решена!",
+            "✅ Ваша заявка #{} была закрыта.",
+            "Ваша заявка #{} была автоматически закрыта из-за неактивности."
+        )
+        requests = len(self.request_users)
+        produced = 0
+        while produced < total and requests:
+            k = min(self.batch_size, total - produced)
+            for request_index in rng.choices(range(requests), k=k):
+                created_at = self.request_created[request_index]
+                updated_at = self.request_updated[request_index]
+                notified_at = created_at + rng.random() * max(updated_at - created_at, 60)
+                yield (
+                    self.user_ids[self.request_users[request_index]],
+                    rng.choice(templates).format(f"{request_index + 1:08X}"),
+                    1 if rng.random() < 0.3 else 0,
+                    int(notified_at)
+                )
+            produced += k
+
+    def _user_rows(self):
+        rng = self.rng
+        for index, user_id in enumerate(self.user_ids):
+            registered = self.start + rng.random() * self.days * 86400 * 0.5
+            last_activity = self.user_last_activity[index] or registered
+            yield (
+                user_id, f"user{user_id}" if rng.random() < 0.8 else None,
+                rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), int(registered), int(last_activity),
+                self.user_requests[index], self.user_solved[index]
+            )
+
+    def generate(self, categories: list, admin_id: int):
+        self.categories = categories
+        self.admin_id = admin_id
+        # Компактное хранение метаданных заявок для генерации связанных таблиц
+        self.request_users = array.array("l")
+        self.request_created = array.array("d")
+        self.request_updated = array.array("d")
+        self.rated = []
+
+        conn = sqlite3.connect(self.db_path)
+        # Режим массовой загрузки: база строится заново, поэтому журнал и fsync не нужны
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA locking_mode = EXCLUSIVE")
+        conn.execute("PRAGMA cache_size = -262144")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+        started = time.perf_counter()
+        # Вторичные индексы схемы бота снимаются на время загрузки и строятся заново по
+        # готовым данным: один проход сортировки быстрее обновления индекса на каждой вставке.
+        # Индексы ограничений (PRIMARY KEY, UNIQUE в CREATE TABLE) остаются: у них нет sql
+        indexes = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"
+        ).fetchall()
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+        self._insert(conn, "requests", """
+            INSERT INTO requests (id, ticket_id, user_id, category, problem, status, priority,
+                                  created_at, last_update, response_time, satisfaction_rating)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, self._request_rows())
+        self._insert(conn, "request_messages", """
+            INSERT INTO request_messages (id, request_id, sender_id, message_text, sent_at, is_internal)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, self._message_rows())
+        self._insert(conn, "feedback", """
+            INSERT INTO feedback (request_id, user_id, rating, comment, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, self._feedback_rows())
+        self._insert(conn, "notifications", """
+            INSERT INTO notifications (user_id, message, is_read, created_at)
+            VALUES (?, ?, ?, ?)
+        """, self._notification_rows())
+        self._insert(conn, "users", """
+            INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, registration_date,
+                                          last_activity, requests_count, solved_issues)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, self._user_rows())
+        for _, sql in indexes:
+            conn.execute(sql)
+        conn.execute("ANALYZE")
+        conn.commit()
+        conn.close()
+        return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетической базы данных бота поддержки")
+    parser.add_argument("--db", required=True, help="путь к создаваемой базе данных")
+    parser.add_argument("--rows", type=int, default=1000000, help="общее число строк во всех таблицах")
+    parser.add_argument("--users", type=int, help="число пользователей")
+    parser.add_argument("--requests", type=int, help="число заявок")
+    parser.add_argument("--messages", type=int, help="число сообщений в заявках")
+    parser.add_argument("--feedback", type=int, help="число отзывов (не больше числа оцененных заявок)")
+    parser.add_argument("--notifications", type=int, help="число уведомлений")
+    parser.add_argument("--days", type=int, default=365, help="период, за который распределяются заявки")
+    parser.add_argument("--seed", type=int, default=42, help="зерно генератора случайных чисел")
+    parser.add_argument("--batch-size", type=int, default=50000, help="строк в одном executemany")
+    parser.add_argument("--force", action="store_true", help="перезаписать существующий файл")
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        if not args.force:
+            print(f"❌ Файл {args.db} уже существует. Используйте --force для перезаписи.")
+            sys.exit(1)
+        os.remove(args.db)
+
+    counts = {
+        "users": args.users or max(1, int(args.rows * TABLE_SHARES["users"])),
+        "requests": args.requests or int(args.rows * TABLE_SHARES["requests"]),
+        "messages": args.messages if args.messages is not None else int(args.rows * TABLE_SHARES["request_messages"]),
+        "feedback": args.feedback if args.feedback is not None else int(args.rows * TABLE_SHARES["feedback"]),
+        "notifications": args.notifications if args.notifications is not None else int(args.rows * TABLE_SHARES["notifications"])
+    }
+
+    # Схема создается тем же кодом, что и в боте
+    db_path = os.path.abspath(args.db)
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("BOT_TOKEN", "0:dataset-generator")
+    os.environ.setdefault("SUPPORT_CHAT_ID", "0")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import telegramm
+    telegramm.init_database()
+
+    generator = DatasetGenerator(db_path, counts, args.seed, args.days, args.batch_size)
+    elapsed = generator.generate(list(telegramm.problems), telegramm.ADMIN_ID)
+
+    total = sum(generator.inserted.values())
+    print(f"✅ База {args.db} создана за {elapsed:.1f} с ({total / elapsed:,.0f} строк/с):")
+    for table, count in generator.inserted.items():
+        print(f"  {table}: {count:,}")
+
+if __name__ == "__main__":
+    main()
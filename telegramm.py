@@ -1,60 +1,273 @@
 import telebot
-from telebot import types
+from telebot import types, apihelper
 import sqlite3
 import logging
 from typing import Optional, Dict, List
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 import signal
 import sys
-import random
-import string
 import re
 import time
+import threading
+import queue
+import copy
+import gzip
+import shutil
+import atexit
+import itertools
+import collections
+import cProfile
+import pstats
+import io
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+import functools
+import multiprocessing
+import contextlib
+import urllib.parse
+import csv
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from dotenv import load_dotenv
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки между процессами недоступны
+    fcntl = None
 
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
-# Улучшенная конфигурация логирования
-logging.basicConfig(
-    filename="bot_logs.log",
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
 # Конфигурация и константы
 CONFIG = {
     "FEEDBACK_DELAY_HOURS": 24,
-    "MAX_DAILY_REQUESTS": 5,
-    "SUPPORT_HOURS": {
+    "MAX_DAILY_REQUESTS": 5,  # Заявок от одного пользователя за последние сутки (0 - без ограничения)
+    "RATE_LIMITS": {  # Ограничение частоты обновлений от пользователя: пополнение в секунду и запас
+        "message": {"rate": 1.0, "burst": 8},
+        "callback": {"rate": 2.0, "burst": 15}
+    },
+    "RATE_LIMIT_NOTICE_SECONDS": 30,  # Не чаще одного предупреждения о превышении лимита
+    "RATE_LIMIT_CACHE_SIZE": 100000,  # Пользователей, для которых хранятся счетчики лимитов
+    "SUPPORT_HOURS": {  # Рабочее время поддержки (МСК); вне его оповещения о заявках копятся до утра
         "start": 9,
         "end": 21
     },
+    "URGENT_PRIORITY_LEVEL": 4,  # Заявки с приоритетом не ниже (PRIORITY_LEVELS, 4 - «Критический») оповещают поддержку круглосуточно
     "AUTO_CLOSE_HOURS": 48,  # Автоматическое закрытие неактивных заявок
     "MAX_MESSAGE_LENGTH": 4000,  # Максимальная длина сообщения
     "RATING_THRESHOLD": 3,  # Порог для автоматического закрытия заявки
+    "KNOWN_USERS_CACHE_SIZE": 100000,  # Пользователи, для которых /start не обращается к базе
+    "ACTIVITY_FLUSH_SECONDS": 5,  # Период записи last_activity и requests_count
+    "UPDATE_DEDUP_WINDOW": 10000,  # Последние update_id, повторная доставка которых отбрасывается
+    "CALLBACK_ACK_THREADS": 2,  # Потоки, подтверждающие callback-запросы до очереди обработчиков
+    "TICKET_VIEW_CACHE_SIZE": 2000,  # Число отрисованных карточек заявок в памяти
+    "HISTORY_PAGE_SIZE": 10,  # Сообщений истории заявки на одной странице
+    "POSTGRES_POOL_SIZE": 10,  # Максимум соединений с PostgreSQL на процесс
+    "ANALYTICS_SNAPSHOT_SECONDS": 60,  # Допустимое отставание отчетов администратора от базы (0 - читать рабочую базу)
+    "NOTIFICATION_DIGEST_SECONDS": 30,  # Окно объединения уведомлений пользователя (0 - без объединения)
+    "RETENTION": {
+        "ticket_days": 90,  # Через сколько дней без изменений закрытые заявки уходят в архив
+        "notification_days": 30,  # Срок хранения уведомлений
+        "batch_size": 500,  # Записей за одну транзакцию
+        "vacuum_pages": 1000  # Страниц, освобождаемых за один проход инкрементального VACUUM
+    },
+    "BACKUP": {
+        "dir": os.getenv("BACKUP_DIR", "backups"),
+        "interval_hours": 24,  # Периодичность автоматических копий
+        "keep": 7,  # Сколько последних копий хранить
+        "pages_per_step": 256,  # Страниц, копируемых за один шаг (между шагами запись в базу не блокируется)
+        "step_pause": 0.01,  # Пауза между шагами, с
+        "max_restarts": 5,  # Перезапусков из-за записи в базу, после которых копирование откладывается
+        "compress_level": 6  # Уровень gzip: 9 сжимает лишь немного лучше, но в разы медленнее
+    },
+    "EXPORT": {
+        "batch_size": 1000,  # Строк, читаемых из базы за один fetchmany
+        "max_document_mb": 50,  # Предел размера документа, отправляемого ботом (ограничение Bot API)
+        "compress_level": 6
+    },
     "PRIORITY_LEVELS": {
         "Низкий": 1,
         "Средний": 2,
         "Высокий": 3,
         "Критический": 4
+    },
+    "LOGGING": {
+        "file": "bot_logs.log",
+        "level": os.getenv('LOG_LEVEL', 'INFO'),
+        "max_bytes": 10 * 1024 * 1024,  # Ротация по размеру файла
+        "rotate_when": os.getenv('LOG_ROTATE_WHEN'),  # Ротация по времени, например "midnight"
+        "backup_count": 14,
+        "queue_size": 10000,  # Записи сверх очереди отбрасываются, а не блокируют обработчик
+        "sample_every": 20  # Из частых отладочных событий в лог попадает каждое N-е
     }
 }
 
+# Упаковка ротированного файла лога в gzip
+def _compress_rotated_log(source: str, dest: str):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+# Форматирование записей лога в JSON со структурированными полями
+class JsonLogFormatter(logging.Formatter):
+    FIELDS = ("chat_id", "ticket_id", "handler", "duration")
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+# Пропуск части частых событий, помеченных extra={"sampled": True}
+class SamplingFilter(logging.Filter):
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+        return next(self._counter) % self.every == 0
+
+# Обработчик, который кладет запись в очередь и никогда не ждет
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Форматирование JSON выполняется в потоке QueueListener, здесь только подставляем аргументы
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+# Улучшенная конфигурация логирования: запись в файл выполняется в отдельном потоке
+def setup_logging():
+    settings = CONFIG["LOGGING"]
+    log_file = settings["file"]
+    worker_index = os.getenv("BOT_WORKER_INDEX")
+    if worker_index is not None:
+        # У каждого процесса-обработчика свой файл: ротация общего файла из нескольких процессов небезопасна
+        root, ext = os.path.splitext(log_file)
+        log_file = f"{root}.worker{worker_index}{ext}"
+    if settings["rotate_when"]:
+        file_handler = TimedRotatingFileHandler(
+            log_file, when=settings["rotate_when"],
+            backupCount=settings["backup_count"], encoding="utf-8"
+        )
+    else:
+        file_handler = RotatingFileHandler(
+            log_file, maxBytes=settings["max_bytes"],
+            backupCount=settings["backup_count"], encoding="utf-8"
+        )
+    file_handler.namer = lambda name: name + ".gz"
+    file_handler.rotator = _compress_rotated_log
+    file_handler.setFormatter(JsonLogFormatter())
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(settings["queue_size"]))
+    queue_handler.addFilter(SamplingFilter(settings["sample_every"]))
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(settings["level"])
+    root_logger.addHandler(queue_handler)
+
+    listener = QueueListener(queue_handler.queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return queue_handler, listener
+
+# Дописывает оставшиеся в очереди записи и останавливает поток логирования
+def stop_logging(listener: QueueListener):
+    if listener._thread is not None:
+        listener.stop()
+
+log_queue_handler, log_listener = setup_logging()
+logger = logging.getLogger(__name__)
+
 # Получение конфигурационных переменных
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 SUPPORT_CHAT_ID = os.getenv('SUPPORT_CHAT_ID')
+# Агенты поддержки, которые получают оповещения о заявках лично (через запятую)
+SUPPORT_AGENT_IDS = [int(agent) for agent in os.getenv('SUPPORT_AGENT_IDS', '').split(',') if agent.strip()]
 ADMIN_ID = int(os.getenv('ADMIN_ID', '5499105806'))
+DB_NAME = os.getenv('DB_PATH', 'support_bot.db')
+# Хранилище: sqlite (по умолчанию, файл DB_PATH) или postgres (строка подключения POSTGRES_DSN)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+POSTGRES_DSN = os.getenv('POSTGRES_DSN', '')
+ARCHIVE_DB_NAME = os.getenv('ARCHIVE_DB_PATH', 'support_bot_archive.db')
 
-# Глобальная переменная для хранения состояния администратора
-admin_mode = {}
+# Адрес HTTP-эндпоинта с метриками (METRICS_PORT=0 отключает сервер)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Многопроцессный режим: число процессов-обработчиков и номер текущего (-1 - основной процесс).
+# Процессы-обработчики отдают метрики на следующих за METRICS_PORT портах
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
+WORKER_INDEX = int(os.getenv('BOT_WORKER_INDEX', '-1'))
+if METRICS_PORT and WORKER_INDEX >= 0:
+    METRICS_PORT += 1 + WORKER_INDEX
 
 # Словарь для хранения временных данных
 temp_data = {}
 
+# Генератор номеров заявок: 8 символов base32 (Crockford, без I, L, O, U) - секунда
+# от TICKET_ID_EPOCH и номер в пределах секунды. Номера возрастают со временем, поэтому
+# новые заявки дописываются в конец индекса ticket_id. Номера внутри секунды чередуются
+# между процессами-обработчиками (slot из slots), так что процессы не выдают одинаковых
+TICKET_ID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+TICKET_ID_EPOCH = 1704067200  # 2024-01-01 00:00 UTC
+TICKET_ID_SEQUENCE_CHARS = 2
+
+class TicketIdGenerator:
+    def __init__(self, slot: int, slots: int):
+        self.slot = slot
+        self.slots = slots
+        self.sequence_size = len(TICKET_ID_ALPHABET) ** TICKET_ID_SEQUENCE_CHARS
+        self.per_second = self.sequence_size // slots
+        self._lock = threading.Lock()
+        self._second = 0
+        self._sequence = 0
+
+    def next(self) -> str:
+        with self._lock:
+            now = int(time.time()) - TICKET_ID_EPOCH
+            if now > self._second:
+                self._second, self._sequence = now, 0
+            elif self._sequence >= self.per_second:
+                # Номера текущей секунды закончились - берем следующую секунду
+                self._second, self._sequence = self._second + 1, 0
+            value = self._second * self.sequence_size + self._sequence * self.slots + self.slot
+            self._sequence += 1
+
+        chars = []
+        while value or len(chars) < 6 + TICKET_ID_SEQUENCE_CHARS:
+            value, digit = divmod(value, len(TICKET_ID_ALPHABET))
+            chars.append(TICKET_ID_ALPHABET[digit])
+        return "".join(reversed(chars))
+
+ticket_ids = TicketIdGenerator(max(WORKER_INDEX, 0), BOT_WORKERS if WORKER_INDEX >= 0 else 1)
+
 # Проверка обязательных переменных окружения
 if not all([BOT_TOKEN, SUPPORT_CHAT_ID, ADMIN_ID]):
     missing_vars = []
@@ -135,6 +348,17 @@ problems = {
                 ],
                 "additional": "Если проблема повторяется, обратитесь к специалисту",
                 "priority": "Высокий"
+            },
+            "no_boot": {
+                "title": "Компьютер не включается",
+                "steps": [
+                    "Проверьте подключение питания и сетевой фильтр",
+                    "Отключите все внешние устройства, кроме монитора и клавиатуры",
+                    "Подержите кнопку питания 10 секунд и включите компьютер снова",
+                    "Запишите звуковые сигналы и индикацию при включении"
+                ],
+                "additional": "Не разбирайте устройство самостоятельно: заявка передается специалисту в первую очередь",
+                "priority": "Критический"
             }
         }
     },
@@ -184,21 +408,492 @@ problems = {
     }
 }
 
+# Границы корзин гистограмм задержек (в секундах)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Реестр метрик в формате экспозиции Prometheus
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._descriptions = {}
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+
+    def describe(self, name: str, kind: str, help_text: str):
+        self._descriptions[name] = (kind, help_text)
+
+    @staticmethod
+    def _labels_key(labels: Optional[Dict]) -> tuple:
+        return tuple(sorted((labels or {}).items()))
+
+    def observe(self, name: str, labels: Optional[Dict], value: float):
+        key = self._labels_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def inc(self, name: str, labels: Optional[Dict] = None, amount: float = 1):
+        key = self._labels_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    # Сумма счетчика по всем наборам меток
+    def counter_total(self, name: str) -> float:
+        with self._lock:
+            return sum(self._counters.get(name, {}).values())
+
+    # Число наблюдений и их сумма по всем наборам меток
+    def histogram_total(self, name: str) -> tuple:
+        with self._lock:
+            states = self._histograms.get(name, {}).values()
+            return sum(state[2] for state in states), sum(state[1] for state in states)
+
+    # Значение датчика вычисляется в момент запроса метрик
+    def gauge(self, name: str, func):
+        self._gauges[name] = func
+
+    @staticmethod
+    def _format_labels(key: tuple, extra: tuple = ()) -> str:
+        pairs = key + extra
+        if not pairs:
+            return ""
+        escaped = []
+        for k, v in pairs:
+            value = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{k}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def _header(self, lines: List[str], name: str, default_kind: str):
+        kind, help_text = self._descriptions.get(name, (default_kind, ""))
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = {
+                name: {key: (list(state[0]), state[1], state[2]) for key, state in series.items()}
+                for name, series in self._histograms.items()
+            }
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        lines = []
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for key, (bucket_counts, total, count) in sorted(series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._format_labels(key, (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(key, (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{self._format_labels(key)} {total}")
+                lines.append(f"{name}_count{self._format_labels(key)} {count}")
+
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{self._format_labels(key)} {value}")
+
+        for name, func in sorted(self._gauges.items()):
+            try:
+                value = func()
+            except Exception as e:
+                logger.error(f"Error collecting gauge {name}: {e}")
+                continue
+            self._header(lines, name, "gauge")
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.describe("bot_handler_duration_seconds", "histogram", "Время выполнения обработчиков")
+metrics.describe("bot_callback_duration_seconds", "histogram", "Время обработки callback-запросов по действиям")
+metrics.describe("bot_notifications_total", "counter", "Доставленные уведомления: по одному или в дайджесте")
+metrics.describe("bot_bulk_tickets_total", "counter", "Заявки, измененные массовыми операциями администратора")
+metrics.describe("bot_ticket_alerts_total", "counter", "Оповещения о новых заявках: сразу, срочные вне рабочего времени, отложенные до утра")
+metrics.describe("bot_retention_archived_total", "counter", "Заявки, перенесенные в архив")
+metrics.describe("bot_retention_pruned_total", "counter", "Удаленные устаревшие уведомления")
+metrics.describe("bot_backups_total", "counter", "Созданные резервные копии по результату")
+metrics.describe("bot_backup_duration_seconds", "histogram", "Время создания резервной копии")
+metrics.describe("bot_exports_total", "counter", "Выгрузки заявок по формату и результату")
+metrics.describe("bot_export_duration_seconds", "histogram", "Время выгрузки заявок")
+metrics.describe("bot_rate_limited_total", "counter", "Отклоненные обновления и заявки сверх лимитов")
+metrics.describe("bot_duplicate_updates_total", "counter", "Повторно доставленные обновления и сообщения, которые не обработаны")
+metrics.describe("bot_analytics_snapshot_refresh_seconds", "histogram", "Время обновления снимка базы для отчетов")
+metrics.describe("bot_cluster_updates_total", "counter", "Обновления, переданные процессам-обработчикам")
+metrics.describe("bot_cluster_worker_restarts_total", "counter", "Перезапуски упавших процессов-обработчиков")
+metrics.describe("bot_callback_ack_seconds", "histogram", "Время от получения callback-запроса до подтверждения")
+metrics.describe("bot_db_query_duration_seconds", "histogram", "Время выполнения SQL-запросов")
+metrics.describe("bot_db_commit_duration_seconds", "histogram", "Время фиксации транзакций")
+metrics.describe("bot_db_lock_retries_total", "counter", "Повторы из-за блокировки базы данных")
+metrics.describe("bot_db_lock_errors_total", "counter", "Ошибки 'database is locked'")
+metrics.describe("bot_telegram_api_duration_seconds", "histogram", "Время вызовов Telegram Bot API")
+metrics.describe("bot_telegram_api_errors_total", "counter", "Ошибки вызовов Telegram Bot API")
+metrics.describe("bot_screen_updates_total", "counter", "Показ экранов меню: редактирование, отправка, без изменений")
+metrics.describe("bot_handler_errors_total", "counter", "Необработанные исключения в обработчиках")
+
+_process_started_at = time.time()
+metrics.gauge("bot_uptime_seconds", lambda: round(time.time() - _process_started_at, 3))
+metrics.gauge("bot_log_queue_depth", lambda: log_queue_handler.queue.qsize())
+metrics.gauge("bot_log_records_dropped", lambda: log_queue_handler.dropped)
+
+# Идентификатор чата из сообщения или callback-запроса (для структурированного лога)
+def _chat_id_of(obj) -> Optional[int]:
+    message = getattr(obj, "message", None) or obj
+    chat = getattr(message, "chat", None)
+    return getattr(chat, "id", None)
+
+# Декоратор для замера времени выполнения обработчика
+def timed_handler(func):
+    name = func.__name__
+    TIMED_HANDLERS.add(name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            session = active_profile
+            if session is not None and session.wants(name):
+                return session.run(name, func, args, kwargs)
+            return func(*args, **kwargs)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", {"handler": name})
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            metrics.observe("bot_handler_duration_seconds", {"handler": name}, duration)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Handler %s finished in %.3fs", name, duration,
+                    extra={
+                        "handler": name,
+                        "duration": round(duration, 6),
+                        "chat_id": _chat_id_of(args[0]) if args else None,
+                        "sampled": True
+                    }
+                )
+
+    return wrapper
+
+# Имена обработчиков, обернутых timed_handler (доступны для профилирования)
+TIMED_HANDLERS = set()
+
+# Профилирование по запросу администратора
+PROFILES_DIR = "profiles"
+PROFILE_MAX_SECONDS = 600
+PROFILE_MAX_UPDATES = 10000
+PROFILE_SAMPLE_INTERVAL = 0.005  # Период сэмплирования стеков (в секундах)
+
+# Текущая сессия профилирования (None, если профилирование выключено)
+active_profile = None
+_profile_lock = threading.Lock()
+_profile_local = threading.local()
+
+class ProfilingSession:
+    def __init__(self, chat_id: int, mode: str, seconds: Optional[int] = None,
+                 updates: Optional[int] = None, handlers: Optional[List[str]] = None):
+        self.chat_id = chat_id
+        self.mode = mode  # "cprofile" или "sample"
+        self.seconds = seconds
+        self.max_updates = updates
+        self.handlers = set(handlers or [])
+        self.started_at = time.time()
+        self.updates = 0
+        self.lock = threading.Lock()
+        self.stats = None
+        self.samples = collections.Counter()
+        self.active_threads = {}
+        self.finished = threading.Event()
+        self.timer = None
+
+    def describe(self) -> str:
+        limit = f"{self.seconds} с" if self.seconds else f"{self.max_updates} обновлений"
+        scope = ", ".join(sorted(self.handlers)) if self.handlers else "все обработчики"
+        return f"{self.mode}, {limit}, {scope}"
+
+    def start(self):
+        if self.mode == "sample":
+            threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True).start()
+        if self.seconds:
+            self.timer = threading.Timer(self.seconds, stop_profiling, kwargs={"reason": "время истекло"})
+            self.timer.daemon = True
+            self.timer.start()
+
+    # Профилируем только внешний вызов: вложенные обработчики попадают в тот же профиль
+    def wants(self, handler: str) -> bool:
+        if getattr(_profile_local, "active", False) or self.finished.is_set():
+            return False
+        return not self.handlers or handler in self.handlers
+
+    def run(self, handler: str, func, args, kwargs):
+        _profile_local.active = True
+        try:
+            if self.mode == "cprofile":
+                profile = cProfile.Profile()
+                try:
+                    return profile.runcall(func, *args, **kwargs)
+                finally:
+                    with self.lock:
+                        if self.stats is None:
+                            self.stats = pstats.Stats(profile)
+                        else:
+                            self.stats.add(profile)
+            ident = threading.get_ident()
+            self.active_threads[ident] = handler
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.active_threads.pop(ident, None)
+        finally:
+            _profile_local.active = False
+            with self.lock:
+                self.updates += 1
+                limit_reached = self.max_updates and self.updates >= self.max_updates
+            if limit_reached:
+                threading.Thread(target=stop_profiling, kwargs={"reason": "лимит обновлений"}, daemon=True).start()
+
+    def _sample_loop(self):
+        while not self.finished.wait(PROFILE_SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            for ident, handler in list(self.active_threads.items()):
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None and len(stack) < 64:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[(handler,) + tuple(reversed(stack))] += 1
+
+    # Сохраняет отчет на диск и возвращает (путь к отчету, краткая сводка)
+    def write_report(self) -> tuple:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        base = os.path.join(PROFILES_DIR, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{self.mode}")
+        elapsed = time.time() - self.started_at
+        header = f"Профилирование: {self.describe()}\nДлительность: {elapsed:.1f} с, обновлений: {self.updates}\n"
+
+        if self.mode == "cprofile":
+            if self.stats is None:
+                return None, header + "Нет данных: ни один обработчик не был вызван."
+            self.stats.dump_stats(base + ".pstats")
+            report = io.StringIO()
+            self.stats.stream = report
+            self.stats.sort_stats("cumulative").print_stats(60)
+            self.stats.sort_stats("tottime").print_stats(30)
+            top = sorted(self.stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:5]
+            lines = [
+                f"{tottime * 1000:.1f} мс / {calls} выз. - {func_name} ({os.path.basename(filename)}:{line})"
+                for (filename, line, func_name), (_, calls, tottime, _, _) in top
+            ]
+        else:
+            if not self.samples:
+                return None, header + "Нет данных: не собрано ни одного сэмпла."
+            with open(base + ".folded", "w", encoding="utf-8") as folded:
+                for stack, count in self.samples.most_common():
+                    folded.write(";".join(stack) + f" {count}\n")
+            total = sum(self.samples.values())
+            own = collections.Counter()
+            inclusive = collections.Counter()
+            for stack, count in self.samples.items():
+                own[stack[-1]] += count
+                for frame in set(stack[1:]):
+                    inclusive[frame] += count
+            report = io.StringIO()
+            report.write(f"Всего сэмплов: {total}\n\nСобственное время:\n")
+            for frame, count in own.most_common(40):
+                report.write(f"{count / total:7.1%} {count:8d}  {frame}\n")
+            report.write("\nВключая вложенные вызовы:\n")
+            for frame, count in inclusive.most_common(40):
+                report.write(f"{count / total:7.1%} {count:8d}  {frame}\n")
+            lines = [f"{count / total:.1%} - {frame}" for frame, count in own.most_common(5)]
+
+        report_path = base + ".txt"
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(header + "\n" + report.getvalue())
+        return report_path, header + "\nТоп по собственному времени:\n" + "\n".join(lines)
+
+def start_profiling(chat_id: int, mode: str = "cprofile", seconds: Optional[int] = None,
+                    updates: Optional[int] = None, handlers: Optional[List[str]] = None) -> Optional[ProfilingSession]:
+    global active_profile
+    with _profile_lock:
+        if active_profile is not None:
+            return None
+        if not seconds and not updates:
+            seconds = 30
+        active_profile = ProfilingSession(chat_id, mode, seconds, updates, handlers)
+        active_profile.start()
+        logger.info(f"Profiling started: {active_profile.describe()}")
+        return active_profile
+
+def stop_profiling(reason: str = "остановлено администратором") -> bool:
+    global active_profile
+    with _profile_lock:
+        session = active_profile
+        if session is None:
+            return False
+        active_profile = None
+        session.finished.set()
+        if session.timer:
+            session.timer.cancel()
+
+    try:
+        report_path, summary = session.write_report()
+        logger.info(f"Profiling finished ({reason}): {report_path}")
+        bot.send_message(session.chat_id, f"🩺 Профилирование завершено ({reason}).\n\n{summary}")
+        if report_path:
+            with open(report_path, "rb") as report:
+                bot.send_document(session.chat_id, report)
+    except Exception as e:
+        logger.error(f"Error finishing profiling session: {e}", exc_info=True)
+    return True
+
+# Действия callback-запросов без параметров
+CALLBACK_ACTIONS = {
+    "admin_tickets_chat", "admin_all_requests", "admin_stats", "admin_users",
+    "admin_settings", "admin_notifications", "admin_analytics", "admin_profile",
+    "admin_backup", "admin_backup_run", "admin_bulk", "admin_bulk_duplicates", "admin_bulk_cancel",
+    "admin_export", "admin_export_csv", "admin_export_jsonl", "help",
+    "cancel_new_ticket", "support", "my_requests", "back_to_main"
+}
+
+# Действия, результат которых всегда сообщается всплывающим текстом ответа на callback-запрос:
+# их подтверждает сам обработчик, остальные подтверждаются сразу при получении
+CALLBACK_NOTICE_ACTIONS = {
+    "admin_export_csv", "admin_export_jsonl", "admin_bulk_cancel", "admin_bulk_run", "admin_backup_run",
+    "admin_resolve", "resolve"
+}
+
+# Префиксы callback-запросов с параметрами (порядок важен: длинные раньше коротких)
+CALLBACK_PREFIXES = (
+    "admin_bulk_run_", "admin_profile_", "admin_ticket_chat_", "admin_hist_", "hist_", "admin_reply_", "admin_resolve_", "admin_reject_", "admin_close_",
+    "new_ticket_cat_", "rate_request_", "cat_", "subcat_", "request_", "resolve_",
+    "comment_", "cancel_", "close_", "rate_"
+)
+
+# Имя действия callback-запроса без идентификаторов заявок (для меток метрик)
+def callback_action(data: Optional[str]) -> str:
+    if not data:
+        return "unknown"
+    if data in CALLBACK_ACTIONS:
+        return data
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return prefix[:-1]
+    return "unknown"
+
+# Отвечает ли обработчик на callback-запрос текстом (тогда подтверждение откладывается до него)
+def callback_answered_by_handler(data: Optional[str]) -> bool:
+    action = callback_action(data)
+    if action == "admin_profile":
+        # Экран профилирования текстом не отвечает; запуск отвечает всегда, остановка - только
+        # если профилирование не запущено
+        if data == "admin_profile":
+            return False
+        return data != "admin_profile_stop" or active_profile is None
+    if action == "rate":
+        return "_" in data[5:]  # rate_<заявка>_<оценка>; rate_<заявка> открывает выбор оценки
+    return action in CALLBACK_NOTICE_ACTIONS
+
+# Короткая метка SQL-запроса: первые слова запроса без лишних пробелов
+@functools.lru_cache(maxsize=256)
+def statement_label(sql: str) -> str:
+    normalized = " ".join(sql.split())
+    return normalized if len(normalized) <= 80 else normalized[:77] + "..."
+
+def _is_lock_error(error: Exception) -> bool:
+    return isinstance(error, sqlite3.OperationalError) and "database is locked" in str(error)
+
+# Курсор, замеряющий время выполнения запросов
+class TimedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def _timed(self, method, sql, *args):
+        started = time.perf_counter()
+        try:
+            method(sql, *args)
+            return self
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e):
+                metrics.inc("bot_db_lock_errors_total")
+            raise
+        finally:
+            metrics.observe(
+                "bot_db_query_duration_seconds",
+                {"statement": statement_label(sql)},
+                time.perf_counter() - started
+            )
+
+    def execute(self, sql, *args):
+        return self._timed(self._cursor.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(self._cursor.executemany, sql, *args)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+# HTTP-обработчик эндпоинта /metrics
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Не засоряем лог запросами Prometheus
+
+def start_metrics_server():
+    if not METRICS_PORT:
+        return None
+    server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    logger.info(f"Metrics endpoint listening on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return server
+
 # Класс для управления подключением к базе данных
 class DatabaseConnection:
-    def __init__(self, db_name: str):
+    def __init__(self, db_name: str, read_only: bool = False):
         self.db_name = db_name
+        self.read_only = read_only
         self.max_retries = 3
         self.retry_delay = 0.1  # 100ms
 
     def __enter__(self):
         for attempt in range(self.max_retries):
             try:
-                self.conn = sqlite3.connect(self.db_name, timeout=5.0)  # Add 5 second timeout
-                self.cursor = self.conn.cursor()
+                if self.read_only:
+                    uri = f"file:{urllib.parse.quote(os.path.abspath(self.db_name))}?mode=ro"
+                    self.conn = sqlite3.connect(uri, timeout=5.0, uri=True)
+                else:
+                    self.conn = sqlite3.connect(self.db_name, timeout=5.0)  # Add 5 second timeout
+                self.cursor = TimedCursor(self.conn.cursor())
                 return self.cursor
             except sqlite3.OperationalError as e:
                 if "database is locked" in str(e) and attempt < self.max_retries - 1:
+                    metrics.inc("bot_db_lock_retries_total", {"site": "connect"})
                     time.sleep(self.retry_delay * (attempt + 1))  # Exponential backoff
                     continue
                 raise
@@ -209,7 +904,9 @@ class DatabaseConnection:
         if self.conn:
             if exc_type is None:
                 try:
+                    started = time.perf_counter()
                     self.conn.commit()
+                    metrics.observe("bot_db_commit_duration_seconds", None, time.perf_counter() - started)
                 except Exception as e:
                     logger.error(f"Error committing transaction: {e}")
                     self.conn.rollback()
@@ -223,267 +920,2308 @@ class DatabaseConnection:
             except Exception as e:
                 logger.error(f"Error closing connection: {e}")
 
-# Инициализация базы данных
-def init_database():
-    with DatabaseConnection("support_bot.db") as cursor:
-        # Таблица пользователей
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_activity TIMESTAMP,
-            requests_count INTEGER DEFAULT 0,
-            is_banned BOOLEAN DEFAULT 0,
-            rating REAL DEFAULT 0,
-            solved_issues INTEGER DEFAULT 0,
-            avg_response_time INTEGER DEFAULT 0
-        )
-        """)
+# Метки времени хранятся целым числом секунд Unix-эпохи (UTC): сравнения и группировки
+# выполняются по индексу без разбора строк, а в сообщениях время показывается по Москве
+MOSCOW_TZ = timezone(timedelta(hours=3), "МСК")
+MOSCOW_OFFSET = 3 * 3600
 
-        # Таблица заявок
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ticket_id TEXT UNIQUE,
-            user_id INTEGER,
-            category TEXT,
-            problem TEXT,
-            status TEXT DEFAULT 'Открыто',
-            priority TEXT DEFAULT 'Средний',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_update TIMESTAMP,
-            assigned_to INTEGER,
-            response_time INTEGER,
-            satisfaction_rating INTEGER,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        """)
+def epoch_now() -> int:
+    return int(time.time())
 
-        # Добавляем недостающие колонки, если они не существуют
-        try:
-            cursor.execute("ALTER TABLE requests ADD COLUMN response_time INTEGER")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
+# Граница времени "N часов/дней назад"
+def epoch_cutoff(**delta) -> int:
+    return int(time.time() - timedelta(**delta).total_seconds())
 
+def format_time(value) -> str:
+    if value is None or value == "":
+        return ""
+    if isinstance(value, str):
+        # Записи архива, перенесенные до перехода на эпоху: текст CURRENT_TIMESTAMP в UTC
         try:
-            cursor.execute("ALTER TABLE requests ADD COLUMN satisfaction_rating INTEGER")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
+            value = datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            return value
+    return datetime.fromtimestamp(value, MOSCOW_TZ).strftime("%d.%m.%Y %H:%M")
 
-        # Таблица сообщений заявки
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS request_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            request_id INTEGER,
-            sender_id INTEGER,
-            message_text TEXT,
-            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_internal BOOLEAN DEFAULT 0,
-            FOREIGN KEY (request_id) REFERENCES requests(id)
-        )
-        """)
+# Хранилище SQLite: соединение на транзакцию через DatabaseConnection
+class SqliteStorage:
+    name = "sqlite"
 
-        # Таблица отзывов
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            request_id INTEGER,
-            user_id INTEGER,
-            rating INTEGER,
-            comment TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (request_id) REFERENCES requests(id),
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        """)
+    def __init__(self, path: str):
+        self.path = path
 
-        # Таблица уведомлений
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            message TEXT,
-            is_read BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        """)
+    def connect(self):
+        return DatabaseConnection(self.path)
 
-# Инициализация бота
-try:
-    bot = telebot.TeleBot(BOT_TOKEN)
-    logger.info("Bot initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize bot: {e}")
-    print(f"❌ Ошибка инициализации бота: {e}")
-    sys.exit(1)
+    # Использует переданный курсор (общая транзакция) или открывает новую транзакцию
+    @contextlib.contextmanager
+    def transaction(self, cursor=None):
+        if cursor is not None:
+            yield cursor
+            return
+        with self.connect() as new_cursor:
+            yield new_cursor
 
-# Функция для создания клавиатуры с категориями проблем
-def get_problems_keyboard():
-    markup = types.InlineKeyboardMarkup(row_width=1)
-    for category_id, category_data in problems.items():
-        markup.add(types.InlineKeyboardButton(
-            f"{category_data['icon']} {category_data['title']}",
-            callback_data=f"cat_{category_id}"
-        ))
-    markup.add(types.InlineKeyboardButton("📞 Связаться с поддержкой", callback_data="support"))
-    markup.add(types.InlineKeyboardButton("📊 Мои заявки", callback_data="my_requests"))
-    markup.add(types.InlineKeyboardButton("ℹ️ Помощь", callback_data="help"))
-    return markup
+    def stream_connection(self):
+        return self.connect()
 
-# Функция для создания админ-клавиатуры
-def get_admin_keyboard():
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    markup.add(
-        types.InlineKeyboardButton("💬 Чат заявок", callback_data="admin_tickets_chat"),
-        types.InlineKeyboardButton("📋 Все заявки", callback_data="admin_all_requests")
-    )
-    markup.add(
-        types.InlineKeyboardButton("📊 Статистика", callback_data="admin_stats"),
-        types.InlineKeyboardButton("👥 Пользователи", callback_data="admin_users")
-    )
-    markup.add(
-        types.InlineKeyboardButton("⚙️ Настройки", callback_data="admin_settings"),
-        types.InlineKeyboardButton("🔔 Уведомления", callback_data="admin_notifications")
-    )
-    markup.add(
-        types.InlineKeyboardButton("📈 Аналитика", callback_data="admin_analytics")
-    )
-    return markup
+    # Построчное чтение результата пачками по batch_size: в памяти не больше одной пачки
+    def stream(self, sql: str, params=(), batch_size: int = 1000):
+        with self.stream_connection() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
 
-# Функция для создания клавиатуры с приоритетами
-def get_priority_keyboard():
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    for priority, level in CONFIG["PRIORITY_LEVELS"].items():
-        markup.add(types.InlineKeyboardButton(
-            f"{'🔴' if level > 2 else '🟡' if level > 1 else '🟢'} {priority}",
-            callback_data=f"priority_{priority}"
-        ))
-    return markup
+# SQL репозиториев пишется с плейсхолдерами "?", для psycopg2 они заменяются на "%s"
+@functools.lru_cache(maxsize=1024)
+def _postgres_sql(sql: str) -> str:
+    return sql.replace("%", "%%").replace("?", "%s")
 
-# Функция для создания клавиатуры с оценками
-def get_rating_keyboard():
-    markup = types.InlineKeyboardMarkup(row_width=5)
-    for i in range(1, 6):
-        markup.add(types.InlineKeyboardButton(
-            "⭐" * i,
-            callback_data=f"rate_{i}"
-        ))
-    return markup
+class PostgresCursor:
+    def __init__(self, cursor, extras):
+        self._cursor = cursor
+        self._extras = extras
 
-# Функция для отправки уведомления
-def send_notification(user_id: int, message: str):
-    try:
-        for attempt in range(3):  # Try up to 3 times
-            try:
-                with DatabaseConnection("support_bot.db") as cursor:
-                    cursor.execute("""
-                        INSERT INTO notifications (user_id, message)
-                        VALUES (?, ?)
-                    """, (user_id, message))
-                    break  # If successful, break the retry loop
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and attempt < 2:
-                    time.sleep(0.1 * (attempt + 1))  # Exponential backoff
-                    continue
-                raise
-            except Exception as e:
-                raise
-        
-        bot.send_message(user_id, f"🔔 {message}")
-    except Exception as e:
-        logger.error(f"Error sending notification: {e}")
-        # Don't re-raise the exception to prevent breaking the main flow
+    def execute(self, sql, params=()):
+        if params:
+            self._cursor.execute(_postgres_sql(sql), params)
+        else:
+            self._cursor.execute(sql)  # Без параметров psycopg2 не разбирает "%" в тексте запроса
+        return self
 
-# Функция для автоматического закрытия неактивных заявок
-def auto_close_inactive_requests():
+    def executemany(self, sql, seq_of_params):
+        self._extras.execute_batch(self._cursor, _postgres_sql(sql), list(seq_of_params))
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+# Транзакция на соединении из пула PostgreSQL (аналог DatabaseConnection)
+class PostgresConnection:
+    def __init__(self, storage, cursor_name: Optional[str] = None):
+        self.storage = storage
+        self.cursor_name = cursor_name
+        self.conn = None
+
+    def __enter__(self):
+        self.storage.slots.acquire()  # Пул psycopg2 не ждет свободного соединения, ожидание - здесь
+        try:
+            self.conn = self.storage.pool.getconn()
+        except Exception:
+            self.storage.slots.release()
+            raise
+        # Именованный курсор (cursor_name) - серверный: строки передаются клиенту по мере fetchmany
+        return TimedCursor(PostgresCursor(self.conn.cursor(name=self.cursor_name), self.storage.extras))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                try:
+                    started = time.perf_counter()
+                    self.conn.commit()
+                    metrics.observe("bot_db_commit_duration_seconds", None, time.perf_counter() - started)
+                except Exception as e:
+                    logger.error(f"Error committing transaction: {e}")
+                    self.conn.rollback()
+            else:
+                try:
+                    self.conn.rollback()
+                except Exception as e:
+                    logger.error(f"Error rolling back transaction: {e}")
+        finally:
+            self.storage.pool.putconn(self.conn, close=bool(self.conn.closed))
+            self.storage.slots.release()
+
+# Хранилище PostgreSQL: несколько одновременных транзакций записи через пул соединений
+class PostgresStorage(SqliteStorage):
+    name = "postgres"
+
+    def __init__(self, dsn: str, pool_size: int):
+        try:
+            import psycopg2.extras
+            import psycopg2.pool
+        except ImportError:
+            raise RuntimeError("Для STORAGE_BACKEND=postgres установите пакет psycopg2-binary")
+        self.extras = psycopg2.extras
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, pool_size, dsn, options="-c timezone=UTC")
+        self.slots = threading.BoundedSemaphore(pool_size)
+
+    def connect(self):
+        return PostgresConnection(self)
+
+    def stream_connection(self):
+        return PostgresConnection(self, cursor_name=f"stream_{threading.get_ident()}_{time.monotonic_ns()}")
+
+    def init_schema(self):
+        with self.connect() as cursor:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id BIGINT PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                registration_date BIGINT DEFAULT CAST(EXTRACT(EPOCH FROM now()) AS BIGINT),
+                last_activity BIGINT,
+                requests_count INTEGER DEFAULT 0,
+                is_banned INTEGER DEFAULT 0,
+                rating REAL DEFAULT 0,
+                solved_issues INTEGER DEFAULT 0,
+                avg_response_time INTEGER DEFAULT 0
+            )
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS requests (
+                id BIGSERIAL PRIMARY KEY,
+                ticket_id TEXT UNIQUE,
+                user_id BIGINT,
+                category TEXT,
+                problem TEXT,
+                status TEXT DEFAULT 'Открыто',
+                priority TEXT DEFAULT 'Средний',
+                created_at BIGINT DEFAULT CAST(EXTRACT(EPOCH FROM now()) AS BIGINT),
+                last_update BIGINT,
+                assigned_to BIGINT,
+                response_time INTEGER,
+                satisfaction_rating INTEGER
+            )
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS request_messages (
+                id BIGSERIAL PRIMARY KEY,
+                request_id BIGINT,
+                sender_id BIGINT,
+                message_text TEXT,
+                sent_at BIGINT DEFAULT CAST(EXTRACT(EPOCH FROM now()) AS BIGINT),
+                is_internal INTEGER DEFAULT 0,
+                idempotency_key TEXT
+            )
+            """)
+            cursor.execute("ALTER TABLE request_messages ADD COLUMN IF NOT EXISTS idempotency_key TEXT")
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS feedback (
+                id BIGSERIAL PRIMARY KEY,
+                request_id BIGINT,
+                user_id BIGINT,
+                rating INTEGER,
+                comment TEXT,
+                created_at BIGINT DEFAULT CAST(EXTRACT(EPOCH FROM now()) AS BIGINT)
+            )
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS notifications (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT,
+                message TEXT,
+                is_read INTEGER DEFAULT 0,
+                created_at BIGINT DEFAULT CAST(EXTRACT(EPOCH FROM now()) AS BIGINT)
+            )
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS admin_sessions (
+                user_id BIGINT PRIMARY KEY,
+                enabled INTEGER DEFAULT 0
+            )
+            """)
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                name TEXT PRIMARY KEY,
+                value BIGINT
+            )
+            """)
+            # Переход с TIMESTAMP на секунды эпохи для баз, созданных до него
+            for table, column in TIMESTAMP_COLUMNS:
+                cursor.execute("""
+                    SELECT data_type FROM information_schema.columns
+                    WHERE table_name = ? AND column_name = ?
+                """, (table, column))
+                if cursor.fetchone()[0].startswith("timestamp"):
+                    cursor.execute(f"""
+                        ALTER TABLE {table}
+                            ALTER COLUMN {column} DROP DEFAULT,
+                            ALTER COLUMN {column} TYPE BIGINT USING CAST(EXTRACT(EPOCH FROM {column}) AS BIGINT),
+                            ALTER COLUMN {column} SET DEFAULT CAST(EXTRACT(EPOCH FROM now()) AS BIGINT)
+                    """)
+            cursor.execute("UPDATE requests SET last_update = created_at WHERE last_update IS NULL")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_requests_user ON requests(user_id, created_at)")
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_request_messages_thread
+                ON request_messages(request_id, sent_at, id)
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_requests_status_update ON requests(status, last_update)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_at)")
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_request_messages_idempotency
+                ON request_messages(idempotency_key)
+            """)
+
+# Снимок базы SQLite для отчетов администратора. Долгие агрегирующие запросы читают копию,
+# а не рабочий файл, и не задерживают запись заявок и ответов. Устаревший (старше max_age
+# секунд) снимок обновляется через backup API в фоновом потоке, а отчеты тем временем читают
+# прежний; ждать копирования приходится, только пока первого снимка еще нет
+class SnapshotStorage(SqliteStorage):
+    def __init__(self, source_path: str, path: str, max_age: float):
+        super().__init__(path)
+        self.source_path = source_path
+        self.max_age = max_age
+        self.refreshed_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def age(self) -> float:
+        return time.monotonic() - self.refreshed_at if self.refreshed_at is not None else 0.0
+
+    def refresh(self):
+        started = time.perf_counter()
+        tmp_path = self.path + ".tmp"
+        source = sqlite3.connect(self.source_path, timeout=5.0)
+        target = sqlite3.connect(tmp_path)
+        try:
+            copy_database(source, target, CONFIG["BACKUP"])
+        finally:
+            target.close()
+            source.close()
+        # Запросы, уже открывшие прежний снимок, дочитывают его; новые открывают свежий
+        os.replace(tmp_path, self.path)
+        self.refreshed_at = time.monotonic()
+        metrics.observe("bot_analytics_snapshot_refresh_seconds", None, time.perf_counter() - started)
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # Прежний снимок остается в работе, следующая попытка - при следующем обращении
+            logger.warning(f"Snapshot refresh failed, serving the previous one: {e}")
+        finally:
+            self._refreshing = False
+
+    def connect(self):
+        with self._lock:
+            if self.refreshed_at is None:
+                self.refresh()
+            elif self.age() >= self.max_age and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return DatabaseConnection(self.path, read_only=True)
+
+# Колонки с метками времени (секунды эпохи)
+TIMESTAMP_COLUMNS = (
+    ("users", "registration_date"),
+    ("users", "last_activity"),
+    ("requests", "created_at"),
+    ("requests", "last_update"),
+    ("request_messages", "sent_at"),
+    ("feedback", "created_at"),
+    ("notifications", "created_at")
+)
+
+# Час и день недели (0 - воскресенье) по Москве из секунд эпохи: целочисленная арифметика
+# одинаково работает в SQLite и PostgreSQL
+def moscow_hour_sql(column: str) -> str:
+    return f"(({column} + {MOSCOW_OFFSET}) / 3600) % 24"
+
+def moscow_weekday_sql(column: str) -> str:
+    return f"(({column} + {MOSCOW_OFFSET}) / 86400 + 4) % 7"  # 01.01.1970 - четверг
+
+def create_storage():
+    if STORAGE_BACKEND == "postgres":
+        return PostgresStorage(POSTGRES_DSN, CONFIG["POSTGRES_POOL_SIZE"])
+    if STORAGE_BACKEND != "sqlite":
+        raise RuntimeError(f"Неизвестное хранилище STORAGE_BACKEND={STORAGE_BACKEND}")
+    return SqliteStorage(DB_NAME)
+
+# Отбор заявок для массовых операций: статус, категория (None - любая), созданные раньше
+# created_before (None - любые), только повторные заявки и номер последней заявки на момент
+# предпросмотра, чтобы операция не задела заявки, созданные после него
+BulkFilter = collections.namedtuple(
+    "BulkFilter", ["status", "category", "created_before", "duplicates", "max_id"], defaults=[None]
+)
+
+# Репозитории: весь SQL для работы с данными бота. Запросы переносимы между SQLite
+# и PostgreSQL, различия диалектов - в методах хранилища. Необязательный параметр cursor
+# позволяет выполнить несколько операций в одной транзакции (storage.transaction())
+class TicketRepository:
+    def __init__(self, storage):
+        self.storage = storage
+
+    # Создание заявки; возвращает False, если номер ticket_id уже занят
+    def create(self, ticket_id: str, user_id: int, category: str, problem: str,
+               priority: str = "Средний", cursor=None) -> bool:
+        now = epoch_now()
+        with self.storage.transaction(cursor) as cur:
+            cur.execute("""
+                INSERT INTO requests (ticket_id, user_id, category, problem, priority, created_at, last_update)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(ticket_id) DO NOTHING
+            """, (ticket_id, user_id, category, problem, priority, now, now))
+            return cur.rowcount > 0
+
+    # Открытые заявки, созданные в [since, until). Условие по last_update (не меньше created_at)
+    # позволяет искать по индексу (status, last_update)
+    def open_created_between(self, since: int, until: int) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT ticket_id, category, problem, priority, created_at
+                FROM requests
+                WHERE status = 'Открыто'
+                AND last_update >= ?
+                AND created_at >= ?
+                AND created_at < ?
+                ORDER BY created_at
+            """, (since, since, until))
+            return cur.fetchall()
+
+    def exists(self, ticket_id: str) -> bool:
+        with self.storage.transaction() as cur:
+            cur.execute("SELECT id FROM requests WHERE ticket_id = ?", (ticket_id,))
+            return cur.fetchone() is not None
+
+    def owner(self, ticket_id: str, cursor=None) -> Optional[tuple]:
+        with self.storage.transaction(cursor) as cur:
+            cur.execute("""
+                SELECT user_id, problem
+                FROM requests
+                WHERE ticket_id = ?
+            """, (ticket_id,))
+            return cur.fetchone()
+
+    # Смена статуса; возвращает (user_id, problem) или None, если заявка не изменена.
+    # Повторная установка того же статуса (двойное нажатие кнопки) ничего не меняет,
+    # поэтому уведомления о смене статуса не отправляются дважды
+    def set_status(self, ticket_id: str, status: str, user_id: Optional[int] = None, cursor=None) -> Optional[tuple]:
+        with self.storage.transaction(cursor) as cur:
+            if user_id is None:
+                cur.execute("""
+                    UPDATE requests
+                    SET status = ?,
+                        last_update = ?
+                    WHERE ticket_id = ?
+                    AND status <> ?
+                """, (status, epoch_now(), ticket_id, status))
+            else:
+                cur.execute("""
+                    UPDATE requests
+                    SET status = ?,
+                        last_update = ?
+                    WHERE ticket_id = ?
+                    AND user_id = ?
+                    AND status <> ?
+                """, (status, epoch_now(), ticket_id, user_id, status))
+            if cur.rowcount <= 0:
+                return None
+            return self.owner(ticket_id, cursor=cur)
+
+    def set_rating(self, ticket_id: str, rating: int, cursor=None):
+        with self.storage.transaction(cursor) as cur:
+            cur.execute("""
+                UPDATE requests
+                SET satisfaction_rating = ?,
+                    last_update = ?
+                WHERE ticket_id = ?
+            """, (rating, epoch_now(), ticket_id))
+
+    def touch(self, ticket_id: str, cursor=None):
+        with self.storage.transaction(cursor) as cur:
+            cur.execute("""
+                UPDATE requests
+                SET last_update = ?
+                WHERE ticket_id = ?
+            """, (epoch_now(), ticket_id))
+
+    def details(self, ticket_id: str, cursor=None) -> Optional[tuple]:
+        with self.storage.transaction(cursor) as cur:
+            cur.execute("""
+                SELECT id, problem, status, created_at, last_update, user_id, category, priority
+                FROM requests
+                WHERE ticket_id = ?
+            """, (ticket_id,))
+            return cur.fetchone()
+
+    def admin_details(self, ticket_id: str, cursor=None) -> Optional[tuple]:
+        with self.storage.transaction(cursor) as cur:
+            cur.execute("""
+                SELECT r.id, r.problem, r.status, r.created_at, r.priority,
+                       u.username, u.first_name, u.last_name, u.user_id
+                FROM requests r
+                JOIN users u ON r.user_id = u.user_id
+                WHERE r.ticket_id = ?
+            """, (ticket_id,))
+            return cur.fetchone()
+
+    # Время создания заявок пользователя начиная с since (по индексу idx_requests_user)
+    def created_since(self, user_id: int, since: int) -> List[int]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT created_at
+                FROM requests
+                WHERE user_id = ?
+                AND created_at >= ?
+                ORDER BY created_at
+            """, (user_id, since))
+            return [row[0] for row in cur.fetchall()]
+
+    def list_for_user(self, user_id: int) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT ticket_id, problem, status, created_at, priority
+                FROM requests
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+            """, (user_id,))
+            return cur.fetchall()
+
+    def recent(self, limit: int = 50) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT r.ticket_id, r.problem, r.status, r.created_at, r.priority,
+                       u.username, u.first_name, u.last_name
+                FROM requests r
+                JOIN users u ON r.user_id = u.user_id
+                ORDER BY r.created_at DESC
+                LIMIT ?
+            """, (limit,))
+            return cur.fetchall()
+
+    def active(self, limit: int = 10) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT r.ticket_id, r.problem, r.status, r.created_at, 
+                       u.username, u.first_name, u.last_name
+                FROM requests r
+                JOIN users u ON r.user_id = u.user_id
+                WHERE r.status != 'Закрыто'
+                ORDER BY 
+                    CASE r.status
+                        WHEN 'Открыто' THEN 1
+                        WHEN 'Решено' THEN 2
+                        ELSE 3
+                    END,
+                    r.created_at DESC
+                LIMIT ?
+            """, (limit,))
+            return cur.fetchall()
+
+    # Закрытие открытых заявок без изменений с момента cutoff; возвращает закрытые заявки
+    def close_inactive(self, cutoff: int) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT r.ticket_id, r.user_id, r.problem
+                FROM requests r
+                WHERE r.status = 'Открыто'
+                AND r.last_update < ?
+            """, (cutoff,))
+            inactive = cur.fetchall()
+            now = epoch_now()
+            cur.executemany("""
+                UPDATE requests
+                SET status = 'Закрыто',
+                    last_update = ?
+                WHERE ticket_id = ?
+            """, [(now, ticket_id) for ticket_id, _, _ in inactive])
+            return inactive
+
+    # Условие WHERE для массовой операции. Повторная заявка - та, у которой есть более ранняя
+    # заявка того же пользователя той же категории с тем же текстом (поиск по индексу user_id)
+    @staticmethod
+    def _bulk_where(criteria: BulkFilter) -> tuple:
+        conditions, params = ["requests.status = ?"], [criteria.status]
+        if criteria.category is not None:
+            conditions.append("requests.category = ?")
+            params.append(criteria.category)
+        if criteria.created_before is not None:
+            conditions.append("requests.created_at < ?")
+            params.append(criteria.created_before)
+        if criteria.duplicates:
+            conditions.append("""EXISTS (
+                    SELECT 1 FROM requests d
+                    WHERE d.user_id = requests.user_id
+                    AND d.category = requests.category
+                    AND TRIM(d.problem) = TRIM(requests.problem)
+                    AND d.id < requests.id
+                )""")
+        if criteria.max_id is not None:
+            conditions.append("requests.id <= ?")
+            params.append(criteria.max_id)
+        return " AND ".join(conditions), params
+
+    # Предпросмотр массовой операции: число подходящих заявок и номер последней из них
+    def bulk_count(self, criteria: BulkFilter) -> tuple:
+        where, params = self._bulk_where(criteria)
+        with self.storage.transaction() as cur:
+            cur.execute(f"SELECT COUNT(*), MAX(id) FROM requests WHERE {where}", params)
+            return cur.fetchone()
+
+    # Массовое изменение одним UPDATE: новый статус или назначение агенту.
+    # RETURNING отдает измененные заявки тем же запросом: (id, ticket_id, user_id, problem)
+    def bulk_update(self, criteria: BulkFilter, status: Optional[str] = None,
+                    assigned_to: Optional[int] = None, cursor=None) -> List[tuple]:
+        where, params = self._bulk_where(criteria)
+        column, value = ("status", status) if status is not None else ("assigned_to", assigned_to)
+        with self.storage.transaction(cursor) as cur:
+            cur.execute(f"""
+                UPDATE requests
+                SET {column} = ?,
+                    last_update = ?
+                WHERE {where}
+                RETURNING id, ticket_id, user_id, problem
+            """, [value, epoch_now(), *params])
+            return cur.fetchall()
+
+    # Заявки с данными пользователя и перепиской для выгрузки: строка на сообщение (заявка
+    # без сообщений - одна строка с пустыми полями сообщения), по порядку заявок и сообщений
+    def export_rows(self, since: Optional[int] = None, batch_size: int = 1000):
+        where, params = ("WHERE r.created_at >= ?", (since,)) if since is not None else ("", ())
+        return self.storage.stream(f"""
+            SELECT r.id, r.ticket_id, r.user_id, u.username, u.first_name, u.last_name,
+                   r.category, r.problem, r.status, r.priority, r.created_at, r.last_update,
+                   r.assigned_to, r.satisfaction_rating,
+                   m.id, m.sender_id, m.message_text, m.sent_at
+            FROM requests r
+            LEFT JOIN users u ON u.user_id = r.user_id
+            LEFT JOIN request_messages m ON m.request_id = r.id
+            {where}
+            ORDER BY r.id, m.sent_at, m.id
+        """, params, batch_size)
+
+    def summary(self) -> tuple:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT 
+                    COUNT(*) as total_requests,
+                    SUM(CASE WHEN status = 'Решено' THEN 1 ELSE 0 END) as solved_requests,
+                    AVG(response_time) as avg_response_time,
+                    AVG(satisfaction_rating) as avg_rating
+                FROM requests
+            """)
+            total, solved, avg_time, avg_rating = cur.fetchone()
+        return total, solved or 0, _as_float(avg_time), _as_float(avg_rating)
+
+    def count_by_category(self) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT category, COUNT(*) as count
+                FROM requests
+                GROUP BY category
+                ORDER BY count DESC
+            """)
+            return cur.fetchall()
+
+    def count_by_hour(self) -> List[tuple]:
+        hour = moscow_hour_sql("created_at")
+        with self.storage.transaction() as cur:
+            cur.execute(f"""
+                SELECT {hour} as hour, COUNT(*) as count
+                FROM requests
+                GROUP BY {hour}
+                ORDER BY hour
+            """)
+            return cur.fetchall()
+
+    def count_by_weekday(self) -> List[tuple]:
+        weekday = moscow_weekday_sql("created_at")
+        with self.storage.transaction() as cur:
+            cur.execute(f"""
+                SELECT {weekday} as weekday, COUNT(*) as count
+                FROM requests
+                GROUP BY {weekday}
+                ORDER BY weekday
+            """)
+            return cur.fetchall()
+
+    def priority_stats(self) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT 
+                    priority,
+                    COUNT(*) as count,
+                    AVG(response_time) as avg_time
+                FROM requests
+                GROUP BY priority
+                ORDER BY count DESC
+            """)
+            return [(priority, count, _as_float(avg_time)) for priority, count, avg_time in cur.fetchall()]
+
+# AVG в PostgreSQL возвращает Decimal
+def _as_float(value):
+    return float(value) if value is not None else None
+
+class MessageRepository:
+    def __init__(self, storage):
+        self.storage = storage
+
+    # Добавление сообщения; key - ключ идемпотентности (например, чат и номер сообщения Telegram).
+    # Возвращает False, если сообщение с таким ключом уже сохранено
+    def add(self, ticket_id: str, sender_id: int, text: str, key: Optional[str] = None, cursor=None) -> bool:
+        with self.storage.transaction(cursor) as cur:
+            cur.execute("""
+                INSERT INTO request_messages (request_id, sender_id, message_text, sent_at, idempotency_key)
+                VALUES (
+                    (SELECT id FROM requests WHERE ticket_id = ?),
+                    ?,
+                    ?,
+                    ?,
+                    ?
+                )
+                ON CONFLICT(idempotency_key) DO NOTHING
+            """, (ticket_id, sender_id, text, epoch_now(), key))
+            return cur.rowcount > 0
+
+    # Пакетное добавление сообщений по id заявок: [(request_id, sender_id, text)]
+    def add_many(self, messages: List[tuple], cursor=None):
+        with self.storage.transaction(cursor) as cur:
+            now = epoch_now()
+            cur.executemany("""
+                INSERT INTO request_messages (request_id, sender_id, message_text, sent_at)
+                VALUES (?, ?, ?, ?)
+            """, [(request_id, sender_id, text, now) for request_id, sender_id, text in messages])
+
+    # Страница истории сообщений заявки: последние HISTORY_PAGE_SIZE сообщений до курсора.
+    # Keyset-запрос по индексу (request_id, sent_at, id) не зависит от длины переписки.
+    # Возвращает сообщения в хронологическом порядке и курсор для более ранней страницы
+    def page(self, request_id: int, before_id: Optional[int] = None, cursor=None) -> tuple:
+        page_size = CONFIG["HISTORY_PAGE_SIZE"]
+        with self.storage.transaction(cursor) as cur:
+            if before_id is None:
+                cur.execute("""
+                    SELECT id, sender_id, message_text, sent_at
+                    FROM request_messages
+                    WHERE request_id = ?
+                    ORDER BY sent_at DESC, id DESC
+                    LIMIT ?
+                """, (request_id, page_size + 1))
+            else:
+                cur.execute("""
+                    SELECT id, sender_id, message_text, sent_at
+                    FROM request_messages
+                    WHERE request_id = ?
+                    AND (sent_at, id) < (SELECT sent_at, id FROM request_messages WHERE id = ?)
+                    ORDER BY sent_at DESC, id DESC
+                    LIMIT ?
+                """, (request_id, before_id, page_size + 1))
+            rows = cur.fetchall()
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        rows.reverse()
+        older_cursor = rows[0][0] if has_older else None
+        return rows, older_cursor
+
+class UserRepository:
+    def __init__(self, storage):
+        self.storage = storage
+
+    # Создание или обновление профиля; строка не переписывается, если данные не изменились
+    def upsert_profile(self, user_id: int, username, first_name, last_name):
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                INSERT INTO users (user_id, username, first_name, last_name, registration_date)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
+                WHERE COALESCE(users.username, '') <> COALESCE(excluded.username, '')
+                   OR COALESCE(users.first_name, '') <> COALESCE(excluded.first_name, '')
+                   OR COALESCE(users.last_name, '') <> COALESCE(excluded.last_name, '')
+            """, (user_id, username, first_name, last_name, epoch_now()))
+
+    # Пакетная запись активности: rows - (user_id, last_activity, новых заявок)
+    def flush_activity(self, rows: List[tuple]):
+        with self.storage.transaction() as cur:
+            cur.executemany("""
+                INSERT INTO users (user_id, registration_date, last_activity, requests_count)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    last_activity = CASE
+                        WHEN users.last_activity IS NULL OR excluded.last_activity > users.last_activity
+                        THEN excluded.last_activity
+                        ELSE users.last_activity
+                    END,
+                    requests_count = users.requests_count + excluded.requests_count
+            """, [(user_id, last_activity, last_activity, count) for user_id, last_activity, count in rows])
+
+    def refresh_stats(self, user_id: int):
+        with self.storage.transaction() as cur:
+            # Обновление количества решенных проблем
+            cur.execute("""
+                UPDATE users
+                SET solved_issues = (
+                    SELECT COUNT(*)
+                    FROM requests
+                    WHERE user_id = ?
+                    AND status = 'Решено'
+                )
+                WHERE user_id = ?
+            """, (user_id, user_id))
+
+            # Обновление среднего времени ответа
+            cur.execute("""
+                UPDATE users
+                SET avg_response_time = (
+                    SELECT AVG(response_time)
+                    FROM requests
+                    WHERE user_id = ?
+                    AND response_time IS NOT NULL
+                )
+                WHERE user_id = ?
+            """, (user_id, user_id))
+
+            # Обновление рейтинга
+            cur.execute("""
+                UPDATE users
+                SET rating = (
+                    SELECT AVG(satisfaction_rating)
+                    FROM requests
+                    WHERE user_id = ?
+                    AND satisfaction_rating IS NOT NULL
+                )
+                WHERE user_id = ?
+            """, (user_id, user_id))
+
+    def list_all(self) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT user_id, username, first_name, last_name, 
+                       requests_count, rating, solved_issues, avg_response_time
+                FROM users
+                ORDER BY requests_count DESC
+            """)
+            return cur.fetchall()
+
+    def admin_mode(self, user_id: int) -> Optional[bool]:
+        with self.storage.transaction() as cur:
+            cur.execute("SELECT enabled FROM admin_sessions WHERE user_id = ?", (user_id,))
+            row = cur.fetchone()
+        return bool(row[0]) if row else None
+
+    def set_admin_mode(self, user_id: int, enabled: bool):
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                INSERT INTO admin_sessions (user_id, enabled) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET enabled = excluded.enabled
+            """, (user_id, int(enabled)))
+
+class NotificationRepository:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def add_many(self, user_id: int, messages: List[str]):
+        with self.storage.transaction() as cur:
+            now = epoch_now()
+            cur.executemany("""
+                INSERT INTO notifications (user_id, message, created_at)
+                VALUES (?, ?, ?)
+            """, [(user_id, message, now) for message in messages])
+
+    def recent(self, limit: int = 50) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT id, message, created_at, is_read
+                FROM notifications
+                ORDER BY created_at DESC
+                LIMIT ?
+            """, (limit,))
+            return cur.fetchall()
+
+    # Удаление одной пачки уведомлений старше cutoff; возвращает число удаленных
+    def prune(self, cutoff: int, batch_size: int) -> int:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                DELETE FROM notifications
+                WHERE id IN (
+                    SELECT id FROM notifications
+                    WHERE created_at < ?
+                    LIMIT ?
+                )
+            """, (cutoff, batch_size))
+            return cur.rowcount
+
+# Служебное состояние бота: именованные целые значения
+class StateRepository:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get(self, name: str) -> Optional[int]:
+        with self.storage.transaction() as cur:
+            cur.execute("SELECT value FROM bot_state WHERE name = ?", (name,))
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    # Значение только растет: запись меньшего значения игнорируется
+    def advance(self, name: str, value: int):
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                INSERT INTO bot_state (name, value) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET value = excluded.value
+                WHERE excluded.value > bot_state.value
+            """, (name, value))
+
+class FeedbackRepository:
+    def __init__(self, storage):
+        self.storage = storage
+
+    # Решенные заявки пользователя, еще не получившие оценку
+    def pending(self, user_id: int) -> List[tuple]:
+        with self.storage.transaction() as cur:
+            cur.execute("""
+                SELECT r.ticket_id, r.problem
+                FROM requests r
+                WHERE r.user_id = ?
+                AND r.status = 'Решено'
+                AND r.satisfaction_rating IS NULL
+                ORDER BY r.created_at DESC
+            """, (user_id,))
+            return cur.fetchall()
+
+# Хранилище отчетов: в PostgreSQL чтение не блокирует запись, для SQLite - снимок базы
+def create_report_storage():
+    if storage.name != "sqlite" or not CONFIG["ANALYTICS_SNAPSHOT_SECONDS"]:
+        return storage
+    suffix = f".worker{WORKER_INDEX}" if WORKER_INDEX >= 0 else ""
+    return SnapshotStorage(DB_NAME, f"{DB_NAME}{suffix}.snapshot", CONFIG["ANALYTICS_SNAPSHOT_SECONDS"])
+
+storage = create_storage()
+ticket_repo = TicketRepository(storage)
+message_repo = MessageRepository(storage)
+user_repo = UserRepository(storage)
+notification_repo = NotificationRepository(storage)
+feedback_repo = FeedbackRepository(storage)
+state_repo = StateRepository(storage)
+
+report_storage = create_report_storage()
+report_tickets = TicketRepository(report_storage)
+report_users = UserRepository(report_storage)
+if isinstance(report_storage, SnapshotStorage):
+    metrics.gauge("bot_analytics_snapshot_age_seconds", report_storage.age)
+
+# Инициализация базы данных
+def init_database():
+    if storage.name != "sqlite":
+        storage.init_schema()
+        return
+    with DatabaseConnection(DB_NAME) as cursor:
+        # Новая база сразу создается в инкрементальном режиме auto_vacuum (до первой таблицы
+        # режим меняется без VACUUM); для существующей команда ничего не делает
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+        # Таблица пользователей
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registration_date INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            last_activity INTEGER,
+            requests_count INTEGER DEFAULT 0,
+            is_banned BOOLEAN DEFAULT 0,
+            rating REAL DEFAULT 0,
+            solved_issues INTEGER DEFAULT 0,
+            avg_response_time INTEGER DEFAULT 0
+        )
+        """)
+
+        # Таблица заявок
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id TEXT UNIQUE,
+            user_id INTEGER,
+            category TEXT,
+            problem TEXT,
+            status TEXT DEFAULT 'Открыто',
+            priority TEXT DEFAULT 'Средний',
+            created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            last_update INTEGER,
+            assigned_to INTEGER,
+            response_time INTEGER,
+            satisfaction_rating INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """)
+
+        # Добавляем недостающие колонки, если они не существуют
+        try:
+            cursor.execute("ALTER TABLE requests ADD COLUMN response_time INTEGER")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+
+        try:
+            cursor.execute("ALTER TABLE requests ADD COLUMN satisfaction_rating INTEGER")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+
+        # Таблица сообщений заявки
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS request_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER,
+            sender_id INTEGER,
+            message_text TEXT,
+            sent_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            is_internal BOOLEAN DEFAULT 0,
+            idempotency_key TEXT,
+            FOREIGN KEY (request_id) REFERENCES requests(id)
+        )
+        """)
+
+        try:
+            cursor.execute("ALTER TABLE request_messages ADD COLUMN idempotency_key TEXT")
+        except sqlite3.OperationalError:
+            pass  # Колонка уже существует
+
+        # Таблица отзывов
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS feedback (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            request_id INTEGER,
+            user_id INTEGER,
+            rating INTEGER,
+            comment TEXT,
+            created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            FOREIGN KEY (request_id) REFERENCES requests(id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """)
+
+        # Таблица уведомлений
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            message TEXT,
+            is_read BOOLEAN DEFAULT 0,
+            created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        """)
+
+        # Режим администратора (общий для процессов-обработчиков)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS admin_sessions (
+            user_id INTEGER PRIMARY KEY,
+            enabled BOOLEAN DEFAULT 0
+        )
+        """)
+
+        # Служебное состояние бота (последний обработанный update_id)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            name TEXT PRIMARY KEY,
+            value INTEGER
+        )
+        """)
+
+        # Индекс для выборок заявок пользователя
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_requests_user ON requests(user_id, created_at)")
+
+        # Ключ идемпотентности: повторная доставка того же сообщения не добавляет строку
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_request_messages_idempotency
+            ON request_messages(idempotency_key)
+        """)
+
+        # Индекс для постраничного чтения истории сообщений заявки
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_request_messages_thread
+            ON request_messages(request_id, sent_at, id)
+        """)
+
+        # Миграции данных: номер последней примененной хранится в PRAGMA user_version
+        cursor.execute("PRAGMA user_version")
+        schema_version = cursor.fetchone()[0]
+
+        if schema_version < 1:
+            # Заполняем requests_count и last_activity, которые раньше не обновлялись
+            cursor.execute("""
+                UPDATE users
+                SET requests_count = (
+                        SELECT COUNT(*) FROM requests r WHERE r.user_id = users.user_id
+                    ),
+                    last_activity = COALESCE(last_activity, (
+                        SELECT MAX(COALESCE(r.last_update, r.created_at))
+                        FROM requests r
+                        WHERE r.user_id = users.user_id
+                    ))
+            """)
+            cursor.execute("PRAGMA user_version = 1")
+
+        if schema_version < 2:
+            # Текстовые метки CURRENT_TIMESTAMP (UTC) переводятся в секунды эпохи
+            for table, column in TIMESTAMP_COLUMNS:
+                cursor.execute(f"""
+                    UPDATE {table}
+                    SET {column} = CAST(strftime('%s', {column}) AS INTEGER)
+                    WHERE typeof({column}) = 'text'
+                """)
+            # last_update заполнен всегда, чтобы выборки по времени обновления шли по индексу
+            cursor.execute("UPDATE requests SET last_update = created_at WHERE last_update IS NULL")
+            cursor.execute("PRAGMA user_version = 2")
+
+        if schema_version < 3:
+            # Столбцы времени баз, созданных до перехода на эпоху, объявлены с DEFAULT
+            # CURRENT_TIMESTAMP (текст). ALTER TABLE в SQLite умолчание не меняет, поэтому оно
+            # заменяется прямо в схеме таблицы: изменение умолчания допустимо через writable_schema
+            # и не требует перестройки таблиц
+            cursor.execute("""
+                SELECT name, sql FROM sqlite_master
+                WHERE type = 'table' AND sql LIKE '%DEFAULT CURRENT_TIMESTAMP%'
+            """)
+            legacy_tables = cursor.fetchall()
+            if legacy_tables:
+                cursor.execute("PRAGMA schema_version")
+                schema_cookie = cursor.fetchone()[0]
+                cursor.execute("PRAGMA writable_schema = ON")
+                for name, sql in legacy_tables:
+                    cursor.execute(
+                        "UPDATE sqlite_master SET sql = ? WHERE type = 'table' AND name = ?",
+                        (sql.replace("DEFAULT CURRENT_TIMESTAMP", "DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))"), name)
+                    )
+                cursor.execute(f"PRAGMA schema_version = {schema_cookie + 1}")
+                cursor.execute("PRAGMA writable_schema = OFF")
+            cursor.execute("PRAGMA user_version = 3")
+
+        # Индексы для выборок по времени: автозакрытие и архивирование, очистка уведомлений
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_requests_status_update ON requests(status, last_update)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_created ON notifications(created_at)")
+
+# Инициализация бота
+apihelper.ENABLE_MIDDLEWARE = True  # Нужно до создания TeleBot
+try:
+    bot = telebot.TeleBot(BOT_TOKEN)
+    logger.info("Bot initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize bot: {e}")
+    print(f"❌ Ошибка инициализации бота: {e}")
+    sys.exit(1)
+
+# Замер времени и ошибок вызовов Telegram Bot API
+_original_make_request = apihelper._make_request
+
+def _timed_make_request(token, method_name, method='get', params=None, files=None):
+    started = time.perf_counter()
+    try:
+        return _original_make_request(token, method_name, method=method, params=params, files=files)
+    except Exception as e:
+        metrics.inc("bot_telegram_api_errors_total", {"method": method_name, "error": type(e).__name__})
+        raise
+    finally:
+        metrics.observe("bot_telegram_api_duration_seconds", {"method": method_name}, time.perf_counter() - started)
+
+apihelper._make_request = _timed_make_request
+
+# Глубина очередей: задачи пула обработчиков, ожидающие шаги диалога, незавершенные заявки
+metrics.gauge("bot_worker_queue_depth", lambda: bot.worker_pool.tasks.qsize() if bot.threaded else 0)
+metrics.gauge(
+    "bot_pending_next_step_handlers",
+    lambda: sum(len(handlers) for handlers in getattr(bot.next_step_backend, 'handlers', {}).values())
+)
+metrics.gauge("bot_temp_data_entries", lambda: len(temp_data))
+
+# Функция для создания клавиатуры с категориями проблем
+def get_problems_keyboard():
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for category_id, category_data in problems.items():
+        markup.add(types.InlineKeyboardButton(
+            f"{category_data['icon']} {category_data['title']}",
+            callback_data=f"cat_{category_id}"
+        ))
+    markup.add(types.InlineKeyboardButton("📞 Связаться с поддержкой", callback_data="support"))
+    markup.add(types.InlineKeyboardButton("📊 Мои заявки", callback_data="my_requests"))
+    markup.add(types.InlineKeyboardButton("ℹ️ Помощь", callback_data="help"))
+    return markup
+
+# Функция для создания админ-клавиатуры
+def get_admin_keyboard():
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        types.InlineKeyboardButton("💬 Чат заявок", callback_data="admin_tickets_chat"),
+        types.InlineKeyboardButton("📋 Все заявки", callback_data="admin_all_requests")
+    )
+    markup.add(
+        types.InlineKeyboardButton("📊 Статистика", callback_data="admin_stats"),
+        types.InlineKeyboardButton("👥 Пользователи", callback_data="admin_users")
+    )
+    markup.add(
+        types.InlineKeyboardButton("⚙️ Настройки", callback_data="admin_settings"),
+        types.InlineKeyboardButton("🔔 Уведомления", callback_data="admin_notifications")
+    )
+    markup.add(
+        types.InlineKeyboardButton("📈 Аналитика", callback_data="admin_analytics"),
+        types.InlineKeyboardButton("🩺 Профилирование", callback_data="admin_profile")
+    )
+    markup.add(
+        types.InlineKeyboardButton("💾 Резервные копии", callback_data="admin_backup"),
+        types.InlineKeyboardButton("🧹 Массовые операции", callback_data="admin_bulk")
+    )
+    markup.add(types.InlineKeyboardButton("📤 Выгрузка заявок", callback_data="admin_export"))
+    return markup
+
+# Функция для создания клавиатуры с приоритетами
+def get_priority_keyboard():
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    for priority, level in CONFIG["PRIORITY_LEVELS"].items():
+        markup.add(types.InlineKeyboardButton(
+            f"{'🔴' if level > 2 else '🟡' if level > 1 else '🟢'} {priority}",
+            callback_data=f"priority_{priority}"
+        ))
+    return markup
+
+# Функция для создания клавиатуры с оценками
+def get_rating_keyboard():
+    markup = types.InlineKeyboardMarkup(row_width=5)
+    for i in range(1, 6):
+        markup.add(types.InlineKeyboardButton(
+            "⭐" * i,
+            callback_data=f"rate_{i}"
+        ))
+    return markup
+
+# Разбивка текста на части не длиннее limit по границам строк.
+# Строки длиннее лимита режутся принудительно; у пустого текста частей нет
+def split_message(text: str, limit: Optional[int] = None) -> List[str]:
+    limit = limit or CONFIG["MAX_MESSAGE_LENGTH"]
+    if not text.strip():
+        return []
+    if len(text) <= limit:
+        return [text]
+
+    chunks = []
+    current = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                chunks.append("".join(current))
+                current, size = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if size + len(line) > limit:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+# Отправка длинного отчета: части уходят по порядку, клавиатура - только у последней.
+# Пустой текст - ошибка вызывающего: молча ничего не отправить нельзя
+def send_long_message(chat_id: int, parts, reply_markup=None):
+    text = parts if isinstance(parts, str) else "".join(parts)
+    chunks = split_message(text)
+    if not chunks:
+        raise ValueError("message text is empty")
+    sent = None
+    for index, chunk in enumerate(chunks):
+        is_last = index == len(chunks) - 1
+        sent = bot.send_message(chat_id, chunk, reply_markup=reply_markup if is_last else None)
+    return sent
+
+# Экран меню - сообщение бота с inline-клавиатурой: такие сообщения можно редактировать
+def is_menu_message(message) -> bool:
+    return (
+        message.from_user is not None and message.from_user.is_bot
+        and message.content_type == "text"
+        and isinstance(message.reply_markup, types.InlineKeyboardMarkup)
+    )
+
+def screen_unchanged(message, text: str, reply_markup) -> bool:
+    if (message.text or "") != text.strip():
+        return False
+    current = message.reply_markup.to_dict() if message.reply_markup else None
+    new = reply_markup.to_dict() if reply_markup else None
+    return current == new
+
+# Показ экрана навигации. Если вызов пришел из нашего меню, сообщение редактируется на месте,
+# неизменившийся экран не отправляется повторно; иначе (или если редактирование невозможно)
+# отправляется новое сообщение
+def show_screen(message, parts, reply_markup=None):
+    text = parts if isinstance(parts, str) else "".join(parts)
+    if is_menu_message(message) and len(text) <= CONFIG["MAX_MESSAGE_LENGTH"]:
+        if screen_unchanged(message, text, reply_markup):
+            metrics.inc("bot_screen_updates_total", {"mode": "unchanged"})
+            return message
+        try:
+            result = bot.edit_message_text(
+                text,
+                message.chat.id,
+                message.message_id,
+                reply_markup=reply_markup
+            )
+            metrics.inc("bot_screen_updates_total", {"mode": "edit"})
+            return result
+        except apihelper.ApiTelegramException as e:
+            if "message is not modified" in str(e.description):
+                metrics.inc("bot_screen_updates_total", {"mode": "unchanged"})
+                return message
+            logger.debug(
+                "Cannot edit message %s, sending a new one: %s", message.message_id, e,
+                extra={"chat_id": message.chat.id}
+            )
+    metrics.inc("bot_screen_updates_total", {"mode": "send"})
+    return send_long_message(message.chat.id, text, reply_markup=reply_markup)
+
+# Доставка накопленных уведомлений пользователю: одна запись в историю на событие
+# и одно сообщение в Telegram на всю пачку
+def deliver_notifications(user_id: int, messages: List[str]):
+    try:
+        for attempt in range(3):  # Try up to 3 times
+            try:
+                notification_repo.add_many(user_id, messages)
+                break  # If successful, break the retry loop
+            except sqlite3.OperationalError as e:
+                if "database is locked" in str(e) and attempt < 2:
+                    metrics.inc("bot_db_lock_retries_total", {"site": "send_notification"})
+                    time.sleep(0.1 * (attempt + 1))  # Exponential backoff
+                    continue
+                raise
+            except Exception as e:
+                raise
+
+        if len(messages) == 1:
+            text = f"🔔 {messages[0]}"
+        else:
+            parts = [f"🔔 Обновления по вашим заявкам ({len(messages)}):\n"]
+            for message in messages:
+                parts.append(f"\n• {message}\n")
+            text = "".join(parts)
+        send_long_message(user_id, text)
+        metrics.inc("bot_notifications_total", {"delivery": "single" if len(messages) == 1 else "digest"}, len(messages))
+    except Exception as e:
+        logger.error(f"Error sending notification: {e}")
+        # Don't re-raise the exception to prevent breaking the main flow
+
+# Накопитель уведомлений: события одного пользователя, пришедшие в течение окна
+# NOTIFICATION_DIGEST_SECONDS с момента первого из них, уходят одним сообщением
+class NotificationDigest:
+    def __init__(self, window: float):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()  # user_id -> (время первого события, сообщения)
+
+    def add(self, user_id: int, message: str):
+        with self._lock:
+            if user_id not in self._pending:
+                self._pending[user_id] = (time.monotonic(), [])
+            self._pending[user_id][1].append(message)
+
+    # Постановка в очередь пачки уведомлений разным пользователям: [(user_id, сообщение)]
+    def add_many(self, items: List[tuple]):
+        now = time.monotonic()
+        with self._lock:
+            for user_id, message in items:
+                if user_id not in self._pending:
+                    self._pending[user_id] = (now, [])
+                self._pending[user_id][1].append(message)
+
+    def take(self, user_id: int) -> List[str]:
+        with self._lock:
+            entry = self._pending.pop(user_id, None)
+        return entry[1] if entry else []
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(messages) for _, messages in self._pending.values())
+
+    def flush(self, force: bool = False) -> int:
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                user_id for user_id, (first_at, _) in self._pending.items()
+                if force or now - first_at >= self.window
+            ]
+            batches = [(user_id, self._pending.pop(user_id)[1]) for user_id in due]
+        for user_id, messages in batches:
+            deliver_notifications(user_id, messages)
+        return len(batches)
+
+    def run(self, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing notifications: {e}")
+
+notification_digest = NotificationDigest(CONFIG["NOTIFICATION_DIGEST_SECONDS"])
+metrics.gauge("bot_notifications_pending", notification_digest.pending)
+atexit.register(notification_digest.flush, True)
+
+# Функция для отправки уведомления. Обычные уведомления объединяются в дайджест,
+# критичные отправляются сразу (вместе с уже накопленными, чтобы сохранить порядок)
+def send_notification(user_id: int, message: str, critical: bool = False):
+    if critical or notification_digest.window <= 0:
+        deliver_notifications(user_id, notification_digest.take(user_id) + [message])
+    else:
+        notification_digest.add(user_id, message)
+
+# Рабочее время поддержки по Москве; смена может переходить через полночь (start > end),
+# одинаковые start и end означают круглосуточную работу
+def support_hours_open(at: int) -> bool:
+    hour = datetime.fromtimestamp(at, MOSCOW_TZ).hour
+    start, end = CONFIG["SUPPORT_HOURS"]["start"], CONFIG["SUPPORT_HOURS"]["end"]
+    if start == end:
+        return True
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+# Последний нерабочий период перед началом текущей (или последней) смены: (начало, конец)
+def last_off_hours(at: int) -> tuple:
+    local = datetime.fromtimestamp(at, MOSCOW_TZ)
+    shift_start = local.replace(hour=CONFIG["SUPPORT_HOURS"]["start"], minute=0, second=0, microsecond=0)
+    if shift_start > local:
+        shift_start -= timedelta(days=1)
+    shift_end = shift_start.replace(hour=0) + timedelta(hours=CONFIG["SUPPORT_HOURS"]["end"])
+    while shift_end > shift_start:
+        shift_end -= timedelta(days=1)
+    return int(shift_end.timestamp()), int(shift_start.timestamp())
+
+# Маршрутизация оповещений о новых заявках в чат поддержки и агентам. В рабочее время
+# оповещение уходит сразу; вне его срочные заявки (приоритет «Критический»,
+# URGENT_PRIORITY_LEVEL) оповещают сразу, остальные не отправляются, а с началом смены
+# приходит одна сводка по заявкам за ночь, которые все еще открыты. Сводка собирается
+# из базы, поэтому перезапуск бота ночью ничего не теряет; отметка отправленной сводки
+# хранится в bot_state
+class TicketAlertRouter:
+    state_name = "alerts_released_until"
+
+    def __init__(self, chats: List, urgent_level: int):
+        self.chats = chats
+        self.urgent_level = urgent_level
+
+    def is_urgent(self, priority: str) -> bool:
+        return CONFIG["PRIORITY_LEVELS"].get(priority, 0) >= self.urgent_level
+
+    # Отправка во все чаты маршрута; если ни один не доступен - администратору
+    def deliver(self, text: str) -> int:
+        delivered = 0
+        for chat_id in self.chats:
+            try:
+                send_long_message(chat_id, text)
+                delivered += 1
+            except Exception as e:
+                logger.error(f"Error sending ticket alert to {chat_id}: {e}")
+        if not delivered and ADMIN_ID not in self.chats:
+            send_long_message(ADMIN_ID, text)
+            delivered += 1
+        return delivered
+
+    def new_ticket(self, text: str, priority: str, created_at: int):
+        if support_hours_open(created_at):
+            route = "immediate"
+            self.deliver(text)
+        elif self.is_urgent(priority):
+            route = "urgent"
+            self.deliver(f"🚨 Срочная заявка вне рабочего времени\n\n{text}")
+        else:
+            route = "held"
+        metrics.inc("bot_ticket_alerts_total", {"route": route})
+
+    # Сводка по заявкам, оповещения о которых были отложены; возвращает число заявок в ней
+    def release(self, now: Optional[int] = None) -> int:
+        now = now or epoch_now()
+        if not support_hours_open(now):
+            return 0
+        held_from, held_until = last_off_hours(now)
+        released = state_repo.get(self.state_name)
+        if held_from >= held_until or (released is not None and released >= held_until):
+            return 0
+
+        tickets = [
+            ticket for ticket in ticket_repo.open_created_between(held_from, held_until)
+            if not self.is_urgent(ticket[3])
+        ]
+        if tickets:
+            parts = [
+                f"🌅 Заявки вне рабочего времени ({format_time(held_from)} - {format_time(held_until)} МСК): "
+                f"{len(tickets)}\n\n"
+            ]
+            for ticket_id, category, problem, priority, created_at in tickets:
+                title = problems[category]['title'] if category in problems else category
+                parts.append(
+                    f"🆕 #{ticket_id} - {format_time(created_at)}\n"
+                    f"{title}, приоритет: {priority}\n"
+                    f"{problem[:100]}\n\n"
+                )
+            self.deliver("".join(parts))
+        state_repo.advance(self.state_name, held_until)
+        logger.info(f"Released off-hours ticket summary: {len(tickets)} tickets")
+        return len(tickets)
+
+    def run(self, interval: float):
+        while True:
+            try:
+                self.release()
+            except Exception as e:
+                logger.error(f"Error releasing ticket alerts: {e}")
+            time.sleep(interval)
+
+alert_router = TicketAlertRouter([SUPPORT_CHAT_ID] + SUPPORT_AGENT_IDS, CONFIG["URGENT_PRIORITY_LEVEL"])
+
+# Отрисованная карточка заявки и поля, от которых зависят кнопки
+# older_cursor - id самого раннего показанного сообщения, если есть более ранние
+TicketView = collections.namedtuple("TicketView", ["text", "status", "user_id", "older_cursor"])
+
+# Ограниченный кэш отрисованных заявок (по страницам истории). Каждая запись хранит версию
+# заявки на момент чтения: операции записи увеличивают версию, и устаревшие записи
+# (в т.ч. прочитанные параллельно с изменением) больше не выдаются и вытесняются по LRU.
+# Версия заявки, вытесненной из таблицы версий, не возвращается к нулю: версией по умолчанию
+# служит наибольшая вытесненная, поэтому записи, прочитанные до изменения, не оживают
+class TicketViewCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._versions = collections.OrderedDict()
+        self._counter = itertools.count(1)
+        self._floor = 0  # Версия заявок, которых нет в _versions
+        self.listeners = []  # Вызываются при сбросе заявки (рассылка другим процессам)
+
+    def version(self, ticket_id: str) -> int:
+        with self._lock:
+            return self._versions.get(ticket_id, self._floor)
+
+    def get(self, kind: str, ticket_id: str, page: Optional[int] = None):
+        key = (kind, ticket_id, page)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == self._versions.get(ticket_id, self._floor):
+                self._entries.move_to_end(key)
+                metrics.inc("bot_ticket_view_cache_total", {"view": kind, "result": "hit"})
+                return entry[1]
+        metrics.inc("bot_ticket_view_cache_total", {"view": kind, "result": "miss"})
+        return None
+
+    def put(self, kind: str, ticket_id: str, version: int, view, page: Optional[int] = None):
+        key = (kind, ticket_id, page)
+        with self._lock:
+            if version != self._versions.get(ticket_id, self._floor):
+                return  # Заявка изменилась, пока строилось представление
+            self._entries[key] = (version, view)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, ticket_id: str, notify: bool = True):
+        with self._lock:
+            self._versions[ticket_id] = next(self._counter)
+            self._versions.move_to_end(ticket_id)
+            while len(self._versions) > self.capacity * 4:
+                _, evicted = self._versions.popitem(last=False)
+                self._floor = max(self._floor, evicted)
+            for kind in ("details", "admin_chat"):
+                self._entries.pop((kind, ticket_id, None), None)
+        if notify:
+            for listener in self.listeners:
+                listener(ticket_id)
+
+    def __len__(self):
+        return len(self._entries)
+
+ticket_views = TicketViewCache(CONFIG["TICKET_VIEW_CACHE_SIZE"])
+metrics.gauge("bot_ticket_view_cache_entries", lambda: len(ticket_views))
+
+# Функция для автоматического закрытия неактивных заявок
+def auto_close_inactive_requests():
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT r.ticket_id, r.user_id, r.problem
-                FROM requests r
-                WHERE r.status = 'Открыто'
-                AND r.last_update < datetime('now', ?)
-            """, (f"-{CONFIG['AUTO_CLOSE_HOURS']} hours",))
-            
-            inactive_requests = cursor.fetchall()
+        inactive_requests = ticket_repo.close_inactive(epoch_cutoff(hours=CONFIG['AUTO_CLOSE_HOURS']))
+
+        # Уведомления отправляются после фиксации транзакции
+        for ticket_id, user_id, problem in inactive_requests:
+            ticket_views.invalidate(ticket_id)
+
+            send_notification(
+                user_id,
+                f"Ваша заявка #{ticket_id} была автоматически закрыта из-за неактивности."
+            )
             
-            for ticket_id, user_id, problem in inactive_requests:
-                cursor.execute("""
-                    UPDATE requests
-                    SET status = 'Закрыто',
-                        last_update = CURRENT_TIMESTAMP
-                    WHERE ticket_id = ?
-                """, (ticket_id,))
-                
-                send_notification(
-                    user_id,
-                    f"Ваша заявка #{ticket_id} была автоматически закрыта из-за неактивности."
-                )
-                
-                logger.info(f"Auto-closed request {ticket_id}")
+            logger.info(f"Auto-closed request {ticket_id}")
     except Exception as e:
         logger.error(f"Error in auto_close_inactive_requests: {e}")
 
-# Функция для обновления статистики пользователя
-def update_user_stats(user_id: int):
-    try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            # Обновление количества решенных проблем
+# Финальные статусы: такие заявки больше не меняются и могут уйти в архив
+ARCHIVED_STATUSES = ('Закрыто', 'Отменено', 'Отклонено')
+
+# Перенос старых закрытых заявок вместе с перепиской и отзывами в архивную базу.
+# Заявка хранится в архиве одной записью со сжатым JSON. Каждая пачка переносится
+# одной транзакцией поверх обеих баз (ATTACH), поэтому заявка не теряется и не дублируется
+def archive_closed_requests() -> int:
+    settings = CONFIG["RETENTION"]
+    archived = 0
+    while True:
+        with DatabaseConnection(DB_NAME) as cursor:
+            cursor.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_NAME,))
             cursor.execute("""
-                UPDATE users
-                SET solved_issues = (
-                    SELECT COUNT(*)
-                    FROM requests
-                    WHERE user_id = ?
-                    AND status = 'Решено'
+                CREATE TABLE IF NOT EXISTS archive.archived_requests (
+                    ticket_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    status TEXT,
+                    created_at INTEGER,
+                    archived_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                    payload BLOB
                 )
-                WHERE user_id = ?
-            """, (user_id, user_id))
-            
-            # Обновление среднего времени ответа
+            """)
             cursor.execute("""
-                UPDATE users
-                SET avg_response_time = (
-                    SELECT AVG(response_time)
-                    FROM requests
-                    WHERE user_id = ?
-                    AND response_time IS NOT NULL
-                )
-                WHERE user_id = ?
-            """, (user_id, user_id))
-            
-            # Обновление рейтинга
+                SELECT * FROM requests
+                WHERE status IN (?, ?, ?)
+                AND last_update < ?
+                ORDER BY id
+                LIMIT ?
+            """, (*ARCHIVED_STATUSES, epoch_cutoff(days=settings['ticket_days']), settings["batch_size"]))
+            columns = [column[0] for column in cursor.description]
+            batch = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            if not batch:
+                break
+
+            # Список id пачки передается одним параметром, чтобы текст запросов не зависел от размера пачки
+            ids = json.dumps([request["id"] for request in batch])
+            messages = collections.defaultdict(list)
             cursor.execute("""
-                UPDATE users
-                SET rating = (
-                    SELECT AVG(satisfaction_rating)
-                    FROM requests
-                    WHERE user_id = ?
-                    AND satisfaction_rating IS NOT NULL
+                SELECT request_id, id, sender_id, message_text, sent_at, is_internal
+                FROM request_messages
+                WHERE request_id IN (SELECT value FROM json_each(?))
+                ORDER BY sent_at, id
+            """, (ids,))
+            for request_id, *row in cursor.fetchall():
+                messages[request_id].append(row)
+
+            feedback = collections.defaultdict(list)
+            cursor.execute("""
+                SELECT request_id, user_id, rating, comment, created_at
+                FROM feedback
+                WHERE request_id IN (SELECT value FROM json_each(?))
+            """, (ids,))
+            for request_id, *row in cursor.fetchall():
+                feedback[request_id].append(row)
+
+            rows = []
+            for request in batch:
+                payload = {
+                    "request": request,
+                    "messages": messages[request["id"]],
+                    "feedback": feedback[request["id"]]
+                }
+                rows.append((
+                    request["ticket_id"], request["user_id"], request["status"], request["created_at"],
+                    gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+                ))
+            cursor.executemany("""
+                INSERT OR REPLACE INTO archive.archived_requests
+                    (ticket_id, user_id, status, created_at, payload)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            cursor.execute("DELETE FROM request_messages WHERE request_id IN (SELECT value FROM json_each(?))", (ids,))
+            cursor.execute("DELETE FROM feedback WHERE request_id IN (SELECT value FROM json_each(?))", (ids,))
+            cursor.execute("DELETE FROM requests WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+
+        for request in batch:
+            ticket_views.invalidate(request["ticket_id"])
+        archived += len(batch)
+        if len(batch) < settings["batch_size"]:
+            break
+    return archived
+
+# Удаление старых уведомлений пачками, чтобы не держать блокировку записи долго
+def prune_notifications() -> int:
+    settings = CONFIG["RETENTION"]
+    pruned = 0
+    cutoff = epoch_cutoff(days=settings['notification_days'])
+    while True:
+        deleted = notification_repo.prune(cutoff, settings["batch_size"])
+        pruned += deleted
+        if deleted < settings["batch_size"]:
+            return pruned
+
+# Возврат освободившихся страниц файлу базы: каждый проход освобождает не больше pages
+# страниц. Нужен инкрементальный режим auto_vacuum: новые базы создаются в нем, существующие
+# переводятся один раз при остановленном боте (python telegramm.py --enable-incremental-vacuum),
+# потому что перевод - полный VACUUM, блокирующий запись на все время перестройки файла
+def compact_database(pages: int) -> int:
+    conn = sqlite3.connect(DB_NAME, timeout=5.0, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            logger.warning(
+                "Database is not in incremental auto_vacuum mode, compaction skipped; "
+                "stop the bot and run: python telegramm.py --enable-incremental-vacuum"
+            )
+        else:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+
+# Однократный перевод базы в инкрементальный режим auto_vacuum (полная перестройка файла)
+def enable_incremental_vacuum():
+    conn = sqlite3.connect(DB_NAME, timeout=5.0, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        conn.close()
+
+# Плановое обслуживание базы: архивирование, очистка уведомлений, сжатие файла
+def run_retention():
+    try:
+        started = time.perf_counter()
+        pruned = prune_notifications()
+        # Архив и сжатие файла - средства SQLite; в PostgreSQL место освобождает autovacuum
+        if storage.name == "sqlite":
+            archived = archive_closed_requests()
+            free_pages = compact_database(CONFIG["RETENTION"]["vacuum_pages"])
+        else:
+            archived, free_pages = 0, 0
+        metrics.inc("bot_retention_archived_total", None, archived)
+        metrics.inc("bot_retention_pruned_total", None, pruned)
+        logger.info(
+            f"Retention: archived {archived} requests, pruned {pruned} notifications, "
+            f"{free_pages} free pages left, {time.perf_counter() - started:.2f}s"
+        )
+    except Exception as e:
+        logger.error(f"Error in run_retention: {e}", exc_info=True)
+
+# Онлайн-резервное копирование через sqlite3 backup API: база копируется небольшими
+# шагами, между которыми бот продолжает писать. Копия проверяется PRAGMA integrity_check,
+# сжимается в gzip и хранится с ограничением по количеству
+BACKUP_PREFIX = "support_bot_"
+
+# Копию создает только один поток одного процесса: в многопроцессном режиме копирование
+# может запустить администратор в любом процессе-обработчике и периодическая задача основного,
+# поэтому кроме блокировки потоков берется блокировка файла в каталоге копий
+class BackupLock:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _lock_file(self):
+        os.makedirs(CONFIG["BACKUP"]["dir"], exist_ok=True)
+        lock_file = open(os.path.join(CONFIG["BACKUP"]["dir"], ".backup.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def acquire(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            return False
+        if fcntl is not None:
+            self._file = self._lock_file()
+            if self._file is None:
+                self._lock.release()
+                return False
+        return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+    # Копия создается сейчас (в этом или другом процессе)
+    def locked(self) -> bool:
+        if self._lock.locked():
+            return True
+        if fcntl is None:
+            return False
+        probe = self._lock_file()
+        if probe is None:
+            return True
+        fcntl.flock(probe, fcntl.LOCK_UN)
+        probe.close()
+        return False
+
+backup_lock = BackupLock()
+
+class BackupRestartLimit(Exception):
+    pass
+
+# Пошаговое копирование начинается заново после каждой записи в базу другим соединением.
+# Если запись идет непрерывно, после max_restarts перезапусков копирование прерывается:
+# база никогда не блокируется на все время копирования, попытка повторяется позже
+def copy_database(source, target, settings: Dict):
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > settings["max_restarts"]:
+                raise BackupRestartLimit(f"copy restarted {state['restarts']} times by concurrent writes")
+        state["remaining"] = remaining
+
+    source.backup(target, pages=settings["pages_per_step"], progress=progress, sleep=settings["step_pause"])
+
+def list_backups() -> List[str]:
+    backup_dir = CONFIG["BACKUP"]["dir"]
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(
+        name for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(".db.gz")
+    )
+    return [os.path.join(backup_dir, name) for name in names]
+
+def backup_due() -> bool:
+    if storage.name != "sqlite":
+        return False  # PostgreSQL копируется средствами сервера (pg_dump, архив WAL)
+    backups = list_backups()
+    if not backups:
+        return True
+    return time.time() - os.path.getmtime(backups[-1]) >= CONFIG["BACKUP"]["interval_hours"] * 3600
+
+def create_backup() -> Optional[str]:
+    if storage.name != "sqlite":
+        raise RuntimeError("для PostgreSQL используйте pg_dump или архивирование WAL")
+    if not backup_lock.acquire():
+        return None  # Копия уже создается (возможно, другим процессом)
+    settings = CONFIG["BACKUP"]
+    started = time.perf_counter()
+    os.makedirs(settings["dir"], exist_ok=True)
+    path = os.path.join(settings["dir"], f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}.db")
+    try:
+        source = sqlite3.connect(DB_NAME, timeout=5.0)
+        target = sqlite3.connect(path)
+        try:
+            copy_database(source, target, settings)
+            result = target.execute("PRAGMA integrity_check").fetchone()[0]
+            if result != "ok":
+                raise sqlite3.DatabaseError(f"integrity check failed: {result}")
+        finally:
+            target.close()
+            source.close()
+
+        with open(path, "rb") as f_in, gzip.open(path + ".gz", "wb", compresslevel=settings["compress_level"]) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+        for old in list_backups()[:-settings["keep"]]:
+            os.remove(old)
+
+        metrics.inc("bot_backups_total", {"result": "ok"})
+        metrics.observe("bot_backup_duration_seconds", None, time.perf_counter() - started)
+        logger.info(f"Backup created: {path}.gz ({time.perf_counter() - started:.2f}s)")
+        return path + ".gz"
+    except BackupRestartLimit as e:
+        metrics.inc("bot_backups_total", {"result": "error"})
+        logger.warning(f"Backup postponed until the next run: {e}")
+        raise
+    except Exception as e:
+        metrics.inc("bot_backups_total", {"result": "error"})
+        logger.error(f"Error creating backup: {e}", exc_info=True)
+        if os.path.exists(path + ".gz"):
+            os.remove(path + ".gz")
+        raise
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        backup_lock.release()
+
+# Создание копии по запросу администратора: выполняется в отдельном потоке,
+# результат отправляется в чат
+def start_backup(chat_id: int) -> bool:
+    if backup_lock.locked():
+        return False
+
+    def run():
+        try:
+            path = create_backup()
+            if path is None:
+                bot.send_message(chat_id, "⚠️ Резервная копия уже создается.")
+                return
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            bot.send_message(chat_id, f"💾 Резервная копия создана и проверена:\n{os.path.basename(path)} ({size_mb:.1f} МБ)")
+        except BackupRestartLimit:
+            bot.send_message(chat_id, "⚠️ База непрерывно изменяется, копирование отложено. Повторите попытку позже.")
+        except Exception as e:
+            bot.send_message(chat_id, f"❌ Не удалось создать резервную копию: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+# Выгрузка заявок с перепиской для аналитики: CSV (строка на сообщение) или JSONL (объект
+# на заявку со списком сообщений), сжатые gzip. Строки читаются из базы пачками и сразу
+# пишутся в файл, поэтому память не зависит от объема. SQLite читается из отдельного снимка
+# (копируется небольшими шагами и не блокирует запись), PostgreSQL - серверным курсором.
+# Время - секунды Unix-эпохи (UTC)
+EXPORT_FORMATS = ("csv", "jsonl")
+EXPORT_TICKET_FIELDS = (
+    "ticket_id", "user_id", "username", "first_name", "last_name", "category", "problem", "status",
+    "priority", "created_at", "last_update", "assigned_to", "satisfaction_rating"
+)
+EXPORT_MESSAGE_FIELDS = ("message_id", "sender_id", "message_text", "sent_at")
+
+export_lock = threading.Lock()
+
+def export_tickets(path: str, fmt: str = "csv", since: Optional[int] = None) -> tuple:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    settings = CONFIG["EXPORT"]
+    started = time.perf_counter()
+    source = storage
+    if storage.name == "sqlite":
+        # Снимок делается один раз на выгрузку и больше не обновляется
+        source = SnapshotStorage(DB_NAME, f"{DB_NAME}.export{os.getpid()}.snapshot", float("inf"))
+    tickets = messages = 0
+    try:
+        rows = TicketRepository(source).export_rows(since, settings["batch_size"])
+        with contextlib.closing(rows), \
+                gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=settings["compress_level"]) as output:
+            if fmt == "csv":
+                writer = csv.writer(output)
+                writer.writerow(EXPORT_TICKET_FIELDS + EXPORT_MESSAGE_FIELDS)
+                last_request_id = None
+                for row in rows:
+                    writer.writerow(row[1:])
+                    if row[0] != last_request_id:
+                        tickets += 1
+                        last_request_id = row[0]
+                    messages += row[14] is not None
+            else:
+                for _, ticket_rows in itertools.groupby(rows, key=lambda row: row[0]):
+                    ticket_rows = list(ticket_rows)
+                    record = dict(zip(EXPORT_TICKET_FIELDS, ticket_rows[0][1:14]))
+                    record["messages"] = [
+                        dict(zip(EXPORT_MESSAGE_FIELDS, row[14:])) for row in ticket_rows if row[14] is not None
+                    ]
+                    output.write(json.dumps(record, ensure_ascii=False))
+                    output.write("\n")
+                    tickets += 1
+                    messages += len(record["messages"])
+        metrics.inc("bot_exports_total", {"format": fmt, "result": "ok"})
+    except Exception:
+        metrics.inc("bot_exports_total", {"format": fmt, "result": "error"})
+        raise
+    finally:
+        if isinstance(source, SnapshotStorage) and os.path.exists(source.path):
+            os.remove(source.path)
+        metrics.observe("bot_export_duration_seconds", None, time.perf_counter() - started)
+    logger.info(f"Exported {tickets} tickets and {messages} messages to {path}")
+    return tickets, messages
+
+# Выгрузка по запросу администратора: выполняется в отдельном потоке, файл отправляется
+# документом и удаляется
+def start_export(chat_id: int, fmt: str) -> bool:
+    if not export_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz", prefix="tickets_")
+        os.close(fd)
+        try:
+            tickets, messages = export_tickets(path, fmt)
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            if size_mb > CONFIG["EXPORT"]["max_document_mb"]:
+                bot.send_message(
+                    chat_id,
+                    f"⚠️ Выгрузка занимает {size_mb:.1f} МБ - больше, чем бот может отправить. "
+                    "Используйте export_tickets.py на сервере."
                 )
-                WHERE user_id = ?
-            """, (user_id, user_id))
+                return
+            with open(path, "rb") as document:
+                bot.send_document(
+                    chat_id,
+                    document,
+                    visible_file_name=f"tickets_{datetime.now(MOSCOW_TZ).strftime('%Y%m%d_%H%M')}.{fmt}.gz",
+                    caption=f"📤 Заявок: {tickets}, сообщений: {messages}"
+                )
+        except Exception as e:
+            logger.error(f"Error exporting tickets: {e}", exc_info=True)
+            bot.send_message(chat_id, f"❌ Не удалось выгрузить заявки: {e}")
+        finally:
+            os.remove(path)
+            export_lock.release()
+
+    threading.Thread(target=run, daemon=True).start()
+    return True
+
+# LRU-кэш известных пользователей: user_id -> отпечаток профиля (username, first_name, last_name)
+class KnownUsersCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+
+    def matches(self, user_id: int, fingerprint: tuple) -> bool:
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is None:
+                return False
+            self._entries.move_to_end(user_id)
+            return cached == fingerprint
+
+    def remember(self, user_id: int, fingerprint: tuple):
+        with self._lock:
+            self._entries[user_id] = fingerprint
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+known_users = KnownUsersCache(CONFIG["KNOWN_USERS_CACHE_SIZE"])
+
+# Режим администратора хранится в базе, чтобы переживать перезапуск процесса-обработчика.
+# В памяти - кэш: чат администратора всегда обрабатывается одним и тем же процессом
+class AdminModeStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def get(self, user_id: int, default: bool = False) -> bool:
+        with self._lock:
+            if user_id in self._cache:
+                return self._cache[user_id]
+        enabled = user_repo.admin_mode(user_id)
+        if enabled is None:
+            enabled = default
+        with self._lock:
+            self._cache[user_id] = enabled
+        return enabled
+
+    def __setitem__(self, user_id: int, enabled: bool):
+        user_repo.set_admin_mode(user_id, enabled)
+        with self._lock:
+            self._cache[user_id] = bool(enabled)
+
+admin_mode = AdminModeStore()
+metrics.gauge("bot_known_users_cached", lambda: len(known_users))
+
+# Функция для регистрации пользователя и обновления его профиля
+def register_user(user) -> bool:
+    fingerprint = (user.username, user.first_name, user.last_name)
+    if known_users.matches(user.id, fingerprint):
+        metrics.inc("bot_known_users_cache_total", {"result": "hit"})
+        return False
+
+    metrics.inc("bot_known_users_cache_total", {"result": "miss"})
+    user_repo.upsert_profile(user.id, *fingerprint)
+    known_users.remember(user.id, fingerprint)
+    return True
+
+# Отложенная запись активности пользователей: обновления копятся в памяти
+# и сбрасываются в базу одним пакетом раз в несколько секунд
+class ActivityTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_seen = {}
+        self._new_requests = {}
+
+    def touch(self, user_id: int):
+        now = epoch_now()
+        with self._lock:
+            self._last_seen[user_id] = now
+
+    def add_request(self, user_id: int):
+        self.touch(user_id)
+        with self._lock:
+            self._new_requests[user_id] = self._new_requests.get(user_id, 0) + 1
+
+    def pending(self) -> int:
+        return len(self._last_seen)
+
+    def flush(self) -> int:
+        with self._lock:
+            last_seen, self._last_seen = self._last_seen, {}
+            new_requests, self._new_requests = self._new_requests, {}
+        if not last_seen:
+            return 0
+
+        rows = [(user_id, seen, new_requests.get(user_id, 0)) for user_id, seen in last_seen.items()]
+        try:
+            user_repo.flush_activity(rows)
+        except Exception as e:
+            logger.error(f"Error flushing user activity: {e}")
+            # Возвращаем несохраненные данные, чтобы записать их при следующем сбросе
+            with self._lock:
+                for user_id, seen in last_seen.items():
+                    self._last_seen[user_id] = max(seen, self._last_seen.get(user_id, seen))
+                for user_id, count in new_requests.items():
+                    self._new_requests[user_id] = self._new_requests.get(user_id, 0) + count
+            return 0
+        return len(rows)
+
+    def run(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+activity_tracker = ActivityTracker()
+metrics.gauge("bot_activity_pending_users", activity_tracker.pending)
+atexit.register(activity_tracker.flush)
+
+# Функция для обновления статистики пользователя
+def update_user_stats(user_id: int):
+    try:
+        user_repo.refresh_stats(user_id)
     except Exception as e:
         logger.error(f"Error in update_user_stats: {e}")
 
+# Ограничение частоты обновлений: токен-бакет на пользователя и тип обновления.
+# Проверка выполняется в памяти до обработчиков и обращений к базе
+class RateLimiter:
+    def __init__(self, limits: Dict, capacity: int, notice_interval: float):
+        self.limits = limits
+        self.capacity = capacity
+        self.notice_interval = notice_interval
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()  # (user_id, тип) -> [токены, время пополнения]
+        self._noticed = {}  # user_id -> время последнего предупреждения
+
+    def allow(self, user_id: int, kind: str) -> bool:
+        limit = self.limits.get(kind)
+        if limit is None:
+            return True
+        now = time.monotonic()
+        key = (user_id, kind)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [limit["burst"], now]
+                if len(self._buckets) > self.capacity:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(limit["burst"], bucket[0] + (now - bucket[1]) * limit["rate"])
+                bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    # Предупреждать пользователя о превышении лимита не чаще раза в notice_interval
+    def should_notice(self, user_id: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._noticed.get(user_id, -self.notice_interval) < self.notice_interval:
+                return False
+            self._noticed[user_id] = now
+            if len(self._noticed) > self.capacity:
+                self._noticed = {uid: at for uid, at in self._noticed.items() if now - at < self.notice_interval}
+            return True
+
+    def __len__(self):
+        return len(self._buckets)
+
+rate_limiter = RateLimiter(CONFIG["RATE_LIMITS"], CONFIG["RATE_LIMIT_CACHE_SIZE"], CONFIG["RATE_LIMIT_NOTICE_SECONDS"])
+metrics.gauge("bot_rate_limit_buckets", lambda: len(rate_limiter))
+
+# Скользящее суточное окно заявок пользователя. Время создания заявок за сутки читается
+# из базы один раз (поиск по индексу), дальше окно ведется в памяти. Обновления одного чата
+# всегда обрабатывает один процесс, поэтому окно процесса полное
+class DailyTicketQuota:
+    window = 24 * 3600
+
+    def __init__(self, limit: int, capacity: int):
+        self.limit = limit
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._created = collections.OrderedDict()  # user_id -> deque времен создания
+
+    def _window(self, user_id: int, now: int) -> collections.deque:
+        with self._lock:
+            created = self._created.get(user_id)
+            if created is not None:
+                self._created.move_to_end(user_id)
+        if created is None:
+            created = collections.deque(ticket_repo.created_since(user_id, now - self.window))
+            with self._lock:
+                created = self._created.setdefault(user_id, created)
+                if len(self._created) > self.capacity:
+                    self._created.popitem(last=False)
+        with self._lock:
+            while created and created[0] <= now - self.window:
+                created.popleft()
+        return created
+
+    # Время, после которого можно создать следующую заявку, или None, если лимит не исчерпан
+    def blocked_until(self, user_id: int) -> Optional[int]:
+        if not self.limit:
+            return None
+        now = epoch_now()
+        created = self._window(user_id, now)
+        if len(created) < self.limit:
+            return None
+        return created[-self.limit] + self.window
+
+    def record(self, user_id: int, created_at: int):
+        if not self.limit:
+            return
+        created = self._window(user_id, created_at)
+        with self._lock:
+            created.append(created_at)
+
+ticket_quota = DailyTicketQuota(CONFIG["MAX_DAILY_REQUESTS"], CONFIG["RATE_LIMIT_CACHE_SIZE"])
+
+# Проверка суточного лимита заявок; при превышении пользователь получает сообщение
+def ticket_quota_exceeded(chat_id: int) -> bool:
+    if chat_id == ADMIN_ID:
+        return False
+    until = ticket_quota.blocked_until(chat_id)
+    if until is None:
+        return False
+    metrics.inc("bot_rate_limited_total", {"kind": "daily_tickets"})
+    bot.send_message(
+        chat_id,
+        f"⚠️ Можно создать не больше {ticket_quota.limit} заявок за сутки.\n"
+        f"Следующую заявку можно будет создать после {format_time(until)} (МСК).",
+        reply_markup=get_problems_keyboard()
+    )
+    return True
+
+# Окно повторной доставки обновлений: после перезапуска long polling или повтора webhook
+# Telegram может прислать уже обработанное обновление. Последние window номеров update_id
+# хранятся в памяти, наибольший обработанный номер периодически записывается в базу и
+# после перезапуска отсекает обновления, полученные до остановки
+class UpdateDeduplicator:
+    state_name = "last_update_id"
+
+    def __init__(self, window: int):
+        self.window = window
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._order = collections.deque()
+        self._floor = None  # Наибольший update_id, сохраненный до запуска процесса
+        self._saved = None
+        self.high_water = None
+
+    def load(self):
+        value = state_repo.get(self.state_name) or 0
+        with self._lock:
+            if self._floor is None:
+                self._floor = self._saved = value
+
+    def accept(self, update_id: int) -> bool:
+        if not self.enabled:
+            return True
+        if self._floor is None:
+            self.load()
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            # Номера ниже окна не отсекаются: после недели без обновлений Telegram
+            # начинает нумерацию заново со случайного значения
+            if self._floor - self.window < update_id <= self._floor:
+                return False
+            self._seen.add(update_id)
+            self._order.append(update_id)
+            if len(self._order) > self.window:
+                self._seen.discard(self._order.popleft())
+            if self.high_water is None or update_id > self.high_water:
+                self.high_water = update_id
+            return True
+
+    def flush(self):
+        with self._lock:
+            value = self.high_water
+        if value is None or value == self._saved:
+            return
+        try:
+            state_repo.advance(self.state_name, value)
+            self._saved = value
+        except Exception as e:
+            logger.error(f"Error saving last update id: {e}")
+
+    def run(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+    def __len__(self):
+        return len(self._seen)
+
+update_dedup = UpdateDeduplicator(CONFIG["UPDATE_DEDUP_WINDOW"])
+# В режиме нескольких процессов повторы отсекает супервизор до распределения обновлений
+update_dedup.enabled = WORKER_INDEX < 0
+atexit.register(update_dedup.flush)
+
+# Ключ идемпотентности записи, созданной по сообщению Telegram
+def message_key(message) -> str:
+    return f"{message.chat.id}:{message.message_id}"
+
+def send_rate_limit_notice(update_kind: str, obj):
+    try:
+        text = "⏳ Слишком много запросов. Подождите несколько секунд."
+        if update_kind == "callback":
+            callback_notice(obj, text, show_alert=True)
+        else:
+            bot.send_message(obj.chat.id, text)
+    except Exception as e:
+        logger.debug(f"Cannot send rate limit notice: {e}")
+
+# Отбрасывание повторно доставленных обновлений. Выполняется до ограничения частоты,
+# чтобы повторы не расходовали лимит пользователя
+@bot.middleware_handler()
+def deduplicate_update(bot_instance, update):
+    if update_dedup.accept(update.update_id):
+        return
+    metrics.inc("bot_duplicate_updates_total", {"kind": "update"})
+    logger.info(f"Duplicate update {update.update_id} skipped")
+    update.message = None
+    update.callback_query = None
+
+# Отбрасывание обновлений сверх лимита до обработчиков: обновление без message и
+# callback_query не попадает ни в один обработчик
+@bot.middleware_handler()
+def rate_limit(bot_instance, update):
+    for kind, field in (("message", "message"), ("callback", "callback_query")):
+        obj = getattr(update, field)
+        if obj is None or obj.from_user is None or obj.from_user.id == ADMIN_ID:
+            continue
+        if rate_limiter.allow(obj.from_user.id, kind):
+            continue
+        setattr(update, field, None)
+        metrics.inc("bot_rate_limited_total", {"kind": kind})
+        if rate_limiter.should_notice(obj.from_user.id):
+            # Предупреждение отправляется вне потока получения обновлений
+            if bot_instance.threaded:
+                bot_instance.worker_pool.put(send_rate_limit_notice, kind, obj)
+            else:
+                send_rate_limit_notice(kind, obj)
+        elif kind == "callback":
+            callback_acks.submit(obj)  # Без предупреждения индикатор загрузки просто снимается
+
+# Дальнейшие middleware тоже обычные, а не типизированные: типизированные выполняются раньше
+# всех обычных, а эти должны видеть только обновления, прошедшие отсев повторов и лимит
+
+# Учет активности пользователя для каждого принятого обновления
+@bot.middleware_handler()
+def track_activity(bot_instance, update):
+    for obj in (update.message, update.callback_query):
+        if obj is not None and obj.from_user:
+            activity_tracker.touch(obj.from_user.id)
+
+# Отметка времени получения callback-запроса (до ожидания в очереди воркеров)
+@bot.middleware_handler()
+def stamp_callback(bot_instance, update):
+    if update.callback_query is not None:
+        update.callback_query.received_at = time.perf_counter()
+
+# Подтверждение callback-запроса при диспетчеризации: клиент перестает показывать индикатор
+# загрузки, не дожидаясь очереди воркеров. Запросы, на которые обработчик отвечает текстом,
+# подтверждаются им самим
+@bot.middleware_handler()
+def acknowledge_callback(bot_instance, update):
+    call = update.callback_query
+    if call is not None and not callback_answered_by_handler(call.data):
+        callback_acks.submit(call)
+
 @bot.message_handler(commands=['start'])
+@timed_handler
 def start(message):
     try:
-        # Регистрация пользователя
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            """, (
-                message.from_user.id,
-                message.from_user.username,
-                message.from_user.first_name,
-                message.from_user.last_name
-            ))
+        # Регистрация пользователя (без обращения к базе, если профиль не изменился)
+        register_user(message.from_user)
 
         # Проверка на админа и его режим
         if message.from_user.id == ADMIN_ID and admin_mode.get(message.from_user.id, False):
@@ -509,6 +3247,7 @@ def start(message):
         bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 @bot.message_handler(commands=['admin'])
+@timed_handler
 def enter_admin_mode(message):
     try:
         if message.from_user.id == ADMIN_ID:
@@ -521,36 +3260,166 @@ def enter_admin_mode(message):
                 reply_markup=get_admin_keyboard()
             )
         else:
-            bot.send_message(
-                message.chat.id,
-                "❌ У вас нет прав администратора."
-            )
-    except Exception as e:
-        logger.error(f"Error in enter_admin_mode: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+            bot.send_message(
+                message.chat.id,
+                "❌ У вас нет прав администратора."
+            )
+    except Exception as e:
+        logger.error(f"Error in enter_admin_mode: {e}")
+        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+
+@bot.message_handler(commands=['exit_admin'])
+@timed_handler
+def exit_admin_mode(message):
+    try:
+        if message.from_user.id == ADMIN_ID:
+            admin_mode[message.from_user.id] = False
+            logger.info(f"Admin {message.from_user.id} exited admin mode")
+            bot.send_message(
+                message.chat.id,
+                "🔒 Вы вышли из режима администратора.\n"
+                "Используйте /admin для входа в режим администратора.",
+                reply_markup=get_problems_keyboard()
+            )
+        else:
+            bot.send_message(
+                message.chat.id,
+                "❌ У вас нет прав администратора."
+            )
+    except Exception as e:
+        logger.error(f"Error in exit_admin_mode: {e}")
+        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+
+PROFILE_USAGE = (
+    "🩺 Профилирование:\n\n"
+    "/profile 30 - cProfile на 30 секунд\n"
+    "/profile 200u - cProfile на 200 обновлений\n"
+    "/profile 60 sample - сэмплирующий профилировщик\n"
+    "/profile 100u show_request_details callback_handler - только указанные обработчики\n"
+    "/profile stop - остановить и получить отчет"
+)
+
+@bot.message_handler(commands=['profile'])
+@timed_handler
+def profile_command(message):
+    try:
+        if message.from_user.id != ADMIN_ID:
+            bot.send_message(message.chat.id, "❌ У вас нет прав администратора.")
+            return
+
+        args = message.text.split()[1:]
+        if not args:
+            session = active_profile
+            status = f"Активно: {session.describe()}" if session else "Профилирование не запущено"
+            bot.send_message(message.chat.id, f"{PROFILE_USAGE}\n\n{status}")
+            return
+
+        if args[0] == "stop":
+            if not stop_profiling():
+                bot.send_message(message.chat.id, "ℹ️ Профилирование не запущено.")
+            return
+
+        mode, seconds, updates, handlers = "cprofile", None, None, []
+        for arg in args:
+            if arg in ("sample", "cprofile"):
+                mode = arg
+            elif re.fullmatch(r"\d+s?", arg):
+                seconds = min(int(arg.rstrip("s")), PROFILE_MAX_SECONDS)
+            elif re.fullmatch(r"\d+u", arg):
+                updates = min(int(arg[:-1]), PROFILE_MAX_UPDATES)
+            elif arg in TIMED_HANDLERS:
+                handlers.append(arg)
+            else:
+                bot.send_message(message.chat.id, f"❌ Неизвестный параметр: {arg}\n\n{PROFILE_USAGE}")
+                return
+
+        session = start_profiling(message.chat.id, mode, seconds, updates, handlers)
+        if session is None:
+            bot.send_message(message.chat.id, "⚠️ Профилирование уже запущено. Используйте /profile stop.")
+        else:
+            bot.send_message(message.chat.id, f"▶️ Профилирование запущено: {session.describe()}")
+    except Exception as e:
+        logger.error(f"Error in profile_command: {e}")
+        bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+
+BULK_USAGE = (
+    "🧹 Массовые операции:\n\n"
+    "/bulk close duplicates - закрыть повторные открытые заявки\n"
+    "/bulk close category=internet older=12h - закрыть открытые заявки категории старше 12 часов\n"
+    "/bulk resolve status=Открыто older=7d - отметить решенными\n"
+    "/bulk reject duplicates - отклонить повторные заявки\n"
+    "/bulk assign 123456 category=mobile - назначить заявки агенту\n\n"
+    "Фильтры: status=<статус> (по умолчанию Открыто), category=<категория>, "
+    "older=<N>h или <N>d, duplicates - есть более ранняя заявка пользователя "
+    "той же категории с тем же текстом.\n"
+    "Перед выполнением показывается число заявок; изменения выполняются одной транзакцией."
+)
+
+# Действия массовых операций: новый статус заявки (assign меняет исполнителя)
+BULK_ACTIONS = {
+    "close": "Закрыто",
+    "resolve": "Решено",
+    "reject": "Отклонено",
+    "assign": None
+}
+
+# Массовая операция, ожидающая подтверждения администратора: действие, агент для assign и фильтр
+BulkOperation = collections.namedtuple("BulkOperation", ["action", "assign_to", "criteria"])
+
+# Разбор аргументов /bulk; возвращает операцию или текст ошибки
+def parse_bulk_args(args: List[str]):
+    if not args or args[0] not in BULK_ACTIONS:
+        return "Укажите действие: close, resolve, reject или assign"
+    action, args = args[0], args[1:]
+    assign_to = None
+    if action == "assign":
+        if not args or not args[0].isdigit():
+            return "Укажите ID агента: /bulk assign 123456 ..."
+        assign_to, args = int(args[0]), args[1:]
+
+    status, category, created_before, duplicates = "Открыто", None, None, False
+    statuses = ("Открыто", "Решено", "Закрыто", "Отменено", "Отклонено")
+    for arg in args:
+        key, _, value = arg.partition("=")
+        if arg == "duplicates":
+            duplicates = True
+        elif key == "status" and value in statuses:
+            status = value
+        elif key == "category" and value in problems:
+            category = value
+        elif key == "older" and re.fullmatch(r"\d+[hd]", value):
+            amount = int(value[:-1])
+            created_before = epoch_cutoff(hours=amount) if value.endswith("h") else epoch_cutoff(days=amount)
+        else:
+            return f"Неизвестный параметр: {arg}"
+    if status == BULK_ACTIONS[action]:
+        return f"Заявки со статусом «{status}» уже в этом статусе"
+    return BulkOperation(action, assign_to, BulkFilter(status, category, created_before, duplicates))
 
-@bot.message_handler(commands=['exit_admin'])
-def exit_admin_mode(message):
+@bot.message_handler(commands=['bulk'])
+@timed_handler
+def bulk_command(message):
     try:
-        if message.from_user.id == ADMIN_ID:
-            admin_mode[message.from_user.id] = False
-            logger.info(f"Admin {message.from_user.id} exited admin mode")
-            bot.send_message(
-                message.chat.id,
-                "🔒 Вы вышли из режима администратора.\n"
-                "Используйте /admin для входа в режим администратора.",
-                reply_markup=get_problems_keyboard()
-            )
-        else:
-            bot.send_message(
-                message.chat.id,
-                "❌ У вас нет прав администратора."
-            )
+        if message.from_user.id != ADMIN_ID:
+            bot.send_message(message.chat.id, "❌ У вас нет прав администратора.")
+            return
+
+        args = message.text.split()[1:]
+        if not args:
+            bot.send_message(message.chat.id, BULK_USAGE)
+            return
+
+        operation = parse_bulk_args(args)
+        if isinstance(operation, str):
+            bot.send_message(message.chat.id, f"❌ {operation}\n\n{BULK_USAGE}")
+            return
+        preview_bulk_operation(message, operation)
     except Exception as e:
-        logger.error(f"Error in exit_admin_mode: {e}")
+        logger.error(f"Error in bulk_command: {e}")
         bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 @bot.message_handler(commands=['help'])
+@timed_handler
 def show_help(message):
     try:
         help_text = (
@@ -581,142 +3450,190 @@ def show_help(message):
         markup.add(types.InlineKeyboardButton("📞 Связаться с поддержкой", callback_data="support"))
         markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
 
-        bot.send_message(message.chat.id, help_text, reply_markup=markup)
+        show_screen(message, help_text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_help: {e}")
         bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 @bot.message_handler(commands=['feedback'])
+@timed_handler
 def start_feedback(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT r.ticket_id, r.problem
-                FROM requests r
-                WHERE r.user_id = ?
-                AND r.status = 'Решено'
-                AND r.satisfaction_rating IS NULL
-                ORDER BY r.created_at DESC
-            """, (message.from_user.id,))
-            
-            solved_requests = cursor.fetchall()
-            
-            if not solved_requests:
-                bot.send_message(
-                    message.chat.id,
-                    "📭 У вас нет решенных заявок для оценки."
-                )
-                return
-            
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            for ticket_id, problem in solved_requests:
-                markup.add(types.InlineKeyboardButton(
-                    f"#{ticket_id} - {problem[:30]}...",
-                    callback_data=f"rate_request_{ticket_id}"
-                ))
-            
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
+        solved_requests = feedback_repo.pending(message.from_user.id)
+        
+        if not solved_requests:
             bot.send_message(
                 message.chat.id,
-                "📝 Выберите заявку для оценки:",
-                reply_markup=markup
+                "📭 У вас нет решенных заявок для оценки."
             )
+            return
+        
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        for ticket_id, problem in solved_requests:
+            markup.add(types.InlineKeyboardButton(
+                f"#{ticket_id} - {problem[:30]}...",
+                callback_data=f"rate_request_{ticket_id}"
+            ))
+        
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        bot.send_message(
+            message.chat.id,
+            "📝 Выберите заявку для оценки:",
+            reply_markup=markup
+        )
     except Exception as e:
         logger.error(f"Error in start_feedback: {e}")
         bot.send_message(message.chat.id, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
-def show_request_details(message, ticket_id):
+# Загрузка карточки заявки через кэш представлений
+def render_request_text(ticket_id, problem, status, created_at, last_update, category, priority,
+                        messages, before_id=None) -> str:
+    text = (
+        f"📋 Заявка #{ticket_id}\n\n"
+        f"📝 Проблема:\n{problem}\n\n"
+        f"📊 Статус: {status}\n"
+        f"📅 Создано: {format_time(created_at)}\n"
+        f"📦 Категория: {category}\n"
+        f"⚡️ Приоритет: {priority}\n"
+    )
+    if last_update:
+        text += f"🔄 Последнее обновление: {format_time(last_update)}\n\n"
+
+    if messages:
+        text += "📨 История сообщений (более ранние):\n" if before_id else "📨 История сообщений:\n"
+        for msg in messages:
+            message_id, sender_id, message_text, sent_at = msg
+            text += f"\n{format_time(sent_at)}:\n{message_text}\n"
+    return text
+
+def load_request_view(ticket_id: str, before_id: Optional[int] = None) -> Optional[TicketView]:
+    view = ticket_views.get("details", ticket_id, before_id)
+    if view is not None:
+        return view
+
+    version = ticket_views.version(ticket_id)
+    with storage.transaction() as cursor:
+        request = ticket_repo.details(ticket_id, cursor=cursor)
+
+        if not request:
+            return None
+
+        request_id, problem, status, created_at, last_update, user_id, category, priority = request
+        messages, older_cursor = message_repo.page(request_id, before_id, cursor=cursor)
+
+    text = render_request_text(
+        ticket_id, problem, status, created_at, last_update, category, priority, messages, before_id
+    )
+    view = TicketView(text, status, user_id, older_cursor)
+    ticket_views.put("details", ticket_id, version, view, before_id)
+    return view
+
+# Карточка заявки из архива. Переписка хранится целиком в сжатой записи,
+# страницы истории выбираются в памяти по тому же курсору (sent_at, id)
+def load_archived_request_view(ticket_id: str, before_id: Optional[int] = None) -> Optional[TicketView]:
+    view = ticket_views.get("archived", ticket_id, before_id)
+    if view is not None:
+        return view
+    if not os.path.exists(ARCHIVE_DB_NAME):
+        return None
+
+    version = ticket_views.version(ticket_id)
     try:
-        logger.info(f"Showing details for ticket {ticket_id}")
-        
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT problem, status, created_at, last_update, user_id, category, priority
-                FROM requests
-                WHERE ticket_id = ?
-            """, (ticket_id,))
-            request = cursor.fetchone()
+        with DatabaseConnection(ARCHIVE_DB_NAME) as cursor:
+            cursor.execute("SELECT payload FROM archived_requests WHERE ticket_id = ?", (ticket_id,))
+            row = cursor.fetchone()
+    except sqlite3.OperationalError as e:
+        if "no such table" in str(e):
+            return None
+        raise
+    if not row:
+        return None
 
-            if not request:
-                bot.send_message(
-                    message.chat.id,
-                    "❌ Заявка не найдена."
-                )
-                return
+    payload = json.loads(gzip.decompress(row[0]).decode("utf-8"))
+    request = payload["request"]
+    messages = [
+        (message_id, sender_id, message_text, sent_at)
+        for message_id, sender_id, message_text, sent_at, is_internal in payload["messages"]
+    ]
+    if before_id is not None:
+        cursor_key = next(((m[3], m[0]) for m in messages if m[0] == before_id), None)
+        messages = [m for m in messages if cursor_key and (m[3], m[0]) < cursor_key]
+    page_size = CONFIG["HISTORY_PAGE_SIZE"]
+    older_cursor = messages[-page_size][0] if len(messages) > page_size else None
+    messages = messages[-page_size:]
 
-            problem, status, created_at, last_update, user_id, category, priority = request
+    text = "🗄 Заявка перенесена в архив\n\n" + render_request_text(
+        ticket_id, request["problem"], request["status"], request["created_at"],
+        request["last_update"], request["category"], request["priority"], messages, before_id
+    )
+    view = TicketView(text, request["status"], request["user_id"], older_cursor)
+    ticket_views.put("archived", ticket_id, version, view, before_id)
+    return view
 
-            cursor.execute("""
-                SELECT sender_id, message_text, sent_at
-                FROM request_messages
-                WHERE request_id = (
-                    SELECT id FROM requests WHERE ticket_id = ?
-                )
-                ORDER BY sent_at
-            """, (ticket_id,))
-            messages = cursor.fetchall()
+@timed_handler
+def show_request_details(message, ticket_id, before_id=None):
+    try:
+        logger.debug(
+            "Showing details for ticket %s", ticket_id,
+            extra={"chat_id": message.chat.id, "ticket_id": ticket_id, "handler": "show_request_details"}
+        )
 
-            text = (
-                f"📋 Заявка #{ticket_id}\n\n"
-                f"📝 Проблема:\n{problem}\n\n"
-                f"📊 Статус: {status}\n"
-                f"📅 Создано: {created_at}\n"
-                f"📦 Категория: {category}\n"
-                f"⚡️ Приоритет: {priority}\n"
+        view = load_request_view(ticket_id, before_id) or load_archived_request_view(ticket_id, before_id)
+        if view is None:
+            bot.send_message(
+                message.chat.id,
+                "❌ Заявка не найдена."
             )
-            if last_update:
-                text += f"🔄 Последнее обновление: {last_update}\n\n"
+            return
 
-            if messages:
-                text += "📨 История сообщений:\n"
-                for msg in messages:
-                    sender_id, message_text, sent_at = msg
-                    text += f"\n{sent_at}:\n{message_text}\n"
+        text, status, user_id, older_cursor = view
 
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            
-            # Кнопки для пользователя
-            if message.chat.id == user_id:
-                if status == 'Открыто':
-                    markup.add(
-                        types.InlineKeyboardButton("📝 Добавить комментарий", callback_data=f"comment_{ticket_id}"),
-                        types.InlineKeyboardButton("✅ Решено и закрыть", callback_data=f"resolve_{ticket_id}"),
-                        types.InlineKeyboardButton("❌ Отменить заявку", callback_data=f"cancel_{ticket_id}")
-                    )
-                elif status == 'Решено':
-                    markup.add(
-                        types.InlineKeyboardButton("⭐ Оценить решение", callback_data=f"rate_{ticket_id}"),
-                        types.InlineKeyboardButton("✅ Закрыть заявку", callback_data=f"close_{ticket_id}")
-                    )
-            # Кнопки для администратора
-            elif message.chat.id == ADMIN_ID:
-                if status == 'Открыто':
-                    markup.add(
-                        types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}"),
-                        types.InlineKeyboardButton("✅ Решить", callback_data=f"admin_resolve_{ticket_id}"),
-                        types.InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_reject_{ticket_id}")
-                    )
-                elif status == 'Решено':
-                    markup.add(
-                        types.InlineKeyboardButton("✅ Закрыть заявку", callback_data=f"admin_close_{ticket_id}"),
-                        types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}")
-                    )
-            
-            markup.add(types.InlineKeyboardButton("◀️ Назад к списку", callback_data="my_requests"))
+        markup = types.InlineKeyboardMarkup(row_width=1)
 
-            try:
-                bot.send_message(
-                    message.chat.id,
-                    text,
-                    reply_markup=markup
+        # Навигация по истории сообщений
+        if older_cursor:
+            markup.add(types.InlineKeyboardButton("⏪ Более ранние сообщения", callback_data=f"hist_{ticket_id}_{older_cursor}"))
+        if before_id:
+            markup.add(types.InlineKeyboardButton("⏩ К последним сообщениям", callback_data=f"request_{ticket_id}"))
+        
+        # Кнопки для пользователя
+        if message.chat.id == user_id:
+            if status == 'Открыто':
+                markup.add(
+                    types.InlineKeyboardButton("📝 Добавить комментарий", callback_data=f"comment_{ticket_id}"),
+                    types.InlineKeyboardButton("✅ Решено и закрыть", callback_data=f"resolve_{ticket_id}"),
+                    types.InlineKeyboardButton("❌ Отменить заявку", callback_data=f"cancel_{ticket_id}")
                 )
-            except Exception as e:
-                logger.error(f"Error sending message: {e}")
-                bot.send_message(
-                    message.chat.id,
-                    "❌ Не удалось отобразить детали заявки. Пожалуйста, попробуйте позже."
+            elif status == 'Решено':
+                markup.add(
+                    types.InlineKeyboardButton("⭐ Оценить решение", callback_data=f"rate_{ticket_id}"),
+                    types.InlineKeyboardButton("✅ Закрыть заявку", callback_data=f"close_{ticket_id}")
+                )
+        # Кнопки для администратора
+        elif message.chat.id == ADMIN_ID:
+            if status == 'Открыто':
+                markup.add(
+                    types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}"),
+                    types.InlineKeyboardButton("✅ Решить", callback_data=f"admin_resolve_{ticket_id}"),
+                    types.InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_reject_{ticket_id}")
+                )
+            elif status == 'Решено':
+                markup.add(
+                    types.InlineKeyboardButton("✅ Закрыть заявку", callback_data=f"admin_close_{ticket_id}"),
+                    types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}")
                 )
+        
+        markup.add(types.InlineKeyboardButton("◀️ Назад к списку", callback_data="my_requests"))
+
+        try:
+            show_screen(message, text, reply_markup=markup)
+        except Exception as e:
+            logger.error(f"Error sending message: {e}")
+            bot.send_message(
+                message.chat.id,
+                "❌ Не удалось отобразить детали заявки. Пожалуйста, попробуйте позже."
+            )
     except Exception as e:
         logger.error(f"Error in show_request_details: {e}", exc_info=True)
         bot.send_message(
@@ -724,97 +3641,82 @@ def show_request_details(message, ticket_id):
             "❌ Произошла ошибка при отображении деталей заявки. Пожалуйста, попробуйте позже."
         )
 
+@timed_handler
 def resolve_issue(call):
     try:
-        ticket_id = call.data.split("_")[1]
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                UPDATE requests
-                SET status = 'Решено',
-                    last_update = CURRENT_TIMESTAMP
-                WHERE ticket_id = ?
-            """, (ticket_id,))
+        ticket_id = call.data.rsplit("_", 1)[1]
+        owner = ticket_repo.set_status(ticket_id, 'Решено')
+        updated = owner is not None
+        if updated:
+            user_id, problem = owner
+
+        # Уведомления и отображение выполняются после фиксации транзакции
+        if updated:
+            ticket_views.invalidate(ticket_id)
+
+            # Отправляем уведомление пользователю
+            send_notification(
+                user_id,
+                f"✅ Ваша заявка #{ticket_id} решена!\n\n"
+                f"Проблема: {problem}\n\n"
+                "Пожалуйста, оцените качество решения."
+            )
             
-            if cursor.rowcount > 0:
-                # Получаем информацию о заявке
-                cursor.execute("""
-                    SELECT user_id, problem
-                    FROM requests
-                    WHERE ticket_id = ?
-                """, (ticket_id,))
-                user_id, problem = cursor.fetchone()
-                
-                # Отправляем уведомление пользователю
-                send_notification(
-                    user_id,
-                    f"✅ Ваша заявка #{ticket_id} решена!\n\n"
-                    f"Проблема: {problem}\n\n"
-                    "Пожалуйста, оцените качество решения."
-                )
-                
-                bot.answer_callback_query(
-                    call.id,
-                    "✅ Заявка помечена как решенная"
-                )
-                
-                # Показываем обновленные детали заявки
-                show_request_details(call.message, ticket_id)
-            else:
-                bot.answer_callback_query(
-                    call.id,
-                    "❌ Не удалось обновить статус заявки"
-                )
+            callback_notice(
+                call,
+                "✅ Заявка помечена как решенная"
+            )
+            
+            # Показываем обновленные детали заявки
+            show_request_details(call.message, ticket_id)
+        else:
+            callback_notice(
+                call,
+                "❌ Не удалось обновить статус заявки"
+            )
     except Exception as e:
         logger.error(f"Error in resolve_issue: {e}")
-        bot.answer_callback_query(
-            call.id,
+        callback_notice(
+            call,
             "❌ Произошла ошибка при обновлении статуса"
         )
 
+@timed_handler
 def close_request(message, ticket_id, is_admin=False):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                UPDATE requests
-                SET status = 'Закрыто',
-                    last_update = CURRENT_TIMESTAMP
-                WHERE ticket_id = ?
-            """, (ticket_id,))
+        owner = ticket_repo.set_status(ticket_id, 'Закрыто')
+        updated = owner is not None
+        if updated:
+            user_id, problem = owner
 
-            if cursor.rowcount > 0:
-                # Получаем информацию о заявке
-                cursor.execute("""
-                    SELECT user_id, problem
-                    FROM requests
-                    WHERE ticket_id = ?
-                """, (ticket_id,))
-                user_id, problem = cursor.fetchone()
-
-                # Отправляем уведомление пользователю
-                if not is_admin:
-                    send_notification(
-                        user_id,
-                        f"✅ Ваша заявка #{ticket_id} была закрыта.\n\n"
-                        f"Проблема: {problem}\n\n"
-                        "Спасибо за использование нашего сервиса!"
-                    )
-                else:
-                    send_notification(
-                        user_id,
-                        f"✅ Администратор закрыл вашу заявку #{ticket_id}.\n\n"
-                        f"Проблема: {problem}\n\n"
-                        "Спасибо за использование нашего сервиса!"
-                    )
+        if updated:
+            ticket_views.invalidate(ticket_id)
 
-                bot.send_message(
-                    message.chat.id,
-                    f"✅ Заявка #{ticket_id} успешно закрыта."
+            # Отправляем уведомление пользователю
+            if not is_admin:
+                send_notification(
+                    user_id,
+                    f"✅ Ваша заявка #{ticket_id} была закрыта.\n\n"
+                    f"Проблема: {problem}\n\n"
+                    "Спасибо за использование нашего сервиса!"
                 )
             else:
-                bot.send_message(
-                    message.chat.id,
-                    "❌ Не удалось закрыть заявку. Возможно, она уже закрыта или не существует."
+                send_notification(
+                    user_id,
+                    f"✅ Администратор закрыл вашу заявку #{ticket_id}.\n\n"
+                    f"Проблема: {problem}\n\n"
+                    "Спасибо за использование нашего сервиса!"
                 )
+
+            bot.send_message(
+                message.chat.id,
+                f"✅ Заявка #{ticket_id} успешно закрыта."
+            )
+        else:
+            bot.send_message(
+                message.chat.id,
+                "❌ Не удалось закрыть заявку. Возможно, она уже закрыта или не существует."
+            )
     except Exception as e:
         logger.error(f"Error in close_request: {e}", exc_info=True)
         bot.send_message(
@@ -822,15 +3724,10 @@ def close_request(message, ticket_id, is_admin=False):
             "❌ Произошла ошибка при закрытии заявки."
         )
 
+@timed_handler
 def start_rating(message, ticket_id):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT problem
-                FROM requests
-                WHERE ticket_id = ?
-            """, (ticket_id,))
-            problem = cursor.fetchone()[0]
+        problem = ticket_repo.owner(ticket_id)[1]
 
         text = (
             f"📝 Заявка #{ticket_id}\n\n"
@@ -858,6 +3755,7 @@ def start_rating(message, ticket_id):
             "❌ Произошла ошибка при запуске оценки."
         )
 
+@timed_handler
 def process_rating(call):
     try:
         # Handle both rate_request_ and rate_ callbacks
@@ -870,19 +3768,15 @@ def process_rating(call):
         _, ticket_id, rating = call.data.split("_")
         rating = int(rating)
 
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                UPDATE requests
-                SET satisfaction_rating = ?,
-                    last_update = CURRENT_TIMESTAMP
-                WHERE ticket_id = ?
-            """, (rating, ticket_id))
+        ticket_repo.set_rating(ticket_id, rating)
 
-            # Обновляем статистику пользователя
-            update_user_stats(call.from_user.id)
+        ticket_views.invalidate(ticket_id)
 
-        bot.answer_callback_query(
-            call.id,
+        # Обновляем статистику пользователя
+        update_user_stats(call.from_user.id)
+
+        callback_notice(
+            call,
             f"✅ Спасибо за вашу оценку! ({'⭐' * rating})"
         )
 
@@ -890,11 +3784,12 @@ def process_rating(call):
         show_request_details(call.message, ticket_id)
     except Exception as e:
         logger.error(f"Error in process_rating: {e}", exc_info=True)
-        bot.answer_callback_query(
-            call.id,
+        callback_notice(
+            call,
             "❌ Произошла ошибка при сохранении оценки."
         )
 
+@timed_handler
 def show_problem_solution(message, category_id, subcategory_id):
     try:
         if category_id not in problems or subcategory_id not in problems[category_id]['categories']:
@@ -921,15 +3816,11 @@ def show_problem_solution(message, category_id, subcategory_id):
         markup = types.InlineKeyboardMarkup(row_width=1)
         markup.add(types.InlineKeyboardButton(
             "📝 Создать заявку",
-            callback_data=f"new_ticket_cat_{category_id}"
+            callback_data=f"new_ticket_cat_{category_id}_{subcategory_id}"
         ))
         markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data=f"cat_{category_id}"))
         
-        bot.send_message(
-            message.chat.id,
-            text,
-            reply_markup=markup
-        )
+        show_screen(message, text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_problem_solution: {e}")
         bot.send_message(
@@ -937,34 +3828,23 @@ def show_problem_solution(message, category_id, subcategory_id):
             "❌ Произошла ошибка при отображении решения."
         )
 
+@timed_handler
 def show_admin_notifications(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT id, message, created_at, is_read
-                FROM notifications
-                ORDER BY created_at DESC
-                LIMIT 50
-            """)
-            
-            notifications = cursor.fetchall()
-            
-            if not notifications:
-                text = "📭 Нет уведомлений"
-            else:
-                text = "📢 Последние уведомления:\n\n"
-                for n_id, message, created_at, is_read in notifications:
-                    status = "✅" if is_read else "❌"
-                    text += f"{status} {created_at}\n{message}\n\n"
-            
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
-            bot.send_message(
-                message.chat.id,
-                text,
-                reply_markup=markup
-            )
+        notifications = notification_repo.recent(50)
+        
+        if not notifications:
+            text = "📭 Нет уведомлений"
+        else:
+            text = "📢 Последние уведомления:\n\n"
+            for n_id, n_text, created_at, is_read in notifications:
+                status = "✅" if is_read else "❌"
+                text += f"{status} {format_time(created_at)}\n{n_text}\n\n"
+        
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        show_screen(message, text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_admin_notifications: {e}")
         bot.send_message(
@@ -972,42 +3852,31 @@ def show_admin_notifications(message):
             "❌ Произошла ошибка при получении уведомлений."
         )
 
+@timed_handler
 def show_users_list(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT user_id, username, first_name, last_name, 
-                       requests_count, rating, solved_issues, avg_response_time
-                FROM users
-                ORDER BY requests_count DESC
-            """)
-            
-            users = cursor.fetchall()
-            
-            if not users:
-                text = "👥 Нет зарегистрированных пользователей"
-            else:
-                text = "👥 Список пользователей:\n\n"
-                for user in users:
-                    user_id, username, first_name, last_name, requests_count, rating, solved_issues, avg_time = user
-                    text += (
-                        f"👤 {first_name} {last_name or ''}\n"
-                        f"📱 @{username or 'нет'}\n"
-                        f"🆔 ID: {user_id}\n"
-                        f"📊 Заявок: {requests_count}\n"
-                        f"⭐ Рейтинг: {rating or 'нет'}\n"
-                        f"✅ Решено: {solved_issues}\n"
-                        f"⏱ Среднее время ответа: {avg_time or 'нет'} мин\n\n"
-                    )
-            
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
-            bot.send_message(
-                message.chat.id,
-                text,
-                reply_markup=markup
-            )
+        users = report_users.list_all()
+        
+        if not users:
+            parts = ["👥 Нет зарегистрированных пользователей"]
+        else:
+            parts = ["👥 Список пользователей:\n\n"]
+            for user in users:
+                user_id, username, first_name, last_name, requests_count, rating, solved_issues, avg_time = user
+                parts.append(
+                    f"👤 {first_name} {last_name or ''}\n"
+                    f"📱 @{username or 'нет'}\n"
+                    f"🆔 ID: {user_id}\n"
+                    f"📊 Заявок: {requests_count}\n"
+                    f"⭐ Рейтинг: {rating or 'нет'}\n"
+                    f"✅ Решено: {solved_issues}\n"
+                    f"⏱ Среднее время ответа: {avg_time or 'нет'} мин\n\n"
+                )
+        
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        show_screen(message, parts, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_users_list: {e}")
         bot.send_message(
@@ -1015,43 +3884,30 @@ def show_users_list(message):
             "❌ Произошла ошибка при получении списка пользователей."
         )
 
+@timed_handler
 def show_all_requests(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT r.ticket_id, r.problem, r.status, r.created_at, r.priority,
-                       u.username, u.first_name, u.last_name
-                FROM requests r
-                JOIN users u ON r.user_id = u.user_id
-                ORDER BY r.created_at DESC
-                LIMIT 50
-            """)
-            
-            requests = cursor.fetchall()
-            
-            if not requests:
-                text = "📭 Нет заявок"
-            else:
-                text = "📋 Все заявки:\n\n"
-                for req in requests:
-                    ticket_id, problem, status, created_at, priority, username, first_name, last_name = req
-                    text += (
-                        f"🔹 #{ticket_id}\n"
-                        f"👤 {first_name} {last_name or ''} (@{username or 'нет'})\n"
-                        f"📝 {problem[:30]}...\n"
-                        f"📊 Статус: {status}\n"
-                        f"📅 Создано: {created_at}\n"
-                        f"⚡️ Приоритет: {priority}\n\n"
-                    )
-            
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
-            bot.send_message(
-                message.chat.id,
-                text,
-                reply_markup=markup
-            )
+        requests = ticket_repo.recent(50)
+        
+        if not requests:
+            parts = ["📭 Нет заявок"]
+        else:
+            parts = ["📋 Все заявки:\n\n"]
+            for req in requests:
+                ticket_id, problem, status, created_at, priority, username, first_name, last_name = req
+                parts.append(
+                    f"🔹 #{ticket_id}\n"
+                    f"👤 {first_name} {last_name or ''} (@{username or 'нет'})\n"
+                    f"📝 {problem[:30]}...\n"
+                    f"📊 Статус: {status}\n"
+                    f"📅 Создано: {format_time(created_at)}\n"
+                    f"⚡️ Приоритет: {priority}\n\n"
+                )
+        
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        show_screen(message, parts, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_all_requests: {e}")
         bot.send_message(
@@ -1059,49 +3915,31 @@ def show_all_requests(message):
             "❌ Произошла ошибка при получении списка заявок."
         )
 
+@timed_handler
 def show_admin_stats(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            # Общая статистика
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_requests,
-                    SUM(CASE WHEN status = 'Решено' THEN 1 ELSE 0 END) as solved_requests,
-                    AVG(response_time) as avg_response_time,
-                    AVG(satisfaction_rating) as avg_rating
-                FROM requests
-            """)
-            stats = cursor.fetchone()
-            
-            # Статистика по категориям
-            cursor.execute("""
-                SELECT category, COUNT(*) as count
-                FROM requests
-                GROUP BY category
-                ORDER BY count DESC
-            """)
-            categories = cursor.fetchall()
-            
-            text = (
-                "📊 Статистика бота:\n\n"
-                f"📝 Всего заявок: {stats[0]}\n"
-                f"✅ Решено: {stats[1]}\n"
-                f"⏱ Среднее время ответа: {stats[2] or 'нет'} мин\n"
-                f"⭐ Средняя оценка: {stats[3] or 'нет'}\n\n"
-                "📈 Статистика по категориям:\n"
-            )
-            
-            for category, count in categories:
-                text += f"• {category}: {count}\n"
-            
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
-            bot.send_message(
-                message.chat.id,
-                text,
-                reply_markup=markup
-            )
+        # Общая статистика
+        stats = report_tickets.summary()
+
+        # Статистика по категориям
+        categories = report_tickets.count_by_category()
+        
+        text = (
+            "📊 Статистика бота:\n\n"
+            f"📝 Всего заявок: {stats[0]}\n"
+            f"✅ Решено: {stats[1]}\n"
+            f"⏱ Среднее время ответа: {stats[2] or 'нет'} мин\n"
+            f"⭐ Средняя оценка: {stats[3] or 'нет'}\n\n"
+            "📈 Статистика по категориям:\n"
+        )
+        
+        for category, count in categories:
+            text += f"• {category}: {count}\n"
+        
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        show_screen(message, text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_admin_stats: {e}")
         bot.send_message(
@@ -1109,6 +3947,7 @@ def show_admin_stats(message):
             "❌ Произошла ошибка при получении статистики."
         )
 
+@timed_handler
 def show_admin_settings(message):
     try:
         text = (
@@ -1122,11 +3961,7 @@ def show_admin_settings(message):
         markup = types.InlineKeyboardMarkup(row_width=1)
         markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
         
-        bot.send_message(
-            message.chat.id,
-            text,
-            reply_markup=markup
-        )
+        show_screen(message, text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_admin_settings: {e}")
         bot.send_message(
@@ -1134,6 +3969,7 @@ def show_admin_settings(message):
             "❌ Произошла ошибка при получении настроек."
         )
 
+@timed_handler
 def cancel_request(message, ticket_id=None):
     try:
         # Удаляем временные данные пользователя
@@ -1150,27 +3986,21 @@ def cancel_request(message, ticket_id=None):
             return
         
         # Если это отмена существующей заявки
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                UPDATE requests
-                SET status = 'Отменено',
-                    last_update = CURRENT_TIMESTAMP
-                WHERE ticket_id = ?
-                AND user_id = ?
-            """, (ticket_id, message.chat.id))
-            
-            if cursor.rowcount > 0:
-                bot.send_message(
-                    message.chat.id,
-                    f"✅ Заявка #{ticket_id} отменена.",
-                    reply_markup=get_problems_keyboard()
-                )
-            else:
-                bot.send_message(
-                    message.chat.id,
-                    "❌ Не удалось отменить заявку. Возможно, она уже закрыта или не существует.",
-                    reply_markup=get_problems_keyboard()
-                )
+        cancelled = ticket_repo.set_status(ticket_id, 'Отменено', user_id=message.chat.id) is not None
+
+        if cancelled:
+            ticket_views.invalidate(ticket_id)
+            bot.send_message(
+                message.chat.id,
+                f"✅ Заявка #{ticket_id} отменена.",
+                reply_markup=get_problems_keyboard()
+            )
+        else:
+            bot.send_message(
+                message.chat.id,
+                "❌ Не удалось отменить заявку. Возможно, она уже закрыта или не существует.",
+                reply_markup=get_problems_keyboard()
+            )
     except Exception as e:
         logger.error(f"Error in cancel_request: {e}")
         bot.send_message(
@@ -1179,73 +4009,251 @@ def cancel_request(message, ticket_id=None):
             reply_markup=get_problems_keyboard()
         )
 
-def show_admin_analytics(message):
+@timed_handler
+def show_admin_profiling(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            # Аналитика по времени
-            cursor.execute("""
-                SELECT 
-                    strftime('%H', created_at) as hour,
-                    COUNT(*) as count
-                FROM requests
-                GROUP BY hour
-                ORDER BY hour
-            """)
-            hourly_stats = cursor.fetchall()
-            
-            # Аналитика по дням недели
-            cursor.execute("""
-                SELECT 
-                    strftime('%w', created_at) as weekday,
-                    COUNT(*) as count
-                FROM requests
-                GROUP BY weekday
-                ORDER BY weekday
-            """)
-            daily_stats = cursor.fetchall()
-            
-            # Аналитика по приоритетам
-            cursor.execute("""
-                SELECT 
-                    priority,
-                    COUNT(*) as count,
-                    AVG(response_time) as avg_time
-                FROM requests
-                GROUP BY priority
-                ORDER BY count DESC
-            """)
-            priority_stats = cursor.fetchall()
-            
-            text = "📊 Аналитика бота:\n\n"
-            
-            # Часовой график
-            text += "🕐 Распределение заявок по часам:\n"
-            for hour, count in hourly_stats:
-                text += f"{hour}:00 - {count} заявок\n"
-            
-            # Дневной график
-            weekdays = ['Воскресенье', 'Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
-            text += "\n📅 Распределение по дням недели:\n"
-            for weekday, count in daily_stats:
-                text += f"{weekdays[int(weekday)]} - {count} заявок\n"
-            
-            # Статистика по приоритетам
-            text += "\n⚡️ Статистика по приоритетам:\n"
-            for priority, count, avg_time in priority_stats:
-                text += (
-                    f"{priority}:\n"
-                    f"• Заявок: {count}\n"
-                    f"• Среднее время ответа: {avg_time or 'нет'} мин\n"
+        session = active_profile
+        status = f"▶️ Активно: {session.describe()}" if session else "⏸ Профилирование не запущено"
+
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        if session:
+            markup.add(types.InlineKeyboardButton("⏹ Остановить и получить отчет", callback_data="admin_profile_stop"))
+        else:
+            markup.add(
+                types.InlineKeyboardButton("▶️ cProfile, 30 с", callback_data="admin_profile_cprofile_30"),
+                types.InlineKeyboardButton("▶️ Сэмплирование, 60 с", callback_data="admin_profile_sample_60")
+            )
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+
+        show_screen(message, f"{PROFILE_USAGE}\n\n{status}", reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Error in show_admin_profiling: {e}")
+        bot.send_message(
+            message.chat.id,
+            "❌ Произошла ошибка при получении состояния профилирования."
+        )
+
+@timed_handler
+def show_admin_backups(message):
+    try:
+        backups = list_backups()
+        parts = ["💾 Резервные копии базы данных\n\n"]
+        if backups:
+            for path in reversed(backups):
+                size_mb = os.path.getsize(path) / (1024 * 1024)
+                parts.append(f"• {os.path.basename(path)} ({size_mb:.1f} МБ)\n")
+        else:
+            parts.append("Копий пока нет.\n")
+        parts.append(
+            f"\nАвтоматически: раз в {CONFIG['BACKUP']['interval_hours']} ч, "
+            f"хранятся последние {CONFIG['BACKUP']['keep']}"
+        )
+        if backup_lock.locked():
+            parts.append("\n\n⏳ Создается новая копия...")
+
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("💾 Создать копию сейчас", callback_data="admin_backup_run"))
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+
+        show_screen(message, parts, reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Error in show_admin_backups: {e}")
+        bot.send_message(
+            message.chat.id,
+            "❌ Произошла ошибка при получении списка резервных копий."
+        )
+
+@timed_handler
+def show_admin_export(message):
+    try:
+        text = (
+            "📤 Выгрузка заявок с перепиской и данными пользователей\n\n"
+            "CSV - строка на каждое сообщение, JSONL - объект на заявку со списком сообщений. "
+            "Файл сжат gzip, время - секунды Unix-эпохи (UTC)."
+        )
+        if export_lock.locked():
+            text += "\n\n⏳ Выполняется выгрузка..."
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(
+            types.InlineKeyboardButton("📄 CSV", callback_data="admin_export_csv"),
+            types.InlineKeyboardButton("📄 JSONL", callback_data="admin_export_jsonl")
+        )
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        show_screen(message, text, reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Error in show_admin_export: {e}")
+        bot.send_message(
+            message.chat.id,
+            "❌ Произошла ошибка при открытии выгрузки."
+        )
+
+# Массовые операции, ожидающие подтверждения: chat_id администратора -> BulkOperation
+pending_bulk_operations = {}
+
+def describe_bulk_operation(operation: BulkOperation) -> str:
+    criteria = operation.criteria
+    action = {
+        "close": "Закрыть",
+        "resolve": "Отметить решенными",
+        "reject": "Отклонить",
+        "assign": f"Назначить агенту {operation.assign_to}"
+    }[operation.action]
+    lines = [f"Действие: {action}", f"Статус: {criteria.status}"]
+    if criteria.category is not None:
+        lines.append(f"Категория: {problems[criteria.category]['title']}")
+    if criteria.created_before is not None:
+        lines.append(f"Созданы до: {format_time(criteria.created_before)} (МСК)")
+    if criteria.duplicates:
+        lines.append("Только повторные заявки")
+    return "\n".join(lines)
+
+@timed_handler
+def show_admin_bulk(message):
+    try:
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("🧹 Закрыть повторные заявки", callback_data="admin_bulk_duplicates"))
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        show_screen(message, BULK_USAGE, reply_markup=markup)
+    except Exception as e:
+        logger.error(f"Error in show_admin_bulk: {e}")
+        bot.send_message(
+            message.chat.id,
+            "❌ Произошла ошибка при открытии массовых операций."
+        )
+
+# Предпросмотр: число подходящих заявок и кнопка подтверждения. Операция запоминается
+# с номером последней подходящей заявки, поэтому заявки, созданные после предпросмотра, не меняются
+@timed_handler
+def preview_bulk_operation(message, operation: BulkOperation):
+    try:
+        count, max_id = ticket_repo.bulk_count(operation.criteria)
+        description = describe_bulk_operation(operation)
+        if not count:
+            bot.send_message(message.chat.id, f"🧹 {description}\n\n📭 Подходящих заявок нет.")
+            return
+
+        operation = operation._replace(criteria=operation.criteria._replace(max_id=max_id))
+        pending_bulk_operations[message.chat.id] = operation
+        markup = types.InlineKeyboardMarkup(row_width=2)
+        markup.add(
+            types.InlineKeyboardButton(f"✅ Выполнить ({count})", callback_data=f"admin_bulk_run_{max_id}"),
+            types.InlineKeyboardButton("❌ Отмена", callback_data="admin_bulk_cancel")
+        )
+        bot.send_message(
+            message.chat.id,
+            f"🧹 {description}\n\nБудет изменено заявок: {count}",
+            reply_markup=markup
+        )
+    except Exception as e:
+        logger.error(f"Error in preview_bulk_operation: {e}")
+        bot.send_message(
+            message.chat.id,
+            "❌ Произошла ошибка при подготовке массовой операции."
+        )
+
+# Выполнение подтвержденной операции: один UPDATE в транзакции (для reject - вместе
+# с сообщениями о причине), затем уведомления пользователям одной пачкой через дайджест
+@timed_handler
+def run_bulk_operation(call, max_id: int):
+    try:
+        operation = pending_bulk_operations.get(call.message.chat.id)
+        if operation is None or operation.criteria.max_id != max_id:
+            callback_notice(call, "⚠️ Операция устарела, выполните предпросмотр заново")
+            return
+        del pending_bulk_operations[call.message.chat.id]
+
+        status = BULK_ACTIONS[operation.action]
+        duplicates = operation.criteria.duplicates
+        reason = "Повторная заявка" if duplicates else "Массовая обработка заявок"
+        with storage.transaction() as cursor:
+            tickets = ticket_repo.bulk_update(
+                operation.criteria, status=status, assigned_to=operation.assign_to, cursor=cursor
+            )
+            if operation.action == "reject":
+                message_repo.add_many(
+                    [(request_id, call.from_user.id, f"Заявка отклонена. Причина: {reason}")
+                     for request_id, _, _, _ in tickets],
+                    cursor=cursor
                 )
-            
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
-            bot.send_message(
-                message.chat.id,
-                text,
-                reply_markup=markup
+
+        # Уведомления и отображение выполняются после фиксации транзакции
+        for _, ticket_id, _, _ in tickets:
+            ticket_views.invalidate(ticket_id)
+
+        delivery_note = ""
+        if operation.action == "assign":
+            if tickets:
+                parts = [f"📌 Вам назначены заявки ({len(tickets)}):\n\n"]
+                parts.extend(f"#{ticket_id} - {problem[:50]}\n" for _, ticket_id, _, problem in tickets)
+                # Изменения уже сохранены: сбой доставки агенту не отменяет операцию
+                try:
+                    send_long_message(operation.assign_to, parts)
+                except Exception as e:
+                    logger.error(f"Error notifying agent {operation.assign_to} about bulk assignment: {e}")
+                    delivery_note = f"\n\n⚠️ Не удалось отправить список заявок агенту {operation.assign_to}"
+        else:
+            texts = {
+                "close": "✅ Администратор закрыл вашу заявку #{ticket_id}.\n\nПроблема: {problem}",
+                "resolve": "✅ Ваша заявка #{ticket_id} решена!\n\nПроблема: {problem}\n\n"
+                           "Пожалуйста, оцените качество решения.",
+                "reject": "❌ Ваша заявка #{ticket_id} была отклонена.\n\nПричина: " + reason
+            }
+            notification_digest.add_many([
+                (user_id, texts[operation.action].format(ticket_id=ticket_id, problem=problem))
+                for _, ticket_id, user_id, problem in tickets
+            ])
+
+        metrics.inc("bot_bulk_tickets_total", {"action": operation.action}, len(tickets))
+        logger.info(f"Bulk {operation.action} applied to {len(tickets)} tickets")
+        callback_notice(call, f"✅ Изменено заявок: {len(tickets)}")
+        bot.send_message(
+            call.message.chat.id,
+            f"✅ Массовая операция выполнена\n\n{describe_bulk_operation(operation)}\n\n"
+            f"Изменено заявок: {len(tickets)}{delivery_note}",
+            reply_markup=get_admin_keyboard()
+        )
+    except Exception as e:
+        logger.error(f"Error in run_bulk_operation: {e}", exc_info=True)
+        callback_notice(call, "❌ Произошла ошибка при выполнении массовой операции")
+
+@timed_handler
+def show_admin_analytics(message):
+    try:
+        # Аналитика по времени
+        hourly_stats = report_tickets.count_by_hour()
+
+        # Аналитика по дням недели
+        daily_stats = report_tickets.count_by_weekday()
+
+        # Аналитика по приоритетам
+        priority_stats = report_tickets.priority_stats()
+        
+        parts = ["📊 Аналитика бота:\n\n"]
+        
+        # Часовой график
+        parts.append("🕐 Распределение заявок по часам:\n")
+        for hour, count in hourly_stats:
+            parts.append(f"{hour:02d}:00 - {count} заявок\n")
+        
+        # Дневной график
+        weekdays = ['Воскресенье', 'Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
+        parts.append("\n📅 Распределение по дням недели:\n")
+        for weekday, count in daily_stats:
+            parts.append(f"{weekdays[int(weekday)]} - {count} заявок\n")
+        
+        # Статистика по приоритетам
+        parts.append("\n⚡️ Статистика по приоритетам:\n")
+        for priority, count, avg_time in priority_stats:
+            parts.append(
+                f"{priority}:\n"
+                f"• Заявок: {count}\n"
+                f"• Среднее время ответа: {avg_time or 'нет'} мин\n"
             )
+        
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        show_screen(message, parts, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_admin_analytics: {e}")
         bot.send_message(
@@ -1253,6 +4261,7 @@ def show_admin_analytics(message):
             "❌ Произошла ошибка при получении аналитики."
         )
 
+@timed_handler
 def start_admin_reply(message, ticket_id):
     try:
         msg = bot.send_message(
@@ -1267,41 +4276,42 @@ def start_admin_reply(message, ticket_id):
             "❌ Произошла ошибка при начале ответа на заявку."
         )
 
+@timed_handler
 def process_admin_reply(message, ticket_id):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
+        if not (message.text or "").strip():
+            bot.send_message(message.chat.id, "❌ Ответ должен содержать текст. Ответ не отправлен.")
+            return
+
+        with storage.transaction() as cursor:
             # Получаем информацию о заявке
-            cursor.execute("""
-                SELECT user_id, problem
-                FROM requests
-                WHERE ticket_id = ?
-            """, (ticket_id,))
-            user_id, problem = cursor.fetchone()
-            
+            user_id, problem = ticket_repo.owner(ticket_id, cursor=cursor)
+
             # Сохраняем сообщение
-            cursor.execute("""
-                INSERT INTO request_messages (request_id, sender_id, message_text)
-                VALUES (
-                    (SELECT id FROM requests WHERE ticket_id = ?),
-                    ?,
-                    ?
-                )
-            """, (ticket_id, message.from_user.id, message.text))
-            
-            # Отправляем уведомление пользователю
-            send_notification(
-                user_id,
-                f"📨 Получен ответ на вашу заявку #{ticket_id}:\n\n"
-                f"{message.text}"
-            )
-            
-            bot.send_message(
-                message.chat.id,
-                "✅ Ответ успешно отправлен пользователю."
-            )
-            
-            # Показываем обновленные детали заявки
-            show_request_details(message, ticket_id)
+            added = message_repo.add(ticket_id, message.from_user.id, message.text, key=message_key(message), cursor=cursor)
+
+        if not added:
+            # Повторная доставка того же сообщения: ответ уже сохранен и отправлен
+            metrics.inc("bot_duplicate_updates_total", {"kind": "message"})
+            return
+
+        # Уведомления и отображение выполняются после фиксации транзакции
+        ticket_views.invalidate(ticket_id)
+
+        # Отправляем уведомление пользователю
+        send_notification(
+            user_id,
+            f"📨 Получен ответ на вашу заявку #{ticket_id}:\n\n"
+            f"{message.text}"
+        )
+        
+        bot.send_message(
+            message.chat.id,
+            "✅ Ответ успешно отправлен пользователю."
+        )
+        
+        # Показываем обновленные детали заявки
+        show_request_details(message, ticket_id)
     except Exception as e:
         logger.error(f"Error in process_admin_reply: {e}")
         bot.send_message(
@@ -1309,6 +4319,7 @@ def process_admin_reply(message, ticket_id):
             "❌ Произошла ошибка при отправке ответа."
         )
 
+@timed_handler
 def start_admin_reject(message, ticket_id):
     try:
         msg = bot.send_message(
@@ -1323,82 +4334,77 @@ def start_admin_reject(message, ticket_id):
             "❌ Произошла ошибка при отклонении заявки."
         )
 
+@timed_handler
 def process_admin_reject(message, ticket_id):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            # Обновляем статус заявки
-            cursor.execute("""
-                UPDATE requests
-                SET status = 'Отклонено',
-                    last_update = CURRENT_TIMESTAMP
-                WHERE ticket_id = ?
-            """, (ticket_id,))
-            
-            # Получаем информацию о заявке
-            cursor.execute("""
-                SELECT user_id, problem
-                FROM requests
-                WHERE ticket_id = ?
-            """, (ticket_id,))
-            user_id, problem = cursor.fetchone()
-            
+        with storage.transaction() as cursor:
+            # Обновляем статус заявки и получаем информацию о ней
+            owner = ticket_repo.set_status(ticket_id, 'Отклонено', cursor=cursor)
+
             # Сохраняем сообщение с причиной
-            cursor.execute("""
-                INSERT INTO request_messages (request_id, sender_id, message_text)
-                VALUES (
-                    (SELECT id FROM requests WHERE ticket_id = ?),
-                    ?,
-                    ?
+            if owner is not None:
+                message_repo.add(
+                    ticket_id, message.from_user.id, f"Заявка отклонена. Причина: {message.text}",
+                    key=message_key(message), cursor=cursor
                 )
-            """, (ticket_id, message.from_user.id, f"Заявка отклонена. Причина: {message.text}"))
-            
-            # Отправляем уведомление пользователю
-            send_notification(
-                user_id,
-                f"❌ Ваша заявка #{ticket_id} была отклонена.\n\n"
-                f"Причина: {message.text}"
-            )
-            
+
+        if owner is None:
+            # Заявка уже отклонена (в том числе повторной доставкой того же сообщения)
             bot.send_message(
                 message.chat.id,
-                "✅ Заявка успешно отклонена."
+                "ℹ️ Заявка уже отклонена или не найдена."
             )
-            
-            # Показываем обновленные детали заявки
-            show_request_details(message, ticket_id)
+            return
+        user_id, problem = owner
+
+        ticket_views.invalidate(ticket_id)
+
+        # Отправляем уведомление пользователю
+        send_notification(
+            user_id,
+            f"❌ Ваша заявка #{ticket_id} была отклонена.\n\n"
+            f"Причина: {message.text}",
+            critical=True
+        )
+        
+        bot.send_message(
+            message.chat.id,
+            "✅ Заявка успешно отклонена."
+        )
+        
+        # Показываем обновленные детали заявки
+        show_request_details(message, ticket_id)
     except Exception as e:
         logger.error(f"Error in process_admin_reject: {e}")
         bot.send_message(
             message.chat.id,
-            "❌ Произошла ошибка при отклонении заявки."
+            "❌ Произошла ошибка при отклонении заявки."
+        )
+
+@timed_handler
+def add_comment(message, ticket_id):
+    try:
+        with storage.transaction() as cursor:
+            added = message_repo.add(ticket_id, message.from_user.id, message.text, key=message_key(message), cursor=cursor)
+
+            # Обновляем время последнего обновления заявки
+            if added:
+                ticket_repo.touch(ticket_id, cursor=cursor)
+
+        if not added:
+            # Повторная доставка того же сообщения: комментарий уже сохранен
+            metrics.inc("bot_duplicate_updates_total", {"kind": "message"})
+            return
+
+        ticket_views.invalidate(ticket_id)
+
+        bot.send_message(
+            message.chat.id,
+            "✅ Комментарий успешно добавлен."
         )
-
-def add_comment(message, ticket_id):
-    try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                INSERT INTO request_messages (request_id, sender_id, message_text)
-                VALUES (
-                    (SELECT id FROM requests WHERE ticket_id = ?),
-                    ?,
-                    ?
-                )
-            """, (ticket_id, message.from_user.id, message.text))
-            
-            # Обновляем время последнего обновления заявки
-            cursor.execute("""
-                UPDATE requests
-                SET last_update = CURRENT_TIMESTAMP
-                WHERE ticket_id = ?
-            """, (ticket_id,))
-            
-            bot.send_message(
-                message.chat.id,
-                "✅ Комментарий успешно добавлен."
-            )
-            
-            # Показываем обновленные детали заявки
-            show_request_details(message, ticket_id)
+        
+        # Показываем обновленные детали заявки
+        show_request_details(message, ticket_id)
     except Exception as e:
         logger.error(f"Error in add_comment: {e}")
         bot.send_message(
@@ -1406,66 +4412,46 @@ def add_comment(message, ticket_id):
             "❌ Произошла ошибка при добавлении комментария."
         )
 
+@timed_handler
 def show_admin_tickets_chat(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT r.ticket_id, r.problem, r.status, r.created_at, 
-                       u.username, u.first_name, u.last_name
-                FROM requests r
-                JOIN users u ON r.user_id = u.user_id
-                WHERE r.status != 'Закрыто'
-                ORDER BY 
-                    CASE r.status
-                        WHEN 'Открыто' THEN 1
-                        WHEN 'Решено' THEN 2
-                        ELSE 3
-                    END,
-                    r.created_at DESC
-                LIMIT 10
-            """)
-            
-            active_tickets = cursor.fetchall()
-            
-            if not active_tickets:
-                bot.send_message(
-                    message.chat.id,
-                    "📭 Нет активных заявок",
-                    reply_markup=get_admin_keyboard()
-                )
-                return
-            
-            text = "💬 Активные заявки:\n\n"
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            
-            for ticket in active_tickets:
-                ticket_id, problem, status, created_at, username, first_name, last_name = ticket
-                status_emoji = {
-                    'Открыто': '🆕',
-                    'Решено': '✅',
-                    'Отклонено': '❌'
-                }.get(status, '❓')
-                
-                user_display = f"{first_name} {last_name or ''}" if first_name else f"@{username}" if username else "Неизвестный"
-                
-                button_text = (
-                    f"{status_emoji} #{ticket_id} | {status}\n"
-                    f"👤 {user_display}\n"
-                    f"📝 {problem[:30]}..."
-                )
-                
-                markup.add(types.InlineKeyboardButton(
-                    button_text,
-                    callback_data=f"admin_ticket_chat_{ticket_id}"
-                ))
-            
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
+        active_tickets = ticket_repo.active(10)
+        
+        if not active_tickets:
             bot.send_message(
                 message.chat.id,
-                text,
-                reply_markup=markup
+                "📭 Нет активных заявок",
+                reply_markup=get_admin_keyboard()
+            )
+            return
+        
+        text = "💬 Активные заявки:\n\n"
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        
+        for ticket in active_tickets:
+            ticket_id, problem, status, created_at, username, first_name, last_name = ticket
+            status_emoji = {
+                'Открыто': '🆕',
+                'Решено': '✅',
+                'Отклонено': '❌'
+            }.get(status, '❓')
+            
+            user_display = f"{first_name} {last_name or ''}" if first_name else f"@{username}" if username else "Неизвестный"
+            
+            button_text = (
+                f"{status_emoji} #{ticket_id} | {status}\n"
+                f"👤 {user_display}\n"
+                f"📝 {problem[:30]}..."
             )
+            
+            markup.add(types.InlineKeyboardButton(
+                button_text,
+                callback_data=f"admin_ticket_chat_{ticket_id}"
+            ))
+        
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        show_screen(message, text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_admin_tickets_chat: {e}")
         bot.send_message(
@@ -1473,85 +4459,88 @@ def show_admin_tickets_chat(message):
             "❌ Произошла ошибка при получении списка заявок."
         )
 
-def show_admin_ticket_chat(message, ticket_id):
-    try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT r.problem, r.status, r.created_at, r.priority,
-                       u.username, u.first_name, u.last_name, u.user_id
-                FROM requests r
-                JOIN users u ON r.user_id = u.user_id
-                WHERE r.ticket_id = ?
-            """, (ticket_id,))
-            
-            ticket_info = cursor.fetchone()
-            if not ticket_info:
-                bot.send_message(
-                    message.chat.id,
-                    "❌ Заявка не найдена."
-                )
-                return
-            
-            problem, status, created_at, priority, username, first_name, last_name, user_id = ticket_info
-            
-            # Получаем историю сообщений
-            cursor.execute("""
-                SELECT rm.sender_id, rm.message_text, rm.sent_at,
-                       u.username, u.first_name, u.last_name
-                FROM request_messages rm
-                LEFT JOIN users u ON rm.sender_id = u.user_id
-                WHERE rm.request_id = (SELECT id FROM requests WHERE ticket_id = ?)
-                ORDER BY rm.sent_at
-            """, (ticket_id,))
-            
-            messages = cursor.fetchall()
-            
-            # Формируем текст с информацией о заявке
-            user_display = f"{first_name} {last_name or ''}" if first_name else f"@{username}" if username else "Неизвестный"
-            
-            text = (
-                f"📋 Заявка #{ticket_id}\n\n"
-                f"👤 Пользователь: {user_display}\n"
-                f"📊 Статус: {status}\n"
-                f"⚡️ Приоритет: {priority}\n"
-                f"📅 Создано: {created_at}\n\n"
-                f"📝 Проблема:\n{problem}\n\n"
+# Загрузка переписки по заявке для администратора через кэш представлений
+def load_admin_ticket_view(ticket_id: str, before_id: Optional[int] = None) -> Optional[TicketView]:
+    view = ticket_views.get("admin_chat", ticket_id, before_id)
+    if view is not None:
+        return view
+
+    version = ticket_views.version(ticket_id)
+    with storage.transaction() as cursor:
+        ticket_info = ticket_repo.admin_details(ticket_id, cursor=cursor)
+        if not ticket_info:
+            return None
+        
+        request_id, problem, status, created_at, priority, username, first_name, last_name, user_id = ticket_info
+        
+        # Получаем страницу истории сообщений
+        messages, older_cursor = message_repo.page(request_id, before_id, cursor=cursor)
+    
+    # Формируем текст с информацией о заявке
+    user_display = f"{first_name} {last_name or ''}" if first_name else f"@{username}" if username else "Неизвестный"
+    
+    text = (
+        f"📋 Заявка #{ticket_id}\n\n"
+        f"👤 Пользователь: {user_display}\n"
+        f"📊 Статус: {status}\n"
+        f"⚡️ Приоритет: {priority}\n"
+        f"📅 Создано: {format_time(created_at)}\n\n"
+        f"📝 Проблема:\n{problem}\n\n"
+    )
+    
+    if messages:
+        text += "💬 История сообщений (более ранние):\n" if before_id else "💬 История сообщений:\n"
+        for msg in messages:
+            message_id, sender_id, msg_text, sent_at = msg
+            sender_display = (
+                "👨‍💼 Админ: " if sender_id == ADMIN_ID
+                else "👤 Пользователь: "
             )
-            
-            if messages:
-                text += "💬 История сообщений:\n"
-                for msg in messages:
-                    sender_id, msg_text, sent_at, s_username, s_first_name, s_last_name = msg
-                    sender_display = (
-                        "👨‍💼 Админ: " if sender_id == ADMIN_ID
-                        else "👤 Пользователь: "
-                    )
-                    text += f"\n{sent_at}\n{sender_display}{msg_text}\n"
-            
-            # Создаем клавиатуру с действиями
-            markup = types.InlineKeyboardMarkup(row_width=2)
-            
-            if status == 'Открыто':
-                markup.add(
-                    types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}"),
-                    types.InlineKeyboardButton("✅ Решено", callback_data=f"admin_resolve_{ticket_id}")
-                )
-                markup.add(
-                    types.InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_reject_{ticket_id}")
-                )
-            elif status == 'Решено':
-                markup.add(
-                    types.InlineKeyboardButton("✅ Закрыть", callback_data=f"admin_close_{ticket_id}"),
-                    types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}")
-                )
-            
-            markup.add(types.InlineKeyboardButton("◀️ Назад к заявкам", callback_data="admin_tickets_chat"))
-            
+            text += f"\n{format_time(sent_at)}\n{sender_display}{msg_text}\n"
+
+    view = TicketView(text, status, user_id, older_cursor)
+    ticket_views.put("admin_chat", ticket_id, version, view, before_id)
+    return view
+
+@timed_handler
+def show_admin_ticket_chat(message, ticket_id, before_id=None):
+    try:
+        view = load_admin_ticket_view(ticket_id, before_id)
+        if view is None:
             bot.send_message(
                 message.chat.id,
-                text,
-                reply_markup=markup
+                "❌ Заявка не найдена."
             )
+            return
+
+        text, status, user_id, older_cursor = view
+        
+        # Создаем клавиатуру с действиями
+        markup = types.InlineKeyboardMarkup(row_width=2)
+
+        # Навигация по истории сообщений
+        if older_cursor:
+            markup.add(types.InlineKeyboardButton("⏪ Более ранние", callback_data=f"admin_hist_{ticket_id}_{older_cursor}"))
+        if before_id:
+            markup.add(types.InlineKeyboardButton("⏩ К последним", callback_data=f"admin_ticket_chat_{ticket_id}"))
+        
+        if status == 'Открыто':
+            markup.add(
+                types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}"),
+                types.InlineKeyboardButton("✅ Решено", callback_data=f"admin_resolve_{ticket_id}")
+            )
+            markup.add(
+                types.InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_reject_{ticket_id}")
+            )
+        elif status == 'Решено':
+            markup.add(
+                types.InlineKeyboardButton("✅ Закрыть", callback_data=f"admin_close_{ticket_id}"),
+                types.InlineKeyboardButton("💬 Ответить", callback_data=f"admin_reply_{ticket_id}")
+            )
+        
+        markup.add(types.InlineKeyboardButton("◀️ Назад к заявкам", callback_data="admin_tickets_chat"))
+        
+        show_screen(message, text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_admin_ticket_chat: {e}")
         bot.send_message(
@@ -1559,10 +4548,72 @@ def show_admin_ticket_chat(message, ticket_id):
             "❌ Произошла ошибка при отображении заявки."
         )
 
+# Ответить на callback-запрос можно только один раз: право ответа забирает первый из
+# потока подтверждений и обработчика
+callback_answer_lock = threading.Lock()
+
+def claim_callback_answer(call) -> bool:
+    with callback_answer_lock:
+        if getattr(call, "acked", False):
+            return False
+        call.acked = True
+        return True
+
+# Подтверждение callback-запроса без текста
+def ack_callback(call) -> bool:
+    if not claim_callback_answer(call):
+        return True
+    try:
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logger.warning(f"Error answering callback {call.id}: {e}")
+        return False
+    received_at = getattr(call, "received_at", None)
+    if received_at is not None:
+        metrics.observe(
+            "bot_callback_ack_seconds",
+            {"action": callback_action(call.data)},
+            time.perf_counter() - received_at
+        )
+    return True
+
+# Короткое уведомление по итогам обработки callback-запроса - всплывающий текст ответа.
+# Если запрос уже подтвержден при получении (так бывает только с ошибками в действиях
+# без уведомлений), текст отправляется в чат, чтобы пользователь узнал о сбое
+def callback_notice(call, text: str, show_alert: bool = False):
+    if claim_callback_answer(call):
+        bot.answer_callback_query(call.id, text, show_alert=show_alert)
+    else:
+        bot.send_message(call.message.chat.id, text)
+
+# Потоки, подтверждающие callback-запросы из middleware: сетевой вызов не задерживает
+# ни получение следующих обновлений, ни очередь обработчиков
+class CallbackAcknowledger:
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def submit(self, call):
+        self._queue.put(call)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def run(self):
+        while True:
+            ack_callback(self._queue.get())
+
+callback_acks = CallbackAcknowledger()
+metrics.gauge("bot_callback_acks_pending", callback_acks.pending)
+
 @bot.callback_query_handler(func=lambda call: True)
+@timed_handler
 def callback_handler(call):
+    started = time.perf_counter()
     try:
-        logger.info(f"Received callback: {call.data} from user {call.from_user.id}")
+        logger.info(
+            "Received callback: %s from user %s", call.data, call.from_user.id,
+            extra={"chat_id": call.from_user.id, "handler": "callback_handler", "sampled": True}
+        )
         
         # Обработка админ-команд
         if call.from_user.id == ADMIN_ID:
@@ -1573,6 +4624,10 @@ def callback_handler(call):
                 ticket_id = call.data.split("_")[3]
                 show_admin_ticket_chat(call.message, ticket_id)
                 return
+            elif call.data.startswith("admin_hist_"):
+                _, _, ticket_id, before_id = call.data.split("_")
+                show_admin_ticket_chat(call.message, ticket_id, int(before_id))
+                return
             elif call.data == "admin_all_requests":
                 show_all_requests(call.message)
                 return
@@ -1591,6 +4646,53 @@ def callback_handler(call):
             elif call.data == "admin_analytics":
                 show_admin_analytics(call.message)
                 return
+            elif call.data == "admin_profile":
+                show_admin_profiling(call.message)
+                return
+            elif call.data == "admin_backup":
+                show_admin_backups(call.message)
+                return
+            elif call.data == "admin_export":
+                show_admin_export(call.message)
+                return
+            elif call.data in ("admin_export_csv", "admin_export_jsonl"):
+                if start_export(call.message.chat.id, call.data.rsplit("_", 1)[1]):
+                    callback_notice(call, "⏳ Выгрузка запущена, файл придет в этот чат")
+                else:
+                    callback_notice(call, "⚠️ Выгрузка уже выполняется")
+                return
+            elif call.data == "admin_bulk":
+                show_admin_bulk(call.message)
+                return
+            elif call.data == "admin_bulk_duplicates":
+                preview_bulk_operation(
+                    call.message, BulkOperation("close", None, BulkFilter("Открыто", None, None, True))
+                )
+                return
+            elif call.data == "admin_bulk_cancel":
+                pending_bulk_operations.pop(call.message.chat.id, None)
+                callback_notice(call, "❌ Массовая операция отменена")
+                return
+            elif call.data.startswith("admin_bulk_run_"):
+                run_bulk_operation(call, int(call.data.rsplit("_", 1)[1]))
+                return
+            elif call.data == "admin_backup_run":
+                if start_backup(call.message.chat.id):
+                    callback_notice(call, "⏳ Создание резервной копии запущено")
+                else:
+                    callback_notice(call, "⚠️ Резервная копия уже создается")
+                return
+            elif call.data == "admin_profile_stop":
+                if not stop_profiling():
+                    callback_notice(call, "ℹ️ Профилирование не запущено")
+                return
+            elif call.data.startswith("admin_profile_"):
+                _, _, mode, seconds = call.data.split("_")
+                if start_profiling(call.message.chat.id, mode, seconds=int(seconds)):
+                    callback_notice(call, "▶️ Профилирование запущено")
+                else:
+                    callback_notice(call, "⚠️ Профилирование уже запущено")
+                return
             elif call.data.startswith("admin_reply_"):
                 ticket_id = call.data.split("_")[2]
                 start_admin_reply(call.message, ticket_id)
@@ -1614,14 +4716,16 @@ def callback_handler(call):
         elif call.data == "cancel_new_ticket":
             cancel_request(call.message)
         elif call.data.startswith("new_ticket_cat_"):
-            category_id = call.data.split("_")[3]
-            # Генерация уникального ID заявки
-            ticket_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-            
-            # Сохранение временных данных
+            # new_ticket_cat_<категория>[_<подкатегория>]: приоритет заявки берется из подкатегории
+            parts = call.data.split("_", 4)
+            category_id = parts[3]
+            subcategory = problems.get(category_id, {}).get('categories', {}).get(parts[4] if len(parts) > 4 else None)
+            if ticket_quota_exceeded(call.message.chat.id):
+                return
+            # Сохранение временных данных (номер заявке присваивается при сохранении)
             temp_data[call.message.chat.id] = {
-                'ticket_id': ticket_id,
-                'category': category_id
+                'category': category_id,
+                'priority': subcategory['priority'] if subcategory else "Средний"
             }
             
             # Запрос описания проблемы
@@ -1639,7 +4743,7 @@ def callback_handler(call):
                 show_problem_solution(call.message, category_id, subcategory_id)
             except ValueError:
                 logger.error(f"Invalid subcategory format: {call.data}")
-                bot.answer_callback_query(call.id, "❌ Неверный формат данных")
+                callback_notice(call, "❌ Неверный формат данных")
         elif call.data == "support":
             start_support_request(call.message)
         elif call.data == "my_requests":
@@ -1647,43 +4751,34 @@ def callback_handler(call):
         elif call.data == "back_to_main":
             try:
                 if call.from_user.id == ADMIN_ID and admin_mode.get(call.from_user.id, False):
-                    bot.edit_message_text(
-                        "Выберите действие:",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=get_admin_keyboard()
-                    )
+                    show_screen(call.message, "Выберите действие:", reply_markup=get_admin_keyboard())
                 else:
-                    bot.edit_message_text(
-                        "Выберите категорию проблемы:",
-                        call.message.chat.id,
-                        call.message.message_id,
-                        reply_markup=get_problems_keyboard()
-                    )
+                    show_screen(call.message, "Выберите категорию проблемы:", reply_markup=get_problems_keyboard())
             except Exception as e:
                 logger.error(f"Error in back_to_main: {e}")
-                bot.answer_callback_query(call.id, "❌ Не удалось вернуться в главное меню")
+                callback_notice(call, "❌ Не удалось вернуться в главное меню")
         elif call.data.startswith("request_"):
             ticket_id = call.data[8:]
             show_request_details(call.message, ticket_id)
+        elif call.data.startswith("hist_"):
+            _, ticket_id, before_id = call.data.split("_")
+            show_request_details(call.message, ticket_id, int(before_id))
         elif call.data.startswith("resolve_"):
             resolve_issue(call)
         elif call.data.startswith("comment_"):
             ticket_id = call.data[8:]
             try:
-                with DatabaseConnection("support_bot.db") as cursor:
-                    cursor.execute("SELECT id FROM requests WHERE ticket_id = ?", (ticket_id,))
-                    if cursor.fetchone():
-                        msg = bot.send_message(
-                            call.message.chat.id,
-                            "Введите ваш комментарий к заявке:"
-                        )
-                        bot.register_next_step_handler(msg, add_comment, ticket_id)
-                    else:
-                        bot.answer_callback_query(call.id, "❌ Заявка не найдена")
+                if ticket_repo.exists(ticket_id):
+                    msg = bot.send_message(
+                        call.message.chat.id,
+                        "Введите ваш комментарий к заявке:"
+                    )
+                    bot.register_next_step_handler(msg, add_comment, ticket_id)
+                else:
+                    callback_notice(call, "❌ Заявка не найдена")
             except Exception as e:
                 logger.error(f"Error in comment handler: {e}")
-                bot.answer_callback_query(call.id, "❌ Не удалось добавить комментарий")
+                callback_notice(call, "❌ Не удалось добавить комментарий")
         elif call.data.startswith("cancel_"):
             ticket_id = call.data[7:]
             cancel_request(call.message, ticket_id)
@@ -1698,14 +4793,23 @@ def callback_handler(call):
                 start_rating(call.message, ticket_id)
         else:
             logger.warning(f"Unknown callback data: {call.data}")
-            bot.answer_callback_query(call.id, "❌ Неизвестная команда")
+            callback_notice(call, "❌ Неизвестная команда")
     except Exception as e:
         logger.error(f"Error in callback handler: {str(e)}", exc_info=True)
         try:
-            bot.answer_callback_query(call.id, "❌ Произошла ошибка. Попробуйте позже.")
+            callback_notice(call, "❌ Произошла ошибка. Попробуйте позже.")
         except Exception as inner_e:
             logger.error(f"Error sending error message: {inner_e}")
+    finally:
+        # Запрос без уведомления подтверждается по завершении обработки
+        ack_callback(call)
+        metrics.observe(
+            "bot_callback_duration_seconds",
+            {"action": callback_action(call.data)},
+            time.perf_counter() - started
+        )
 
+@timed_handler
 def process_problem_description(message):
     try:
         if message.chat.id not in temp_data:
@@ -1717,22 +4821,32 @@ def process_problem_description(message):
             return
 
         ticket_data = temp_data[message.chat.id]
-        
-        # Создаем новую заявку в базе данных
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                INSERT INTO requests (ticket_id, user_id, category, problem, created_at, last_update)
-                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            """, (ticket_data['ticket_id'], message.chat.id, ticket_data['category'], message.text))
+        if ticket_quota_exceeded(message.chat.id):
+            del temp_data[message.chat.id]
+            return
+
+        # Создаем новую заявку в базе данных. Номер выдается в момент вставки, чтобы порядок
+        # номеров совпадал с порядком заявок; занятый номер (перезапуск процесса в ту же
+        # секунду) заменяется следующим
+        priority = ticket_data.get('priority', "Средний")
+        ticket_data['ticket_id'] = ticket_ids.next()
+        while not ticket_repo.create(
+            ticket_data['ticket_id'], message.chat.id, ticket_data['category'], message.text, priority
+        ):
+            ticket_data['ticket_id'] = ticket_ids.next()
+        created_at = epoch_now()
+        ticket_quota.record(message.chat.id, created_at)
+        activity_tracker.add_request(message.chat.id)
 
-        # Отправляем уведомление администратору
+        # Оповещаем поддержку (вне рабочего времени несрочные заявки попадут в утреннюю сводку)
         admin_notification = (
             f"📝 Новая заявка #{ticket_data['ticket_id']}\n"
             f"От: {message.from_user.first_name} {message.from_user.last_name or ''} (@{message.from_user.username or 'нет'})\n"
-            f"Категория: {problems[ticket_data['category']]['title']}\n\n"
+            f"Категория: {problems[ticket_data['category']]['title']}\n"
+            f"Приоритет: {priority}\n\n"
             f"Проблема:\n{message.text}"
         )
-        bot.send_message(ADMIN_ID, admin_notification)
+        alert_router.new_ticket(admin_notification, priority, created_at)
 
         # Отправляем подтверждение пользователю
         confirmation = (
@@ -1764,48 +4878,37 @@ def signal_handler(sig, frame):
 
 signal.signal(signal.SIGINT, signal_handler)
 
+@timed_handler
 def show_user_requests(message):
     try:
-        with DatabaseConnection("support_bot.db") as cursor:
-            cursor.execute("""
-                SELECT ticket_id, problem, status, created_at, priority
-                FROM requests
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-            """, (message.chat.id,))
-            
-            requests = cursor.fetchall()
-            
-            if not requests:
-                bot.send_message(
-                    message.chat.id,
-                    "📭 У вас пока нет заявок."
-                )
-                return
-            
-            text = "📋 Ваши заявки:\n\n"
-            markup = types.InlineKeyboardMarkup(row_width=1)
-            
-            for ticket_id, problem, status, created_at, priority in requests:
-                text += (
-                    f"🔹 #{ticket_id}\n"
-                    f"📝 {problem[:30]}...\n"
-                    f"📊 Статус: {status}\n"
-                    f"📅 Создано: {created_at}\n"
-                    f"⚡️ Приоритет: {priority}\n\n"
-                )
-                markup.add(types.InlineKeyboardButton(
-                    f"#{ticket_id} - {problem[:30]}...",
-                    callback_data=f"request_{ticket_id}"
-                ))
-            
-            markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
-            
+        requests = ticket_repo.list_for_user(message.chat.id)
+        
+        if not requests:
             bot.send_message(
                 message.chat.id,
-                text,
-                reply_markup=markup
+                "📭 У вас пока нет заявок."
+            )
+            return
+        
+        parts = ["📋 Ваши заявки:\n\n"]
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        
+        for ticket_id, problem, status, created_at, priority in requests:
+            parts.append(
+                f"🔹 #{ticket_id}\n"
+                f"📝 {problem[:30]}...\n"
+                f"📊 Статус: {status}\n"
+                f"📅 Создано: {format_time(created_at)}\n"
+                f"⚡️ Приоритет: {priority}\n\n"
             )
+            markup.add(types.InlineKeyboardButton(
+                f"#{ticket_id} - {problem[:30]}...",
+                callback_data=f"request_{ticket_id}"
+            ))
+        
+        markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
+        
+        show_screen(message, parts, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_user_requests: {e}")
         bot.send_message(
@@ -1813,6 +4916,7 @@ def show_user_requests(message):
             "❌ Произошла ошибка при получении списка заявок."
         )
 
+@timed_handler
 def show_category_problems(message, category_id):
     try:
         if category_id not in problems:
@@ -1834,11 +4938,7 @@ def show_category_problems(message, category_id):
         
         markup.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_main"))
         
-        bot.send_message(
-            message.chat.id,
-            text,
-            reply_markup=markup
-        )
+        show_screen(message, text, reply_markup=markup)
     except Exception as e:
         logger.error(f"Error in show_category_problems: {e}")
         bot.send_message(
@@ -1846,14 +4946,14 @@ def show_category_problems(message, category_id):
             "❌ Произошла ошибка при отображении категории."
         )
 
+@timed_handler
 def start_support_request(message):
     try:
-        # Генерация уникального ID заявки
-        ticket_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        
-        # Сохранение временных данных
+        if ticket_quota_exceeded(message.chat.id):
+            return
+
+        # Сохранение временных данных (номер заявке присваивается при сохранении)
         temp_data[message.chat.id] = {
-            'ticket_id': ticket_id,
             'step': 'category'
         }
         
@@ -1883,28 +4983,210 @@ def start_support_request(message):
             "❌ Произошла ошибка при создании заявки."
         )
 
+# Периодические задачи обслуживания (выполняются только в основном процессе)
+def periodic_tasks():
+    while True:
+        try:
+            auto_close_inactive_requests()
+            run_retention()
+            if backup_due():
+                try:
+                    create_backup()
+                except Exception:
+                    pass  # Ошибка уже записана в лог, повтор на следующем проходе
+            time.sleep(3600)  # Проверка каждый час
+        except Exception as e:
+            logger.error(f"Error in periodic tasks: {e}")
+            time.sleep(60)
+
+def start_background_tasks(periodic: bool = True):
+    if periodic:
+        periodic_thread = threading.Thread(target=periodic_tasks)
+        periodic_thread.daemon = True
+        periodic_thread.start()
+
+        dedup_thread = threading.Thread(
+            target=update_dedup.run,
+            args=(CONFIG["ACTIVITY_FLUSH_SECONDS"],),
+            daemon=True
+        )
+        dedup_thread.start()
+
+        alert_thread = threading.Thread(target=alert_router.run, args=(60,), daemon=True)
+        alert_thread.start()
+
+    activity_thread = threading.Thread(
+        target=activity_tracker.run,
+        args=(CONFIG["ACTIVITY_FLUSH_SECONDS"],),
+        daemon=True
+    )
+    activity_thread.start()
+
+    notification_thread = threading.Thread(target=notification_digest.run, args=(1,), daemon=True)
+    notification_thread.start()
+
+    for _ in range(CONFIG["CALLBACK_ACK_THREADS"]):
+        threading.Thread(target=callback_acks.run, daemon=True).start()
+
+# Чат, к которому относится обновление (в исходном JSON от Bot API)
+def update_chat_id(update: Dict) -> int:
+    for kind in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if kind in update:
+            return update[kind]["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        if callback.get("message"):
+            return callback["message"]["chat"]["id"]
+        return callback["from"]["id"]
+    for payload in update.values():
+        if isinstance(payload, dict) and "from" in payload:
+            return payload["from"]["id"]
+    return 0
+
+# Процесс-обработчик: получает обновления своих чатов от супервизора и обрабатывает их
+# по очереди, сохраняя порядок внутри чата. Сброс кэша карточек заявок передается
+# супервизору, чтобы остальные процессы не показывали устаревшие данные
+def run_worker(index: int, inbox, events):
+    ticket_views.listeners.append(lambda ticket_id: events.put(("invalidate", ticket_id, index)))
+    bot.threaded = False
+    start_background_tasks(periodic=False)
+    start_metrics_server()
+    logger.info(f"Worker {index} started (pid {os.getpid()})")
+
+    while True:
+        kind, payload = inbox.get()
+        if kind == "stop":
+            break
+        if kind == "invalidate":
+            ticket_views.invalidate(payload, notify=False)
+            continue
+        try:
+            bot.process_new_updates([types.Update.de_json(payload)])
+        except Exception as e:
+            logger.error(f"Error processing update in worker {index}: {e}", exc_info=True)
+    logger.info(f"Worker {index} stopped")
+
+# Супервизор: получает обновления через long polling, распределяет их по процессам-обработчикам
+# по chat_id и перезапускает упавшие процессы
+class Supervisor:
+    def __init__(self, workers: int):
+        self.context = multiprocessing.get_context("spawn")
+        self.count = workers
+        self.inboxes = [self.context.Queue() for _ in range(workers)]
+        self.events = self.context.Queue()
+        self.processes = [None] * workers
+        self.stopping = False
+
+    def start_worker(self, index: int):
+        # Номер процесса читается при импорте модуля в дочернем процессе
+        os.environ["BOT_WORKER_INDEX"] = str(index)
+        try:
+            process = self.context.Process(
+                target=run_worker,
+                args=(index, self.inboxes[index], self.events),
+                name=f"bot-worker-{index}",
+                daemon=True
+            )
+            process.start()
+        finally:
+            del os.environ["BOT_WORKER_INDEX"]
+        self.processes[index] = process
+
+    def route(self, update: Dict):
+        index = update_chat_id(update) % self.count
+        self.inboxes[index].put(("update", update))
+        metrics.inc("bot_cluster_updates_total", {"worker": str(index)})
+
+    # Сброс карточки заявки в самом супервизоре (автозакрытие, архивирование) рассылается
+    # всем процессам-обработчикам
+    def broadcast_invalidate(self, ticket_id: str):
+        for inbox in self.inboxes:
+            inbox.put(("invalidate", ticket_id))
+
+    def forward_events(self):
+        while True:
+            kind, ticket_id, origin = self.events.get()
+            ticket_views.invalidate(ticket_id, notify=False)
+            for index, inbox in enumerate(self.inboxes):
+                if index != origin:
+                    inbox.put((kind, ticket_id))
+
+    def watch_workers(self):
+        while not self.stopping:
+            time.sleep(1)
+            for index, process in enumerate(self.processes):
+                if not self.stopping and not process.is_alive():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    metrics.inc("bot_cluster_worker_restarts_total", {"worker": str(index)})
+                    # Процесс мог завершиться, удерживая блокировку чтения очереди, поэтому
+                    # новый процесс получает новую очередь; не обработанные обновления теряются
+                    self.inboxes[index] = self.context.Queue()
+                    self.start_worker(index)
+
+    def stop(self):
+        self.stopping = True
+        for inbox in self.inboxes:
+            inbox.put(("stop", None))
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+
+    def run(self):
+        ticket_views.listeners.append(self.broadcast_invalidate)
+        for index in range(self.count):
+            self.start_worker(index)
+        threading.Thread(target=self.forward_events, name="cluster-events", daemon=True).start()
+        threading.Thread(target=self.watch_workers, name="cluster-watchdog", daemon=True).start()
+        metrics.gauge("bot_cluster_workers_alive", lambda: sum(
+            1 for process in self.processes if process is not None and process.is_alive()
+        ))
+        logger.info(f"Supervisor started with {self.count} workers")
+
+        offset = None
+        try:
+            while True:
+                try:
+                    updates = apihelper.get_updates(BOT_TOKEN, offset, 100, 25, None, 20)
+                except Exception as e:
+                    logger.error(f"Error getting updates: {e}")
+                    time.sleep(3)
+                    continue
+                for update in updates:
+                    offset = update["update_id"] + 1
+                    if not update_dedup.accept(update["update_id"]):
+                        metrics.inc("bot_duplicate_updates_total", {"kind": "update"})
+                        continue
+                    self.route(update)
+        finally:
+            self.stop()
+
 if __name__ == "__main__":
+    if "--enable-incremental-vacuum" in sys.argv[1:]:
+        # Выполняется при остановленном боте: VACUUM блокирует базу на все время работы
+        if storage.name != "sqlite":
+            print("Команда нужна только для SQLite")
+        elif enable_incremental_vacuum():
+            print("✅ База переведена в режим инкрементального VACUUM")
+        else:
+            print("ℹ️ База уже в режиме инкрементального VACUUM")
+        stop_logging(log_listener)
+        sys.exit(0)
+
     try:
         init_database()
+        update_dedup.load()
+        start_metrics_server()
         logger.info("Bot started successfully")
         print("✅ Бот запущен. Нажмите Ctrl+C для остановки")
-        
-        # Запуск периодических задач
-        def periodic_tasks():
-            while True:
-                try:
-                    auto_close_inactive_requests()
-                    time.sleep(3600)  # Проверка каждый час
-                except Exception as e:
-                    logger.error(f"Error in periodic tasks: {e}")
-                    time.sleep(60)
-        
-        import threading
-        periodic_thread = threading.Thread(target=periodic_tasks)
-        periodic_thread.daemon = True
-        periodic_thread.start()
-        
-        bot.polling(none_stop=True)
+
+        start_background_tasks()
+
+        if BOT_WORKERS > 1:
+            Supervisor(BOT_WORKERS).run()
+        else:
+            bot.polling(none_stop=True)
     except Exception as e:
         logger.error(f"Critical error: {e}")
         bot.stop_polling()